@@ -3,24 +3,135 @@ import numpy as np
 from collections import defaultdict
 from datetime import datetime, timedelta
 import json
+from data_ingestion import (normalize_source_timestamps, print_timestamp_report, load_datasets, print_load_report,
+                            validate_datasets, print_validation_report, QUARANTINE_PATH)
+from fuzzy_matching import FuzzyMatcher, extract_mentions, name_blocking_keys, email_blocking_keys, normalize_name, normalize_email_local
+from identity_graph import IdentityGraph, CO_OCCURRENCE_RULES, co_occurring_pairs
+from activity_store import ActivityStore, ActivityRefs, EntityActivitiesView, NAT, location_field, timestamps_to_isoformat
+
+# (dataset_name, id_field, activity_type) for every source linked to profiles
+LINKING_CONFIG = [
+    ('wifi_logs', 'device_hash', 'wifi_logs'),
+    ('campus_swipes', 'card_id', 'campus_swipes'),
+    ('library_check', 'entity_id', 'library_checkouts'),
+    ('lab_bookings', 'entity_id', 'lab_bookings'),
+    ('text_notes', 'entity_id', 'text_notes'),
+    ('face_vector', 'face_id', 'face_vectors'),
+    ('cctv_frame', 'face_id', 'cctv_frames')
+]
+
+# timestamp column for each activity type
+TIMESTAMP_FIELDS = {
+    'wifi_logs': 'timestamp',
+    'campus_swipes': 'timestamp',
+    'library_checkouts': 'timestamp',
+    'lab_bookings': 'start_time',
+    'text_notes': 'timestamp',
+    'cctv_frames': 'timestamp',
+    'face_vectors': 'timestamp'
+}
+
+# sources whose unlinked rows are searched for name / email mentions: (dataset_name, activity_type, fields, free text fields)
+FUZZY_MENTION_SOURCES = [
+    ('text_notes', 'text_notes', ['entity_id', 'name', 'email'], ['text'])
+]
+
+# minimum trigram similarity for a fuzzy mention match
+FUZZY_MATCH_THRESHOLDS = {
+    'name': 0.7,
+    'email': 0.8
+}
+
+# wifi devices no profile lists are linked to the entity whose resolved swipe / CCTV events they keep
+# appearing next to: at least min_support co-occurrences within max_seconds at one location, and at
+# least min_share of all the device's co-occurrences
+ORPHAN_DEVICE_LINKING = {
+    'source': ('wifi_logs', 'device_hash', 'wifi_logs'),
+    'evidence_sources': ['campus_swipes', 'cctv_frame'],
+    'max_seconds': 120,
+    'min_support': 5,
+    'min_share': 0.6
+}
+
+# access point -> location_id it covers; other access points are compared by their id without the AP_ prefix
+AP_LOCATIONS = {}
+
+def access_point_locations(ap_ids):
+    """Location each access point covers, per AP_LOCATIONS"""
+    ap_ids = pd.Series(ap_ids, dtype=object)
+    unique_ids = pd.Series(ap_ids.dropna().unique())
+    covered = {ap_id: AP_LOCATIONS.get(ap_id, ap_id[3:] if ap_id.startswith('AP_') else ap_id)
+               for ap_id in unique_ids.astype(str).tolist()}
+    return ap_ids.astype(str).map(covered).where(ap_ids.notna()).to_numpy(dtype=object)
+
+def concat_column(frames, field):
+    """One column over consecutive frames of a source; frames without it contribute nulls"""
+    columns = [frame[field] if field in frame.columns else pd.Series(None, index=frame.index, dtype=object)
+               for frame in frames]
+    return columns[0] if len(columns) == 1 else pd.concat(columns, ignore_index=True)
+
+# label (entity, timestamp)-sorted events with time-window group ids in one sweep;
+# a group is anchored at its first event and takes every later event of the same
+# entity within `window` of it
+def assign_time_window_groups(entity_codes, timestamps, window):
+    n = len(timestamps)
+    group_starts = np.zeros(n, dtype=bool)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    
+    boundaries = np.flatnonzero(np.diff(entity_codes)) + 1
+    segment_starts = np.concatenate(([0], boundaries))
+    segment_ends = np.concatenate((boundaries, [n]))
+    
+    for segment_start, segment_end in zip(segment_starts, segment_ends):
+        segment = timestamps[segment_start:segment_end]
+        position = 0
+        while position < len(segment):
+            group_starts[segment_start + position] = True
+            position = np.searchsorted(segment, segment[position] + window, side='right')
+    
+    return np.cumsum(group_starts) - 1
 
 class CompleteEntityResolver:
     def __init__(self, datasets):
         self.datasets = datasets
         self.entity_registry = {}
         self.id_to_entity = {}
-        self.entity_activities = defaultdict(lambda: defaultdict(list))
+        self.activity_store = ActivityStore(datasets)
+        for dataset_name, _, activity_type in LINKING_CONFIG:
+            self.activity_store.register_source(dataset_name, activity_type)
+        self.entity_activities = EntityActivitiesView(self.activity_store)
         self.cross_source_links = defaultdict(list)
         self.confidence_scores = {}
+        self.source_timestamps = {}
+        self.timestamp_report = {}
+        self.fuzzy_matchers = None
+        self.identity_graph = None
+        self.orphan_device_links = {}
+        self.identifier_conflicts = {}
+        self.identifier_table = None
+        self.validation_report = {}
     # pipeline for entity resolution    
     def resolve_all_entities_full_pipeline(self):
         
+        # Quarantine rows that fail validation
+        self._validate_sources()
+        
+        # Parse every source's timestamp column once
+        self._normalize_source_timestamps()
+        
         # Build entity maps from ALL profiles
         self._build_complete_entity_maps()
         
         # Link ALL activities across ALL datasets
         self._link_all_data_sources()
         
+        # Fuzzy match name / email mentions in rows left unlinked
+        self._link_fuzzy_mentions()
+        
+        # Link unknown wifi devices that keep showing up next to a known person
+        self._link_orphan_devices()
+        
         # Create cross-source relationships
         self._create_inferred_relationships()
         
@@ -31,97 +142,360 @@ class CompleteEntityResolver:
         clean_data = self._generate_clean_output()        
         return clean_data
     
+    # vectorized checks per source; failing rows are written to the quarantine file and never linked
+    def _validate_sources(self):
+        valid_datasets, self.validation_report = validate_datasets(self.datasets, quarantine_path=QUARANTINE_PATH)
+        self.datasets.update(valid_datasets)
+        print_validation_report(self.validation_report)
+    
+    # column-wise timestamp normalization for all linked sources; a source without a timestamp
+    # column is recorded as None so it is not normalized again
+    def _normalize_source_timestamps(self):
+        timestamp_fields = {dataset_name: TIMESTAMP_FIELDS[activity_type]
+                            for dataset_name, _, activity_type in LINKING_CONFIG}
+        self.source_timestamps, self.timestamp_report = normalize_source_timestamps(self.datasets, timestamp_fields)
+        for dataset_name in timestamp_fields:
+            self.source_timestamps.setdefault(dataset_name, None)
+        print_timestamp_report(self.timestamp_report)
+    
     # start with entity maping
     def _build_complete_entity_maps(self):        
         if 'profile' not in self.datasets:
             raise ValueError("Profile dataset not found")
         
+        # matchers are rebuilt from the new registry on first use
+        self.fuzzy_matchers = None
+        
         total_profiles = len(self.datasets['profile'])
         print(f"Processing {total_profiles} profiles")
         
-        for idx, person in self.datasets['profile'].iterrows():
-            entity_id = person['entity_id']
-            
-            # identifiers
-            identifiers = []
-            id_fields = ['student_id', 'staff_id', 'card_id', 'device_hash', 'face_id', 'email']
-            
-            for field in id_fields:
-                if field in person and pd.notna(person[field]):
-                    identifiers.append(str(person[field]))
-            
-            # Map ALL identifiers to this entity
-            for identifier in identifiers:
-                self.id_to_entity[identifier] = entity_id
-            
-            # Store complete entity info
-            self.entity_registry[entity_id] = {
-                'name': person.get('name', 'Unknown'),
-                'role': person.get('role', 'Unknown'),
-                'email': person.get('email', ''),
-                'department': person.get('department', ''),
-                'all_identifiers': identifiers,
-                'source': 'profile',
-                'resolution_method': 'direct_mapping'
-            }
+        self._index_profiles(['student_id', 'staff_id', 'card_id', 'device_hash', 'face_id', 'email'])
+        
+        self._build_identity_graph()
+    
+    # identifier map and registry built column-wise from the profile table
+    def _index_profiles(self, id_fields):
+        profiles = self.datasets['profile']
+        fields = [field for field in id_fields if field in profiles.columns]
+        entity_ids = profiles['entity_id'].to_numpy(dtype=object)
+        
+        # non-null identifiers in row then field order, the order a row-by-row scan visits them
+        present = np.zeros((len(profiles), len(fields)), dtype=bool)
+        values = np.empty((len(profiles), len(fields)), dtype=object)
+        for column, field in enumerate(fields):
+            present[:, column] = profiles[field].notna().to_numpy()
+            values[:, column] = profiles[field].astype(str).to_numpy(dtype=object)
+        identifiers = values[present].tolist()
+        counts = present.sum(axis=1)
+        identifier_entities = np.repeat(entity_ids, counts).tolist()
+        
+        # later profiles win shared identifiers, keys keep their first-seen order
+        self.id_to_entity.update(zip(identifiers, identifier_entities))
+        self._report_identifier_conflicts(identifiers, identifier_entities)
+        
+        def column_values(field, default):
+            return profiles[field].tolist() if field in profiles.columns else [default] * len(profiles)
+        
+        offsets = np.concatenate(([0], np.cumsum(counts))).tolist()
+        rows = zip(entity_ids.tolist(), column_values('name', 'Unknown'), column_values('role', 'Unknown'),
+                   column_values('email', ''), column_values('department', ''), offsets[:-1], offsets[1:])
+        self.entity_registry.update((entity_id, {
+            'name': name,
+            'role': role,
+            'email': email,
+            'department': department,
+            'all_identifiers': identifiers[start:end],
+            'source': 'profile',
+            'resolution_method': 'direct_mapping'
+        }) for entity_id, name, role, email, department, start, end in rows)
+    
+    def _report_identifier_conflicts(self, identifiers, entity_ids, limit=5):
+        """Identifiers listed by more than one profile, found and reported in one pass"""
+        pairs = pd.DataFrame({'identifier': identifiers, 'entity_id': entity_ids}).drop_duplicates()
+        shared = pairs[pairs['identifier'].duplicated(keep=False)]
+        self.identifier_conflicts = shared.groupby('identifier', sort=False)['entity_id'].agg(list).to_dict()
+        if not self.identifier_conflicts:
+            return
+        
+        print(f"Identifier conflicts: {len(self.identifier_conflicts)} identifiers listed by more than one profile "
+              f"(the last profile keeps them)")
+        for identifier, conflicting in list(self.identifier_conflicts.items())[:limit]:
+            print(f"   {identifier}: {', '.join(str(entity_id) for entity_id in conflicting)}")
+    
+    # identifier clusters from the profiles plus co-occurrence evidence in the logs
+    def _build_identity_graph(self):
+        self.identifier_table = None
+        entity_identifiers = [(entity_id, identifier) for entity_id, info in self.entity_registry.items()
+                              for identifier in info['all_identifiers']]
+        self.identity_graph = IdentityGraph(entity_identifiers)
+        
+        for rule in CO_OCCURRENCE_RULES:
+            left, right, support = self._co_occurring_identifiers(rule)
+            strong = np.flatnonzero(support >= rule['min_support'])
+            self.identity_graph.add_evidence([left[i] for i in strong], [right[i] for i in strong], support[strong])
+        
+        self.identity_graph.print_report()
+    
+    def _co_occurring_identifiers(self, rule):
+        """(left ids, right ids, support) of identifier pairs seen at one location within the rule's window"""
+        activity_types = {dataset_name: activity_type for dataset_name, _, activity_type in LINKING_CONFIG}
+        sides = []
+        for dataset_name, field in (rule['left'], rule['right']):
+            pieces = self._source_pieces(dataset_name, activity_types[dataset_name])
+            frames = [frame for _, frame, _ in pieces]
+            location = location_field(frames[0]) if frames else None
+            if location is None or field not in frames[0].columns:
+                return [], [], np.zeros(0, dtype=np.int64)
             
-    def _link_all_data_sources(self):
+            values, locations = concat_column(frames, field), concat_column(frames, location)
+            timestamps = np.concatenate([timestamps for _, _, timestamps in pieces])
+            usable = np.flatnonzero((timestamps != NAT) & values.notna().to_numpy() & locations.notna().to_numpy())
+            sides.append((locations.astype(str).to_numpy()[usable], timestamps[usable], values.astype(str).to_numpy()[usable]))
         
-        linking_config = [
-            ('wifi_logs', 'device_hash', 'wifi_logs'),
-            ('campus_swipes', 'card_id', 'campus_swipes'),
-            ('library_check', 'entity_id', 'library_checkouts'),
-            ('lab_bookings', 'entity_id', 'lab_bookings'),
-            ('text_notes', 'entity_id', 'text_notes'),
-            ('face_vector', 'face_id', 'face_vectors'),
-            ('cctv_frame', 'face_id', 'cctv_frames')
-        ]
+        return co_occurring_pairs(*sides[0], *sides[1], rule['max_seconds'] * 1_000_000_000)
+    
+    def _source_pieces(self, dataset_name, activity_type):
+        """(first store row, frame, int64 timestamps) of each consecutive piece of a source: the loaded frame"""
+        df = self.datasets.get(dataset_name)
+        if df is None:
+            return []
+        return [(0, df, self._get_source_timestamps(dataset_name, activity_type, np.arange(len(df))))]
+    
+    def _add_source_rows(self, dataset_name, activity_type, entity_ids, rows, confidence, provenance):
+        """Add activities for store rows of a source, whichever of its pieces they fall in"""
+        confidence = np.broadcast_to(np.asarray(confidence, dtype=np.float64), len(rows))
+        linked_count = 0
+        for start, frame, timestamps in self._source_pieces(dataset_name, activity_type):
+            selected = np.flatnonzero((rows >= start) & (rows < start + len(frame)))
+            local_rows = rows[selected] - start
+            linked_count += self.activity_store.add(dataset_name, activity_type, entity_ids[selected], local_rows,
+                                                    timestamps[local_rows], confidence[selected], provenance,
+                                                    frame=frame, row_offset=start)
+        return linked_count
+    
+    # columnar linking: join each source's id column against the identifier table
+    def _link_all_data_sources(self):
         
         total_linked = 0
-        for dataset_name, id_field, activity_type in linking_config:
+        for dataset_name, id_field, activity_type in LINKING_CONFIG:
             if dataset_name in self.datasets:
                 df = self.datasets[dataset_name]
                 print(f"Processing {len(df)} records from {dataset_name}")
                 
-                linked_count = 0
-                for _, record in df.iterrows():
-                    identifier = record.get(id_field)
-                    entity_id = self._find_entity(identifier, id_field)
-                    
-                    if entity_id:
-                        self.entity_activities[entity_id][activity_type].append({
-                            'record': record.to_dict(),
-                            'source': dataset_name,
-                            'confidence': 1.0,
-                            'provenance': f"direct_{id_field}_match",
-                            'timestamp': self._extract_timestamp(record, activity_type)
-                        })
-                        linked_count += 1
+                if id_field in df.columns:
+                    entity_ids = self._join_entity_ids(df[id_field])
+                    linked_count = self._add_linked_activities(df, entity_ids, dataset_name, id_field, activity_type)
+                else:
+                    linked_count = 0
                 
                 total_linked += linked_count
                 print(f"Linked {linked_count}/{len(df)} records from {dataset_name}")
         
         print(f"Total linked activities: {total_linked}")
     
-    def _create_inferred_relationships(self):
-        cross_link_count = 0
-        for entity_id in self.entity_registry.keys():
-            # Get ALL activities for this entity
-            all_activities = self._get_all_timestamped_activities(entity_id)
+    def _build_identifier_table(self):
+        """Build the identifier -> entity lookup table used by the columnar join, once per map build"""
+        if self.identifier_table is not None:
+            return self.identifier_table
+        
+        # identifiers only the identity graph places, same answer as _find_entity
+        extra = {}
+        if self.identity_graph is not None:
+            extra = {identifier: entity_id for identifier, entity_id in self.identity_graph.resolved_identifiers().items()
+                     if identifier not in self.id_to_entity}
+        
+        identifiers = pd.Index(list(self.id_to_entity.keys()) + list(extra.keys()), dtype=object)
+        entities = np.array(list(self.id_to_entity.values()) + list(extra.values()), dtype=object)
+        self.identifier_table = (identifiers, entities)
+        return self.identifier_table
+    
+    def _join_entity_ids(self, id_values):
+        """Resolve a whole id column at once; unmatched rows get None"""
+        identifiers, entities = self._build_identifier_table()
+        entity_ids = np.full(len(id_values), None, dtype=object)
+        
+        present = id_values.notna().to_numpy()
+        if not present.any() or len(identifiers) == 0:
+            return entity_ids
+        
+        keys = id_values[present].astype(str).to_numpy()
+        positions = identifiers.get_indexer(keys)
+        found = positions >= 0
+        
+        present_rows = np.flatnonzero(present)
+        entity_ids[present_rows[found]] = entities[positions[found]]
+        return entity_ids
+    
+    def _add_linked_activities(self, df, entity_ids, dataset_name, id_field, activity_type):
+        """Append one activity per linked row and return how many rows were linked"""
+        matched_rows = np.flatnonzero(pd.notna(entity_ids))
+        timestamps = self._get_source_timestamps(dataset_name, activity_type, matched_rows)
+        
+        return self.activity_store.add(dataset_name, activity_type, entity_ids[matched_rows], matched_rows,
+                                       timestamps, 1.0, f"direct_{id_field}_match")
+    
+    def _link_fuzzy_mentions(self):
+        total_linked = 0
+        for dataset_name, activity_type, fields, text_fields in FUZZY_MENTION_SOURCES:
+            if dataset_name not in self.datasets:
+                continue
             
-            # Group by time windows (activities within 30 minutes)
-            time_groups = self._group_by_time_windows(all_activities)
+            df = self.datasets[dataset_name]
+            store = self.activity_store
+            linked = np.zeros(len(df), dtype=bool)
+            linked[store.column('row')[store.column('source') == store.register_source(dataset_name, activity_type)]] = True
             
-            # Create cross-source links for each time group
-            for time_group in time_groups:
-                if len(time_group) >= 2:  
-                    self._create_cross_source_evidence(entity_id, time_group)
-                    cross_link_count += 1
+            matches = self._match_fuzzy_mentions(df, np.flatnonzero(~linked), fields, text_fields)
+            for provenance, (rows, entity_ids, scores) in matches.items():
+                timestamps = self._get_source_timestamps(dataset_name, activity_type, rows)
+                total_linked += store.add(dataset_name, activity_type, entity_ids, rows, timestamps, scores, provenance)
+        
+        print(f"Fuzzy matched {total_linked} name/email mentions")
+    
+    def _link_orphan_devices(self):
+        dataset_name, id_field, activity_type = ORPHAN_DEVICE_LINKING['source']
+        proposal = self._propose_orphan_device_links()
+        if proposal is None:
+            return 0
+        
+        rows, entity_ids, shares, device_count = proposal
+        linked_count = self._add_source_rows(dataset_name, activity_type, entity_ids, rows, shares,
+                                             f"co_occurrence_{id_field}_match")
+        print(f"Orphan devices: {len(self.orphan_device_links)} of {device_count} linked by co-occurrence, "
+              f"{linked_count} events")
+        return linked_count
+    
+    # (store rows, entity ids, shares, orphan device count) of every event of a device no profile lists
+    # that clears the co-occurrence thresholds; rows linked by an earlier run of this step count as orphans
+    def _propose_orphan_device_links(self):
+        dataset_name, id_field, activity_type = ORPHAN_DEVICE_LINKING['source']
+        self.orphan_device_links = {}
+        pieces = self._source_pieces(dataset_name, activity_type)
+        frames = [frame for _, frame, _ in pieces]
+        if not frames or id_field not in frames[0].columns or location_field(frames[0]) is None:
+            return None
+        
+        store = self.activity_store
+        sources = store.column('source')
+        device_values = concat_column(frames, id_field)
+        own = sources == store.register_source(dataset_name, activity_type)
+        provenance = f"co_occurrence_{id_field}_match"
+        if provenance in store.provenance_codes:
+            own &= store.column('provenance') != store.provenance_codes[provenance]
+        linked = np.zeros(len(device_values), dtype=bool)
+        linked[store.column('row')[own]] = True
+        timestamps = np.concatenate([timestamps for _, _, timestamps in pieces])
+        orphans = np.flatnonzero(~linked & device_values.notna().to_numpy() & (timestamps != NAT))
+        
+        # resolved events of the evidence sources, with their entity
+        activity_types = {name: source_activity_type for name, _, source_activity_type in LINKING_CONFIG}
+        evidence_codes = [store.register_source(name, activity_types[name]) for name in ORPHAN_DEVICE_LINKING['evidence_sources']]
+        locations = store.column('location')
+        evidence = np.flatnonzero(np.isin(sources, evidence_codes) & (store.column('timestamp') != NAT)
+                                  & store.location_mask(locations))
+        if len(orphans) == 0 or len(evidence) == 0:
+            print("Orphan devices: nothing to link")
+            return None
+        
+        devices = device_values.astype(str).to_numpy()[orphans]
+        device_locations = access_point_locations(concat_column(frames, location_field(frames[0])).to_numpy()[orphans])
+        devices_found, entity_ids, support = co_occurring_pairs(
+            device_locations, timestamps[orphans], devices,
+            store.location_values(locations[evidence]).astype(str), store.column('timestamp')[evidence],
+            np.array(store.entity_ids, dtype=object)[store.column('entity')[evidence]],
+            ORPHAN_DEVICE_LINKING['max_seconds'] * 1_000_000_000)
+        
+        # strongest entity per device, kept when it clears both thresholds
+        pairs = pd.DataFrame({'device': devices_found, 'entity_id': entity_ids, 'support': support})
+        pairs['share'] = pairs['support'] / pairs.groupby('device', sort=False)['support'].transform('sum')
+        best = pairs.sort_values(['device', 'support'], ascending=[True, False], kind='stable').drop_duplicates('device')
+        best = best[(best['support'] >= ORPHAN_DEVICE_LINKING['min_support']) & (best['share'] >= ORPHAN_DEVICE_LINKING['min_share'])]
+        self.orphan_device_links = {device: {'entity_id': entity_id, 'support': int(count), 'share': float(share)}
+                                    for device, entity_id, count, share in best.itertuples(index=False)}
+        
+        # every event of a linked device becomes an activity of its entity, with the share as confidence
+        best = best.set_index('device')
+        proposed = pd.Series(devices).map(best['entity_id']).to_numpy(dtype=object)
+        matched = pd.notna(proposed)
+        shares = pd.Series(devices[matched]).map(best['share']).to_numpy(dtype=np.float64)
+        return orphans[matched], proposed[matched], shares, len(np.unique(devices))
+    
+    def _build_fuzzy_matchers(self):
+        """Name and email-local-part matchers over the registered profiles"""
+        names, name_entities, emails, email_entities = [], [], [], []
+        for entity_id, profile in self.entity_registry.items():
+            name = normalize_name(profile['name']) if pd.notna(profile.get('name')) else None
+            if name:
+                names.append(name)
+                name_entities.append(entity_id)
+            local = normalize_email_local(profile['email']) if pd.notna(profile.get('email')) else None
+            if local:
+                emails.append(local)
+                email_entities.append(entity_id)
+        
+        self.fuzzy_matchers = {
+            'name': FuzzyMatcher(names, name_entities, name_blocking_keys),
+            'email': FuzzyMatcher(emails, email_entities, email_blocking_keys)
+        }
+    
+    def _match_fuzzy_mentions(self, df, rows, fields, text_fields):
+        """provenance -> (rows, entity ids, similarity scores) for rows whose best mention clears its threshold"""
+        mentions = extract_mentions(df, rows, fields, text_fields)
+        if len(mentions) == 0:
+            return {}
+        if self.fuzzy_matchers is None:
+            self._build_fuzzy_matchers()
+        
+        # every distinct mention is matched once
+        mentions['entity_id'] = None
+        mentions['score'] = 0.0
+        for kind, matcher in self.fuzzy_matchers.items():
+            selected = (mentions['kind'] == kind).to_numpy()
+            values, inverse = np.unique(mentions['value'].to_numpy()[selected].astype(str), return_inverse=True)
+            labels, scores = matcher.match(values)
+            scores[scores < FUZZY_MATCH_THRESHOLDS[kind]] = 0.0
+            mentions.loc[selected, 'entity_id'] = labels[inverse]
+            mentions.loc[selected, 'score'] = scores[inverse]
+        
+        # best scoring mention per row, first mention on ties
+        mentions = mentions[mentions['score'] > 0]
+        best = mentions.sort_values(['row', 'score'], ascending=[True, False], kind='stable').drop_duplicates('row')
+        
+        matches = {}
+        for kind in FUZZY_MATCH_THRESHOLDS:
+            selected = best[best['kind'] == kind]
+            if len(selected):
+                matches[f"fuzzy_{kind}_match"] = (selected['row'].to_numpy(dtype=np.int64),
+                                                  selected['entity_id'].to_numpy(dtype=object),
+                                                  selected['score'].to_numpy(dtype=np.float64))
+        return matches
+    
+    def _create_inferred_relationships(self, entity_ids=None):
+        cross_link_count = 0
+        
+        # relinking a subset of entities replaces their existing links
+        if entity_ids is None:
+            entity_ids = self.entity_registry.keys()
+        else:
+            for entity_id in entity_ids:
+                self.cross_source_links.pop(entity_id, None)
+        
+        # Group ALL entities' activities by time windows (activities within 30 minutes)
+        entity_time_groups = self._group_all_by_time_windows(entity_ids=entity_ids)
+        
+        # only groups with activities from at least two records become links
+        linked_groups = [(entity_id, time_group) for entity_id in entity_ids
+                         for time_group in entity_time_groups.get(entity_id, []) if len(time_group) >= 2]
+        
+        # Create cross-source links for each time group, referencing the activities in the store
+        for entity_id, time_group in linked_groups:
+            self._create_cross_source_evidence(entity_id, ActivityRefs(self.activity_store, time_group))
+            cross_link_count += 1
         
         print(f" Created {cross_link_count} cross-source relationships")
     
-    def _perform_multi_modal_fusion(self):        
-        for entity_id in self.entity_registry.keys():
+    def _perform_multi_modal_fusion(self, entity_ids=None):        
+        for entity_id in (self.entity_registry.keys() if entity_ids is None else entity_ids):
             # Collect evidence from ALL sources
             evidence = self._collect_all_evidence_types(entity_id)
             
@@ -132,7 +506,7 @@ class CompleteEntityResolver:
                 'final_confidence': final_confidence,
                 'evidence_breakdown': {
                     'source_count': len(evidence),
-                    'activity_count': sum(len(activities) for activities in self.entity_activities[entity_id].values()),
+                    'activity_count': self.activity_store.entity_count(entity_id),
                     'cross_links_count': len(self.cross_source_links.get(entity_id, []))
                 },
                 'provenance': 'multi_modal_fusion'
@@ -157,7 +531,7 @@ class CompleteEntityResolver:
             entity_data = {
                 'profile': self.entity_registry[entity_id],
                 'activities': self._get_structured_activities(entity_id),
-                'cross_source_evidence': self.cross_source_links.get(entity_id, []),
+                'cross_source_evidence': self._serialize_cross_links(entity_id),
                 'confidence': self.confidence_scores.get(entity_id, {}),
                 'behavioral_summary': self._generate_behavioral_summary(entity_id)
             }
@@ -165,54 +539,75 @@ class CompleteEntityResolver:
         
         return clean_output
     
+    def _serialize_cross_links(self, entity_id):
+        """Cross links for output; their activities are (activity_type, index into the entity's
+        activities of that type) pairs instead of activity copies"""
+        cross_links = self.cross_source_links.get(entity_id, [])
+        if not any(isinstance(link['activities'], ActivityRefs) for link in cross_links):
+            return cross_links
+        
+        index = self.activity_store.entity_activity_index(entity_id)
+        serialized = []
+        for link in cross_links:
+            if isinstance(link['activities'], ActivityRefs):
+                link = dict(link, activities=link['activities'].references(index))
+            serialized.append(link)
+        return serialized
+    
     def _get_structured_activities(self, entity_id):
         """Get all activities in structured format for pattern analysis"""
-        structured = {}
+        store = self.activity_store
+        columns = store.entity_columns(entity_id)
         
-        for activity_type, activities in self.entity_activities[entity_id].items():
-            structured[activity_type] = []
-            for activity in activities:
-                structured[activity_type].append({
-                    'timestamp': activity['timestamp'].isoformat() if activity['timestamp'] else None,
-                    'location': self._extract_location(activity['record'], activity_type),
-                    'details': activity['record'],
-                    'confidence': activity['confidence'],
-                    'source': activity['source']
-                })
+        timestamps = timestamps_to_isoformat(columns['timestamp'])
+        timestamps[columns['timestamp'] == NAT] = None
+        locations = store.location_values(columns['location'])
+        records = store.records(columns['position'])
         
-        return structured
+        structured = {}
+        for position in range(len(records)):
+            dataset_name, activity_type = store.sources[columns['source'][position]]
+            structured.setdefault(activity_type, []).append({
+                'timestamp': timestamps[position],
+                'location': locations[position],
+                'details': records[position],
+                'confidence': float(columns['confidence'][position]),
+                'source': dataset_name
+            })
+        
+        # activity types in first-linked order, each list in insertion order
+        return {activity_type: structured[activity_type] for activity_type in store.activity_types(entity_id)}
     
     def _generate_behavioral_summary(self, entity_id):
         """Generate behavioral summary for pattern recognition"""
-        activities = self.entity_activities[entity_id]
+        store = self.activity_store
+        columns = store.entity_columns(entity_id)
         
         # Extract location sequences
-        locations = []
-        timestamps = []
-        
-        for activity_type, activity_list in activities.items():
-            for activity in activity_list:
-                if activity['timestamp']:
-                    location = self._extract_location(activity['record'], activity_type)
-                    if location:
-                        locations.append(location)
-                        timestamps.append(activity['timestamp'])
-        
-        # Sort by timestamp
-        if timestamps:
-            sorted_data = sorted(zip(timestamps, locations))
-            locations_sequence = [loc for _, loc in sorted_data]
+        located = (columns['timestamp'] != NAT) & store.location_mask(columns['location'])
+        timestamps = columns['timestamp'][located]
+        location_codes = columns['location'][located]
+        
+        # Sort by timestamp, then location (same order as sorting (timestamp, location) pairs);
+        # numeric location ids rank before names so sources mixing the two still sort
+        if len(timestamps):
+            unique_codes = np.unique(location_codes)
+            location_rank = np.zeros(unique_codes.max() + 1, dtype=np.int64)
+            location_rank[sorted(unique_codes, key=lambda code: (isinstance(store.locations[code], str), store.locations[code]))] = \
+                np.arange(len(unique_codes))
+            order = np.lexsort((location_rank[location_codes], timestamps))
+            locations_sequence = store.location_values(location_codes[order]).tolist()
         else:
             locations_sequence = []
         
         return {
-            'total_activities': sum(len(act_list) for act_list in activities.values()),
-            'unique_locations': len(set(locations)),
+            'total_activities': len(columns['position']),
+            'unique_locations': len(np.unique(location_codes)),
             'location_sequence': locations_sequence,
-            'activity_types': list(activities.keys()),
+            'activity_types': store.activity_types(entity_id),
             'time_range': {
-                'first_activity': min(timestamps).isoformat() if timestamps else None,
-                'last_activity': max(timestamps).isoformat() if timestamps else None
+                'first_activity': pd.Timestamp(timestamps.min()).isoformat() if len(timestamps) else None,
+                'last_activity': pd.Timestamp(timestamps.max()).isoformat() if len(timestamps) else None
             }
         }
     
@@ -222,51 +617,82 @@ class CompleteEntityResolver:
         if pd.isna(identifier):
             return None
         
-        entity_id = self.id_to_entity.get(str(identifier))
-        return entity_id
+        # the identifier's cluster decides; shared identifiers whose cluster spans several
+        # entities keep the profile mapping
+        identifier = str(identifier)
+        if self.identity_graph is not None:
+            entity_id = self.identity_graph.entity_of(identifier)
+            if entity_id is not None:
+                return entity_id
+        
+        return self.id_to_entity.get(identifier)
     
     def _get_all_timestamped_activities(self, entity_id):
         """Get all activities with timestamps for an entity"""
-        all_activities = []
-        
-        for activity_type, activities in self.entity_activities[entity_id].items():
-            for activity in activities:
-                if activity['timestamp']:
-                    all_activities.append(activity)
-        
-        return all_activities
+        positions = self.activity_store.entity_positions(entity_id)
+        timed = self.activity_store.column('timestamp')[positions] != NAT
+        return self.activity_store.materialize(positions[timed])
     
     def _group_by_time_windows(self, activities, window_minutes=30):
         """Group activities by time windows"""
         if not activities:
             return []
         
+        window = pd.Timedelta(minutes=window_minutes)
         time_groups = []
         sorted_activities = sorted(activities, key=lambda x: x['timestamp'])
         
+        # group starts are more than a window apart, so only the newest group can take the activity
         for activity in sorted_activities:
-            placed = False
-            for group in time_groups:
-                time_diff = abs((activity['timestamp'] - group[0]['timestamp']).total_seconds() / 60)
-                if time_diff <= window_minutes:
-                    group.append(activity)
-                    placed = True
-                    break
-            
-            if not placed:
+            if time_groups and activity['timestamp'] - time_groups[-1][0]['timestamp'] <= window:
+                time_groups[-1].append(activity)
+            else:
                 time_groups.append([activity])
         
         return time_groups
     
+    def _group_all_by_time_windows(self, window_minutes=30, entity_ids=None):
+        """Group every entity's (or only the given entities') timestamped activities over one sorted
+        (entity, timestamp) array; returns entity_id -> list of groups, each an array of activity store positions"""
+        store = self.activity_store
+        timestamps = store.column('timestamp')
+        entities = store.column('entity')
+        
+        if entity_ids is None:
+            positions = np.arange(len(store))
+        else:
+            positions = np.concatenate([store.entity_positions(entity_id) for entity_id in entity_ids]
+                                       + [np.zeros(0, dtype=np.int64)])
+        timed = positions[timestamps[positions] != NAT]
+        if len(timed) == 0:
+            return {}
+        
+        # equal timestamps keep the source, row order a full build links them in
+        order = timed[np.lexsort((store.column('row')[timed], store.column('source')[timed],
+                                  timestamps[timed], entities[timed]))]
+        group_ids = assign_time_window_groups(entities[order], timestamps[order],
+                                              pd.Timedelta(minutes=window_minutes).value)
+        
+        entity_time_groups = defaultdict(list)
+        for group in np.split(order, np.flatnonzero(np.diff(group_ids)) + 1):
+            entity_time_groups[store.entity_ids[entities[group[0]]]].append(group)
+        
+        return entity_time_groups
+    
     def _create_cross_source_evidence(self, entity_id, related_activities):
-        """Create cross-source evidence chain"""
-        sources = list(set(act['source'] for act in related_activities))
+        """Create cross-source evidence chain; related_activities is activity dicts or ActivityRefs into the store"""
+        if isinstance(related_activities, ActivityRefs):
+            sources = list(set(related_activities.source_names()))
+            timestamp = related_activities.first_timestamp()
+        else:
+            sources = list(set(act['source'] for act in related_activities))
+            timestamp = related_activities[0]['timestamp']
         
         cross_link = {
             'type': 'temporal_correlation',
             'sources': sources,
             'activities': related_activities,
-            'timestamp': related_activities[0]['timestamp'],
+            'timestamp': timestamp,
             'confidence': min(0.9, 0.7 + (len(sources) * 0.05)),  # More sources = higher confidence
             'provenance': 'inferred_temporal_pattern',
             'description': f"Activities from {len(sources)} sources within 30 minutes"
@@ -276,24 +702,25 @@ class CompleteEntityResolver:
     
     def _extract_timestamp(self, record, activity_type):
         """Extract timestamp from record"""
-        timestamp_fields = {
-            'wifi_logs': 'timestamp',
-            'campus_swipes': 'timestamp',
-            'library_checkouts': 'timestamp',
-            'lab_bookings': 'start_time',
-            'text_notes': 'timestamp',
-            'cctv_frames': 'timestamp',
-            'face_vectors': 'timestamp'
-        }
-        
-        field = timestamp_fields.get(activity_type)
+        field = TIMESTAMP_FIELDS.get(activity_type)
         if field and field in record and pd.notna(record[field]):
             try:
                 return pd.to_datetime(record[field])
-            except:
+            except (ValueError, TypeError, OverflowError):
                 return None
         return None
     
+    def _get_source_timestamps(self, dataset_name, activity_type, rows):
+        """Ready-made int64 epoch-ns timestamps for the given source rows; missing or unparseable become NAT"""
+        if dataset_name not in self.source_timestamps:
+            self._normalize_source_timestamps()
+            self.source_timestamps.setdefault(dataset_name, None)
+        
+        if self.source_timestamps[dataset_name] is None:
+            return np.full(len(rows), NAT, dtype=np.int64)
+        
+        return pd.DatetimeIndex(self.source_timestamps[dataset_name]).asi8[rows]
+    
     def _extract_location(self, record, activity_type):
         """Extract location from record"""
         if 'location_id' in record:
@@ -306,10 +733,7 @@ class CompleteEntityResolver:
     
     def _collect_all_evidence_types(self, entity_id):
         """Collect all evidence types for an entity"""
-        evidence_types = set()
-        
-        for activity_type in self.entity_activities[entity_id].keys():
-            evidence_types.add(activity_type)
+        evidence_types = set(self.activity_store.activity_types(entity_id))
         
         if self.cross_source_links.get(entity_id):
             evidence_types.add('cross_source')
@@ -327,28 +751,29 @@ class CompleteEntityResolver:
     
     def _count_total_activities(self):
         """Count total activities across all entities"""
-        total = 0
-        for entity_acts in self.entity_activities.values():
-            for activity_list in entity_acts.values():
-                total += len(activity_list)
-        return total
+        return len(self.activity_store)
     
     def _count_cross_links(self):
         """Count total cross-source links"""
         return sum(len(links) for links in self.cross_source_links.values())
 
 
+# raw CSV path of every source
+DATASET_PATHS = {
+    'profile': '/content/student or staff profiles.csv',
+    'wifi_logs': '/content/wifi_associations_logs.csv',
+    'campus_swipes': '/content/campus card_swipes.csv',
+    'library_check': '/content/library_checkouts.csv',
+    'lab_bookings': '/content/lab_bookings.csv',
+    'text_notes': '/content/free_text_notes (helpdesk or RSVPs).csv',
+    'face_vector': '/content/face_embeddings.csv',
+    'cctv_frame': '/content/cctv_frames.csv'
+}
+
 def load_all_datasets():    
-    datasets = {}
     try:
-        datasets['profile'] = pd.read_csv('/content/student or staff profiles.csv')
-        datasets['wifi_logs'] = pd.read_csv('/content/wifi_associations_logs.csv')
-        datasets['campus_swipes'] = pd.read_csv('/content/campus card_swipes.csv')
-        datasets['library_check'] = pd.read_csv('/content/library_checkouts.csv')
-        datasets['lab_bookings'] = pd.read_csv('/content/lab_bookings.csv')
-        datasets['text_notes'] = pd.read_csv('/content/free_text_notes (helpdesk or RSVPs).csv')
-        datasets['face_vector'] = pd.read_csv('/content/face_embeddings.csv')
-        datasets['cctv_frame'] = pd.read_csv('/content/cctv_frames.csv')
+        datasets, load_report = load_datasets(DATASET_PATHS)
+        print_load_report(load_report)
         
         print("All datasets loaded successfully")
         return datasets
@@ -1,23 +1,39 @@
 import json
+import zlib
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import joblib
 import pandas as pd
 import numpy as np
 from collections import defaultdict
-from EntityResolver import CompleteEntityResolver
+from EntityResolver import CompleteEntityResolver, LINKING_CONFIG, TIMESTAMP_FIELDS, FUZZY_MENTION_SOURCES, ORPHAN_DEVICE_LINKING
+from identity_graph import CO_OCCURRENCE_RULES
+from data_ingestion import (parse_timestamp_column, load_datasets, print_load_report, validate_source, quarantine_rows,
+                            QUARANTINE_PATH)
+from negative_cache import NegativeCache
+from entity_map_writer import EntityMapWriter
+from entity_db import EntityDatabaseWriter
+from event_log import write_event_log
+from face_index import FaceEmbeddingIndex, EMBEDDING_COLUMN, embedding_columns, parse_embeddings
+from activity_store import EntityActivitiesView, NAT, timestamps_to_isoformat, hour_of, weekday_of, ordered_counts, grouped_ordered_counts, group_bounds
 
 #load raw data
+# raw CSV path of every source
+DATASET_PATHS = {
+    'profile': 'RAW_Data_folder\\student or staff profiles.csv',
+    'wifi_logs': 'RAW_Data_folder\\wifi_associations_logs.csv',
+    'campus_swipes': 'RAW_Data_folder\\campus card_swipes.csv',
+    'library_check': 'RAW_Data_folder\\library_checkouts.csv',
+    'lab_bookings': 'RAW_Data_folder\\lab_bookings.csv',
+    'text_notes': 'RAW_Data_folder/free_text_notes (helpdesk or RSVPs).csv',
+    'face_vector': 'RAW_Data_folder/face_embeddings.csv',
+    'cctv_frame': 'RAW_Data_folder\\cctv_frames.csv'
+}
+
 def load_all_datasets():
-    datasets = {}
-    
     try:
-        datasets['profile'] = pd.read_csv('RAW_Data_folder\student or staff profiles.csv')
-        datasets['wifi_logs'] = pd.read_csv('RAW_Data_folder\wifi_associations_logs.csv')
-        datasets['campus_swipes'] = pd.read_csv('RAW_Data_folder\campus card_swipes.csv')
-        datasets['library_check'] = pd.read_csv('RAW_Data_folder\library_checkouts.csv')
-        datasets['lab_bookings'] = pd.read_csv('RAW_Data_folder\lab_bookings.csv')
-        datasets['text_notes'] = pd.read_csv('RAW_Data_folder/free_text_notes (helpdesk or RSVPs).csv')
-        datasets['face_vector'] = pd.read_csv('RAW_Data_folder/face_embeddings.csv')
-        datasets['cctv_frame'] = pd.read_csv('RAW_Data_folder\cctv_frames.csv')
+        datasets, load_report = load_datasets(DATASET_PATHS)
+        print_load_report(load_report)
         
         print("all datasets load successfully!")
     except Exception as e:
@@ -26,12 +42,50 @@ def load_all_datasets():
     
     return datasets
 
+# fields kept in activity_timeline details, per activity type
+DETAIL_FIELDS = {
+    'wifi_logs': ['device_hash', 'ap_id', 'timestamp'],
+    'campus_swipes': ['card_id', 'location_id', 'timestamp'],
+    'library_checkouts': ['book_id', 'timestamp'],
+    'lab_bookings': ['room_id', 'start_time', 'end_time'],
+    'text_notes': ['category', 'text', 'timestamp'],
+    'face_vectors': ['face_id', 'timestamp'],
+    'cctv_frames': ['frame_id', 'location_id', 'timestamp']
+}
+
+# n-gram length for the substring index over identifiers
+IDENTIFIER_NGRAM_SIZE = 3
+
+# sources whose rows can also be linked by face embedding similarity
+FACE_LINKED_SOURCES = ['cctv_frame']
+
+# cosine similarity a frame needs to its best gallery face to be linked
+FACE_MATCH_THRESHOLD = 0.85
+
+# galleries at least this large are searched with the approximate (ivf) index
+FACE_INDEX_IVF_MIN_SIZE = 100000
+
 # entity mapping using all identifier from profile
 class CompleteFixedEntityResolver(CompleteEntityResolver):
+    def __init__(self, datasets):
+        super().__init__(datasets)
+        self.identifier_keys = []
+        self.identifier_positions = {}
+        self.lowercase_index = {}
+        self.identifier_ngram_index = {}
+        self.face_index = None
+        self.face_embeddings = None
+        self.face_match_threshold = FACE_MATCH_THRESHOLD
+        self.negative_cache = NegativeCache()
+    
     def _build_complete_entity_maps(self):        
         if 'profile' not in self.datasets:
             raise ValueError("Profile detaset not found")
         
+        # matchers are rebuilt from the new registry on first use; new identifiers may resolve ids that failed before
+        self.fuzzy_matchers = None
+        self.negative_cache.clear()
+        
         total_profiles = len(self.datasets['profile'])
         print(f"Processing {total_profiles} profiles")
         
@@ -42,46 +96,89 @@ class CompleteFixedEntityResolver(CompleteEntityResolver):
             if field in sample_profile:
                 print(f"{field}: {sample_profile[field]}")
         
-        for idx, person in self.datasets['profile'].iterrows():
-            entity_id = person['entity_id']
-            
-            # Extract identifiers
-            identifiers = []
-            id_fields = ['entity_id', 'student_id', 'staff_id', 'card_id', 'device_hash', 'face_id', 'email']
-            
-            for field in id_fields:
-                if field in person and pd.notna(person[field]):
-                    identifier_value = str(person[field])
-                    identifiers.append(identifier_value)
-                    
-                    # Map thease identifier to the entity
-                    self.id_to_entity[identifier_value] = entity_id
-            
-            # Storeing complete entity info
-            self.entity_registry[entity_id] = {
-                'name': person.get('name', 'Unknown'),
-                'role': person.get('role', 'Unknown'),
-                'email': person.get('email',''),
-                'department': person.get('department',''),
-                'all_identifiers': identifiers,
-                'source': 'profile',
-                'resolution_method': 'direct_mapping'
-            }
+        self._index_profiles(['entity_id', 'student_id', 'staff_id', 'card_id', 'device_hash', 'face_id', 'email'])
+        
+        self._build_identity_graph()
+        self._build_fallback_indexes()
+        self._build_face_index()
+    # indexes for the case-insensitive and substring fallbacks, built once per map build
+    def _build_fallback_indexes(self):
+        self.identifier_keys = list(self.id_to_entity.keys())
+        self.identifier_positions = {key: position for position, key in enumerate(self.identifier_keys)}
+        
+        # first key in id_to_entity order wins, same as the old linear scan
+        self.lowercase_index = {}
+        for key in self.identifier_keys:
+            self.lowercase_index.setdefault(key.lower(), key)
+        
+        # n-gram -> ascending positions of the keys containing it
+        self.identifier_ngram_index = defaultdict(list)
+        for position, key in enumerate(self.identifier_keys):
+            for gram in self._identifier_ngrams(key):
+                self.identifier_ngram_index[gram].append(position)
+        
+    # gallery of face embeddings whose face_id resolves to an entity
+    def _build_face_index(self):
+        self.face_index = None
+        self.face_embeddings = None
+        if 'face_vector' not in self.datasets or 'face_id' not in self.datasets['face_vector'].columns:
+            return
+        
+        face_vectors = self.datasets['face_vector']
+        vectors, valid = parse_embeddings(face_vectors)
+        if vectors.shape[1] == 0:
+            return
+        
+        # face_id -> embedding row, first row wins for repeated ids
+        face_ids = face_vectors['face_id'].astype(str)
+        first = np.flatnonzero(~face_ids.duplicated().to_numpy())
+        self.face_embeddings = (pd.Index(face_ids.iloc[first]), first, vectors, valid)
+        
+        entity_ids = self._enhanced_join_entity_ids(face_vectors['face_id'], 'face_id')
+        gallery = valid & pd.notna(entity_ids)
+        if gallery.any():
+            mode = 'ivf' if gallery.sum() >= FACE_INDEX_IVF_MIN_SIZE else 'exact'
+            self.face_index = FaceEmbeddingIndex(vectors[gallery], entity_ids[gallery], mode=mode)
+            print(f"Face index: {gallery.sum()} embeddings ({mode})")
+    
+    def _match_faces_by_embedding(self, df, entity_ids):
+        """(rows, entity ids, similarities) for rows the identifier join left unmatched whose
+        embedding is close enough to a gallery face"""
+        unmatched = np.flatnonzero(pd.isna(entity_ids))
+        if self.face_index is None or len(unmatched) == 0:
+            return unmatched[:0], np.zeros(0, dtype=object), np.zeros(0, dtype=np.float32)
+        
+        # the frame's own embedding when it carries one, else the embedding recorded for its face_id
+        if EMBEDDING_COLUMN in df.columns or embedding_columns(df):
+            queries, valid = parse_embeddings(df.iloc[unmatched])
+        elif 'face_id' in df.columns and self.face_embeddings is not None:
+            face_ids, first, vectors, valid_vectors = self.face_embeddings
+            found = face_ids.get_indexer(df['face_id'].iloc[unmatched].astype(str).to_numpy())
+            rows = first[np.maximum(found, 0)]
+            queries = vectors[rows]
+            valid = (found >= 0) & valid_vectors[rows]
+        else:
+            return unmatched[:0], np.zeros(0, dtype=object), np.zeros(0, dtype=np.float32)
         
+        rows = unmatched[valid]
+        labels, similarities = self.face_index.best_labels(queries[valid], self.face_match_threshold)
+        matched = pd.notna(labels)
+        return rows[matched], labels[matched], similarities[matched]
+    
+    def _add_face_matches(self, df, entity_ids, dataset_name, activity_type):
+        """Link unmatched rows by face similarity, with the similarity as confidence"""
+        rows, face_entity_ids, similarities = self._match_faces_by_embedding(df, entity_ids)
+        timestamps = self._get_source_timestamps(dataset_name, activity_type, rows)
+        self.activity_store.add(dataset_name, activity_type, face_entity_ids, rows, timestamps,
+                                similarities, 'face_embedding_match')
+        if len(rows):
+            print(f"Linked {len(rows)} more records by face embedding")
+        return len(rows)
+    
     #linking with multiple matching
     def _link_all_data_sources(self):        
-        linking_config = [
-            ('wifi_logs', 'device_hash', 'wifi_logs'),
-            ('campus_swipes', 'card_id', 'campus_swipes'),
-            ('library_check', 'entity_id', 'library_checkouts'),
-            ('lab_bookings', 'entity_id', 'lab_bookings'),
-            ('text_notes', 'entity_id', 'text_notes'),
-            ('face_vector', 'face_id', 'face_vectors'),
-            ('cctv_frame', 'face_id', 'cctv_frames')
-        ]
-        
         total_linked = 0
-        for dataset_name, id_field, activity_type in linking_config:
+        for dataset_name, id_field, activity_type in LINKING_CONFIG:
             if dataset_name in self.datasets:
                 df = self.datasets[dataset_name]
                 print(f"\n Processing {dataset_name}")
@@ -91,24 +188,17 @@ class CompleteFixedEntityResolver(CompleteEntityResolver):
                     print(f"SKIPG: {id_field} column not found")
                     continue
                 
-                linked_count = 0
-                sample_linked = []
+                entity_ids = self._enhanced_join_entity_ids(df[id_field], id_field)
+                linked_count = self._add_linked_activities(df, entity_ids, dataset_name, id_field, activity_type)
+                if dataset_name in FACE_LINKED_SOURCES:
+                    linked_count += self._add_face_matches(df, entity_ids, dataset_name, activity_type)
                 
-                for _, record in df.iterrows():
-                    identifier = record.get(id_field)
-                    entity_id = self._enhanced_find_entity(identifier, id_field)
-                    
-                    if entity_id:
-                        self.entity_activities[entity_id][activity_type].append({
-                            'record': record.to_dict(),
-                            'source': dataset_name,
-                            'confidence': 1.0,
-                            'provenance': f"direct_{id_field}_match",
-                            'timestamp': self._extract_timestamp(record, activity_type)
-                        })
-                        linked_count += 1
-                        if len(sample_linked) < 3:
-                            sample_linked.append(f"{identifier} → {entity_id}")
+                sample_linked = []
+                for identifier, entity_id in zip(df[id_field], entity_ids):
+                    if len(sample_linked) >= 3:
+                        break
+                    if pd.notna(entity_id):
+                        sample_linked.append(f"{identifier} → {entity_id}")
                 
                 total_linked += linked_count
                 print(f"Linked {linked_count}/{len(df)} records")
@@ -116,6 +206,20 @@ class CompleteFixedEntityResolver(CompleteEntityResolver):
                     print(f"Sample matches: {sample_linked}")
         
         print(f"\nTOTAL: {total_linked} activities linked")
+        self.negative_cache.print_stats()
+    # exact matches come from the columnar join, fallbacks run once per distinct leftover id
+    def _enhanced_join_entity_ids(self, id_values, id_field):
+        entity_ids = self._join_entity_ids(id_values)
+        
+        unmatched = np.flatnonzero(pd.isna(entity_ids) & id_values.notna().to_numpy())
+        if len(unmatched) == 0:
+            return entity_ids
+        
+        leftover = id_values.iloc[unmatched]
+        fallback = {identifier: self._enhanced_find_entity(identifier, id_field) 
+                    for identifier in pd.unique(leftover)}
+        entity_ids[unmatched] = leftover.map(fallback).to_numpy(dtype=object)
+        return entity_ids
     # entity finding with multiple strategies::
     def _enhanced_find_entity(self, identifier, id_field):
         if pd.isna(identifier):
@@ -123,14 +227,20 @@ class CompleteFixedEntityResolver(CompleteEntityResolver):
         
         identifier_str = str(identifier)
         
-        # 1: Direct match
-        if identifier_str in self.id_to_entity:
-            return self.id_to_entity[identifier_str]
+        # 0: identifiers that recently failed every strategy
+        cache_key = (id_field, identifier_str)
+        if cache_key in self.negative_cache:
+            return None
+        
+        # 1: Direct match, through the identity clusters
+        entity_id = self._find_entity(identifier_str, id_field)
+        if entity_id is not None:
+            return entity_id
         
         # 2: Case-insensitive match
-        for key in self.id_to_entity.keys():
-            if key.lower() == identifier_str.lower():
-                return self.id_to_entity[key]
+        key = self.lowercase_index.get(identifier_str.lower())
+        if key is not None:
+            return self.id_to_entity[key]
         
         # 3: For face_id try to match filename patterns (remove .jpg)
         if id_field == 'face_id' and '.jpg' in identifier_str:
@@ -140,197 +250,393 @@ class CompleteFixedEntityResolver(CompleteEntityResolver):
         
         #  4: profile may be use ddifferent entty_id format than other datsets try to find any identifier that contains this value
         if id_field == 'entity_id':
-            for key in self.id_to_entity.keys():
-                if identifier_str in key or key in identifier_str:
-                    return self.id_to_entity[key]
+            key = self._find_substring_match(identifier_str)
+            if key is not None:
+                return self.id_to_entity[key]
         
+        self.negative_cache.add(cache_key)
+        return None
+    # first identifier (in id_to_entity order) that contains or is contained in the value
+    def _find_substring_match(self, identifier_str):
+        best = len(self.identifier_keys)
+        
+        # keys contained in the value: look up every substring of the value
+        length = len(identifier_str)
+        for start in range(length + 1):
+            for end in range(start, length + 1):
+                position = self.identifier_positions.get(identifier_str[start:end])
+                if position is not None and position < best:
+                    best = position
+        
+        # keys containing the value: verify candidates from the rarest n-gram posting list
+        grams = self._identifier_ngrams(identifier_str)
+        if grams:
+            postings = min((self.identifier_ngram_index.get(gram, []) for gram in grams), key=len)
+            for position in postings:
+                if position >= best:
+                    break
+                if identifier_str in self.identifier_keys[position]:
+                    best = position
+                    break
+        else:
+            # value shorter than an n-gram: scan, but only up to the current best
+            for position in range(best):
+                if identifier_str in self.identifier_keys[position]:
+                    best = position
+                    break
+        
+        if best < len(self.identifier_keys):
+            return self.identifier_keys[best]
         return None
+    
+    def _identifier_ngrams(self, value):
+        """Distinct n-grams of a value; empty when it is shorter than the n-gram size"""
+        return {value[i:i + IDENTIFIER_NGRAM_SIZE] for i in range(len(value) - IDENTIFIER_NGRAM_SIZE + 1)}
+
+# entities whose patterns are aggregated together when the map is streamed out
+ENTITY_CHUNK_SIZE = 100
+
+# cross-link fields the evidence chains read
+EVIDENCE_LINK_FIELDS = ['timestamp', 'sources', 'confidence', 'description']
+
+# stable shard number for an entity (python's hash() differs between processes)
+def entity_shard(entity_id, shard_count):
+    return zlib.crc32(str(entity_id).encode('utf-8')) % shard_count
+
+# worker: enhanced entity data for one shard
+def resolve_entity_shard(shard):
+    resolver = ImprovedEntityResolver.from_shard(shard)
+    return resolver._generate_enhanced_entities()
 
 # generate final json for patterns analysis
 class ImprovedEntityResolver(CompleteFixedEntityResolver):
-    def generate_enhanced_json_output(self):
+    # resolver holding one shard of an already linked resolver
+    @classmethod
+    def from_shard(cls, shard):
+        resolver = cls(shard['activity_store'].datasets)
+        resolver.activity_store = shard['activity_store']
+        resolver.entity_activities = EntityActivitiesView(resolver.activity_store)
+        resolver.entity_registry = shard['entity_registry']
+        resolver.cross_source_links = defaultdict(list, shard['cross_source_links'])
+        return resolver
+    
+    def generate_enhanced_json_output(self, workers=None):
+        
+        if workers and workers > 1:
+            entities = self._generate_enhanced_entities_parallel(workers)
+        else:
+            entities = self._generate_enhanced_entities()
         
         enhanced_output = {
-            'entities': self._generate_enhanced_entities(),
+            'entities': entities,
             'patterns_ready': True,
         }
         
         return enhanced_output
     
+    # (entity_id, enhanced entity) one at a time; patterns are aggregated chunk by chunk so only one
+    # chunk's worth of output is alive at once
+    def iter_enhanced_entities(self, chunk_size=ENTITY_CHUNK_SIZE):
+        entity_ids = list(self.entity_registry.keys())
+        for start in range(0, len(entity_ids), chunk_size):
+            chunk = entity_ids[start:start + chunk_size]
+            patterns = self._aggregate_entity_patterns(chunk)
+            for entity_id in chunk:
+                yield entity_id, self._build_enhanced_entity(entity_id, patterns.pop(entity_id))
+    
+    # stream the map to a file, or to a directory of shard_size-entity files plus a manifest, each file
+    # with an entity_id -> byte range index; parallel workers still build every entity in memory first.
+    # with database, the same entities are bulk loaded into an sqlite entity database as well
+    def write_enhanced_json_output(self, path, compact=False, shard_size=None, workers=None, index=True, database=None):
+        if workers and workers > 1:
+            entities = self._generate_enhanced_entities_parallel(workers).items()
+        else:
+            entities = self.iter_enhanced_entities()
+        
+        database_writer = EntityDatabaseWriter(database) if database else None
+        try:
+            with EntityMapWriter(path, compact, shard_size, index=index) as writer:
+                for entity_id, entity in entities:
+                    writer.write(entity_id, entity)
+                    if database_writer is not None:
+                        database_writer.write(entity_id, entity)
+        except BaseException:
+            # a failed run must not move a partial database into place
+            if database_writer is not None:
+                database_writer.abort()
+            raise
+        
+        layout = f"{len(writer.shards)} shards" if shard_size else "one file"
+        print(f"Wrote {writer.entity_count} entities to {path} ({layout}{', compact' if compact else ''})")
+        if database_writer is not None:
+            database_writer.close()
+            print(f"Loaded {database_writer.entity_count} entities into {database}")
+        return writer.entity_count
+    
+    # every resolved activity as a memory mapped, (entity, timestamp) sorted event log for analytics
+    def write_event_log(self, path):
+        event_count = write_event_log(path, self.activity_store, self.entity_registry.keys())
+        print(f"Wrote {event_count} events of {len(self.entity_registry)} entities to {path}")
+        return event_count
+    
+    # split linked entities into hash shards; each shard carries only its own activities
+    def _build_entity_shards(self, shard_count):
+        shard_entities = defaultdict(list)
+        for entity_id in self.entity_registry.keys():
+            shard_entities[entity_shard(entity_id, shard_count)].append(entity_id)
+        
+        shards = []
+        for entity_ids in shard_entities.values():
+            shards.append({
+                'activity_store': self.activity_store.subset(entity_ids, DETAIL_FIELDS),
+                'entity_registry': {entity_id: self.entity_registry[entity_id] for entity_id in entity_ids},
+                'cross_source_links': {
+                    entity_id: [{field: link.get(field) for field in EVIDENCE_LINK_FIELDS}
+                                for link in self.cross_source_links.get(entity_id, [])]
+                    for entity_id in entity_ids
+                }
+            })
+        return shards
+    
+    # enhanced entities computed shard by shard in a process pool
+    def _generate_enhanced_entities_parallel(self, workers):
+        shards = self._build_entity_shards(workers)
+        print(f"Resolving {len(self.entity_registry)} entities in {len(shards)} shards on {workers} workers")
+        
+        resolved = {}
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for shard_entities in executor.map(resolve_entity_shard, shards):
+                resolved.update(shard_entities)
+        
+        return {entity_id: resolved[entity_id] for entity_id in self.entity_registry.keys()}
+    
     # making entity data with pattern ready structure
     def _generate_enhanced_entities(self):
         entities = {}
+        patterns = self._aggregate_entity_patterns()
         
         for entity_id in self.entity_registry.keys():
-            entities[entity_id] = {
-                'profile_info': self.entity_registry[entity_id],
-                'activity_timeline': self._generate_activity_timeline(entity_id),
-                'behavioral_patterns': self._extract_behavioral_patterns(entity_id),
-                'location_analysis': self._analyze_location_patterns(entity_id),
-                'temporal_analysis': self._analyze_temporal_patterns(entity_id),
-                'evidence_chains': self._generate_evidence_chains(entity_id),
-                'ml_features': self._extract_ml_features(entity_id)
-            }
+            entities[entity_id] = self._build_enhanced_entity(entity_id, patterns[entity_id])
         
         return entities
+    
+    def _build_enhanced_entity(self, entity_id, entity_patterns):
+        """Enhanced output of one entity from its aggregated pattern sections"""
+        return {
+            'profile_info': self.entity_registry[entity_id],
+            'activity_timeline': self._generate_activity_timeline(entity_id),
+            'behavioral_patterns': entity_patterns['behavioral_patterns'],
+            'location_analysis': entity_patterns['location_analysis'],
+            'temporal_analysis': entity_patterns['temporal_analysis'],
+            'evidence_chains': self._generate_evidence_chains(entity_id, entity_patterns['recent_sequence']),
+            'ml_features': entity_patterns['ml_features']
+        }
     # activity timeline
     def _generate_activity_timeline(self, entity_id):
-        timeline = []
-        
-        for activity_type, activities in self.entity_activities[entity_id].items():
-            for activity in activities:
-                timestamp = activity.get('timestamp')
-                if timestamp:
-                    timeline.append({
-                        'timestamp': timestamp.isoformat(),
-                        'activity_type': activity_type,
-                        'location': self._extract_location(activity['record'], activity_type),
-                        'source': activity['source'],
-                        'confidence': activity['confidence'],
-                        'provenance': activity['provenance'],
-                        'details': self._clean_activity_details(activity['record'], activity_type)
-                    })
+        store = self.activity_store
+        columns = store.entity_columns(entity_id)
+        timed = columns['timestamp'] != NAT
         
         # Sort by timestamp
-        timeline.sort(key=lambda x: x['timestamp'])
-        return timeline
-    # extract behavioral pattern
-    def _extract_behavioral_patterns(self, entity_id):
-        activities = self.entity_activities[entity_id]
+        timestamps = timestamps_to_isoformat(columns['timestamp'][timed])
+        order = np.argsort(timestamps.astype(str), kind='stable')
+        positions = columns['position'][timed][order]
         
-        # Extract location sequences
-        locations = []
-        location_times = []
+        locations = store.location_values(store.column('location')[positions])
+        details = store.records(positions, DETAIL_FIELDS)
+        source_codes = store.column('source')[positions]
+        confidences = store.column('confidence')[positions]
+        provenance_codes = store.column('provenance')[positions]
         
-        for activity_type, activity_list in activities.items():
-            for activity in activity_list:
-                timestamp = activity.get('timestamp')
-                location = self._extract_location(activity['record'], activity_type)
+        timeline = []
+        for i, timestamp in enumerate(timestamps[order]):
+            dataset_name, activity_type = store.sources[source_codes[i]]
+            timeline.append({
+                'timestamp': timestamp,
+                'activity_type': activity_type,
+                'location': locations[i],
+                'source': dataset_name,
+                'confidence': float(confidences[i]),
+                'provenance': store.provenances[provenance_codes[i]],
+                'details': details[i]
+            })
+        
+        return timeline
+    # single pass over the activity table computing every pattern section for all entities
+    def _aggregate_entity_patterns(self, entity_ids=None):
+        store = self.activity_store
+        if entity_ids is None:
+            entity_ids = list(self.entity_registry.keys())
+            positions = np.arange(len(store))
+        else:
+            positions = np.concatenate([store.entity_positions(entity_id) for entity_id in entity_ids] + [np.zeros(0, dtype=np.int64)])
+        
+        # rows grouped by entity, in source then row order within an entity (the order a full build links them in)
+        positions = positions[np.lexsort((store.column('row')[positions], store.column('source')[positions],
+                                          store.column('entity')[positions]))]
+        entities = store.column('entity')[positions]
+        timestamps = store.column('timestamp')[positions]
+        locations = store.column('location')[positions]
+        sources = store.column('source')[positions]
+        
+        timed = timestamps != NAT
+        located = timed & store.location_mask(locations)
+        with_location = store.location_mask(locations)
+        hours = hour_of(timestamps)
+        weekdays = weekday_of(timestamps)
+        day_part_names = [self._get_day_part(hour) for hour in range(24)]
+        day_part_codes, day_part_values = pd.factorize(np.array(day_part_names, dtype=object))
+        day_parts = day_part_codes[hours]
+        
+        # located rows in timestamp order, for sequences, hourly distribution and transitions
+        located_rows = np.flatnonzero(located)
+        by_time = located_rows[np.lexsort((timestamps[located_rows], entities[located_rows]))]
+        sequence_entities = entities[by_time]
+        sequence_locations = locations[by_time]
+        sequence_bounds = group_bounds(sequence_entities)
+        
+        same_entity = sequence_entities[1:] == sequence_entities[:-1]
+        transition_counts = grouped_ordered_counts(
+            sequence_entities[1:][same_entity],
+            sequence_locations[:-1][same_entity].astype(np.int64) * len(store.locations) + sequence_locations[1:][same_entity])
+        sequence_hour_counts = grouped_ordered_counts(sequence_entities, hours[by_time])
+        
+        # located rows in insertion order, for frequencies and day-part preferences
+        location_counts = grouped_ordered_counts(entities[located], locations[located])
+        day_part_order = grouped_ordered_counts(entities[located], day_parts[located])
+        day_part_location_counts = grouped_ordered_counts(
+            entities[located].astype(np.int64) * len(day_part_values) + day_parts[located], locations[located])
+        
+        # timed rows, for the temporal analysis and the recent sequence
+        hour_counts = grouped_ordered_counts(entities[timed], hours[timed])
+        weekday_counts = grouped_ordered_counts(entities[timed], weekdays[timed])
+        timed_totals = np.bincount(entities[timed], minlength=len(store.entity_ids))
+        weekend_totals = np.bincount(entities[timed & (weekdays >= 5)], minlength=len(store.entity_ids))
+        timed_rows = np.flatnonzero(timed)
+        timed_by_time = timed_rows[np.lexsort((timestamps[timed_rows], entities[timed_rows]))]
+        timed_bounds = group_bounds(entities[timed_by_time])
+        
+        # every row, for the ml features
+        any_location_counts = grouped_ordered_counts(entities[with_location], locations[with_location])
+        source_counts = grouped_ordered_counts(entities, sources)
+        
+        bounds = [group_bounds(counts[0]) for counts in (transition_counts, sequence_hour_counts, location_counts, day_part_order,
+                                                         day_part_location_counts, hour_counts, weekday_counts, any_location_counts, source_counts)]
+        transition_bounds, sequence_hour_bounds, location_bounds, day_part_bounds, day_part_location_bounds, \
+            hour_bounds, weekday_bounds, any_location_bounds, source_bounds = bounds
+        entity_totals = np.bincount(entities, minlength=len(store.entity_ids))
+        
+        def counts_for(counts, group_bounds_, group, values=None):
+            start, end = group_bounds_.get(group, (0, 0))
+            keys = counts[1][start:end].tolist() if values is None else values(counts[1][start:end])
+            return dict(zip(keys, counts[2][start:end].tolist()))
+        
+        patterns = {}
+        for entity_id in entity_ids:
+            code = store.entity_codes.get(entity_id, -1)
+            
+            # extract behavioral pattern
+            behavioral_patterns = {}
+            if code in sequence_bounds:
+                start, end = sequence_bounds[code]
+                location_sequence = store.location_values(sequence_locations[start:end]).tolist()
+                location_frequency = counts_for(location_counts, location_bounds, code, lambda codes: store.location_values(codes).tolist())
+                
+                transition_frequency = {}
+                for transition_code, count in counts_for(transition_counts, transition_bounds, code).items():
+                    source, target = divmod(transition_code, len(store.locations))
+                    transition_frequency[f"{store.locations[source]}→{store.locations[target]}"] = count
                 
-                if timestamp and location:
-                    locations.append(location)
-                    location_times.append({
-                        'location': location,
-                        'timestamp': timestamp,
-                        'hour': timestamp.hour,
-                        'day_of_week': timestamp.weekday(),
-                        'is_weekend': timestamp.weekday() >= 5
-                    })
-        
-        # Calculate patterns
-        if location_times:
-            location_times.sort(key=lambda x: x['timestamp'])
-            location_sequence = [lt['location'] for lt in location_times]
+                behavioral_patterns = {
+                    'location_sequence': location_sequence,
+                    'unique_locations': list(set(list(location_frequency))),
+                    'location_frequency': location_frequency,
+                    'hourly_distribution': counts_for(sequence_hour_counts, sequence_hour_bounds, code),
+                    'common_transitions': dict(sorted(transition_frequency.items(), 
+                                                    key=lambda x: x[1], reverse=True)[:10]),
+                    'total_location_changes': end - start - 1,
+                    'activity_consistency': self._calculate_consistency_score(sequence_locations[start:end])
+                }
             
-            # Time-based patterns
-            hourly_distribution = defaultdict(int)
-            for lt in location_times:
-                hourly_distribution[lt['hour']] += 1
+            # location pattern
+            location_analysis = {}
+            if code in sequence_bounds:
+                location_preferences_pct = {}
+                for day_part in counts_for(day_part_order, day_part_bounds, code):
+                    visits = counts_for(day_part_location_counts, day_part_location_bounds, code * len(day_part_values) + day_part,
+                                        lambda codes: store.location_values(codes).tolist())
+                    total = sum(visits.values())
+                    location_preferences_pct[day_part_values[day_part]] = {
+                        loc: count/total for loc, count in visits.items()
+                    }
+                
+                visits = counts_for(location_counts, location_bounds, code, lambda codes: store.location_values(codes).tolist())
+                location_analysis = {
+                    'location_preferences_by_time': location_preferences_pct,
+                    'most_visited_location': max(set(list(visits)), key=visits.get),
+                    'visit_frequency': int(sum(visits.values())),
+                    'location_entropy': self._entropy_from_counts(list(visits.values()))
+                }
             
-            # Location frequency
-            location_frequency = defaultdict(int)
-            for location in locations:
-                location_frequency[location] += 1
+            # temporal pattern
+            temporal_analysis = {}
+            if code >= 0 and timed_totals[code] > 0:
+                hourly_activity = counts_for(hour_counts, hour_bounds, code)
+                peak_hours = sorted(hourly_activity.items(), key=lambda x: x[1], reverse=True)[:3]
+                day_activity = counts_for(weekday_counts, weekday_bounds, code)
+                temporal_analysis = {
+                    'hourly_activity_distribution': hourly_activity,
+                    'peak_activity_hours': [hour for hour, count in peak_hours],
+                    'weekday_vs_weekend_ratio': int(weekend_totals[code]) / int(timed_totals[code]),
+                    'most_active_day': max(set(list(day_activity)), key=day_activity.get)
+                }
             
-            # Movement patterns (transitions)
-            transitions = []
-            for i in range(1, len(location_sequence)):
-                transitions.append(f"{location_sequence[i-1]}→{location_sequence[i]}")
+            # recent movement, from the last three timed activities
+            recent_sequence = []
+            if code in timed_bounds and timed_totals[code] >= 2:
+                start, end = timed_bounds[code]
+                recent = locations[timed_by_time[max(start, end - 3):end]]
+                recent_sequence = store.location_values(recent[store.location_mask(recent)]).tolist()
             
-            transition_frequency = defaultdict(int)
-            for transition in transitions:
-                transition_frequency[transition] += 1
+            # featuring for ml
+            profile = self.entity_registry[entity_id]
+            activity_types = [store.sources[source][1] for source in counts_for(source_counts, source_bounds, code)]
+            ml_features = {
+                'entity_id': entity_id,
+                'department': profile.get('department', 'Unknown'),
+                'role': profile.get('role', 'Unknown'),
+                'total_activities': int(entity_totals[code]) if code >= 0 else 0,
+                'activity_variety': len(activity_types),
+                'data_sources_used': activity_types
+            }
+            visits = counts_for(any_location_counts, any_location_bounds, code, lambda codes: store.location_values(codes).tolist())
+            if visits:
+                ml_features.update({
+                    'unique_locations_count': len(visits),
+                    'most_frequent_location': max(set(list(visits)), key=visits.get),
+                    'location_consistency': len(visits) / sum(visits.values())
+                })
             
-            return {
-                'location_sequence': location_sequence,
-                'unique_locations': list(set(locations)),
-                'location_frequency': dict(location_frequency),
-                'hourly_distribution': dict(hourly_distribution),
-                'common_transitions': dict(sorted(transition_frequency.items(), 
-                                                key=lambda x: x[1], reverse=True)[:10]),
-                'total_location_changes': len(transitions),
-                'activity_consistency': self._calculate_consistency_score(locations)
+            patterns[entity_id] = {
+                'behavioral_patterns': behavioral_patterns,
+                'location_analysis': location_analysis,
+                'temporal_analysis': temporal_analysis,
+                'recent_sequence': recent_sequence,
+                'ml_features': ml_features
             }
         
-        return {}
+        return patterns
+    # extract behavioral pattern
+    def _extract_behavioral_patterns(self, entity_id):
+        return self._aggregate_entity_patterns([entity_id])[entity_id]['behavioral_patterns']
     # location pattern
     def _analyze_location_patterns(self, entity_id):
-        activities = self.entity_activities[entity_id]
-        location_data = []
-        
-        for activity_type, activity_list in activities.items():
-            for activity in activity_list:
-                timestamp = activity.get('timestamp')
-                location = self._extract_location(activity['record'], activity_type)
-                
-                if timestamp and location:
-                    location_data.append({
-                        'location': location,
-                        'timestamp': timestamp,
-                        'activity_type': activity_type,
-                        'hour': timestamp.hour,
-                        'day_part': self._get_day_part(timestamp.hour)
-                    })
-        
-        if not location_data:
-            return {}
-        
-        # Location preferences by time of day
-        location_preferences = defaultdict(lambda: defaultdict(int))
-        for data in location_data:
-            location_preferences[data['day_part']][data['location']] += 1
-        
-        # Convert to percentages
-        location_preferences_pct = {}
-        for day_part, locations in location_preferences.items():
-            total = sum(locations.values())
-            location_preferences_pct[day_part] = {
-                loc: count/total for loc, count in locations.items()
-            }
-        
-        return {
-            'location_preferences_by_time': location_preferences_pct,
-            'most_visited_location': max(set([d['location'] for d in location_data]), 
-                                       key=[d['location'] for d in location_data].count),
-            'visit_frequency': len(location_data),
-            'location_entropy': self._calculate_location_entropy([d['location'] for d in location_data])
-        }
+        return self._aggregate_entity_patterns([entity_id])[entity_id]['location_analysis']
     # temporal pattern
     def _analyze_temporal_patterns(self, entity_id):
-        activities = self.entity_activities[entity_id]
-        temporal_data = []
-        
-        for activity_type, activity_list in activities.items():
-            for activity in activity_list:
-                timestamp = activity.get('timestamp')
-                if timestamp:
-                    temporal_data.append({
-                        'hour': timestamp.hour,
-                        'day_of_week': timestamp.weekday(),
-                        'is_weekend': timestamp.weekday() >= 5,
-                        'activity_type': activity_type
-                    })
-        
-        if not temporal_data:
-            return {}
-        
-        # Activity distribution by hour
-        hourly_activity = defaultdict(int)
-        for data in temporal_data:
-            hourly_activity[data['hour']] += 1
-        
-        # Peak activity times
-        peak_hours = sorted(hourly_activity.items(), key=lambda x: x[1], reverse=True)[:3]
-        
-        return {
-            'hourly_activity_distribution': dict(hourly_activity),
-            'peak_activity_hours': [hour for hour, count in peak_hours],
-            'weekday_vs_weekend_ratio': len([d for d in temporal_data if d['is_weekend']]) / len(temporal_data),
-            'most_active_day': max(set([d['day_of_week'] for d in temporal_data]), 
-                                 key=[d['day_of_week'] for d in temporal_data].count)
-        }
+        return self._aggregate_entity_patterns([entity_id])[entity_id]['temporal_analysis']
     # generate evidence for inference
-    def _generate_evidence_chains(self, entity_id):
+    def _generate_evidence_chains(self, entity_id, recent_sequence=None):
         evidence_chains = []
         
         # Add cross-source links as evidence
@@ -345,69 +651,28 @@ class ImprovedEntityResolver(CompleteFixedEntityResolver):
             })
         
         # Add sequential evidence
-        activities = self._get_all_timestamped_activities(entity_id)
-        if len(activities) >= 2:
-            activities.sort(key=lambda x: x['timestamp'])
-            recent_sequence = [self._extract_location(act['record'], act['source']) 
-                             for act in activities[-3:] if self._extract_location(act['record'], act['source'])]
-            
-            if len(recent_sequence) >= 2:
-                evidence_chains.append({
-                    'type': 'sequential_pattern',
-                    'sequence': recent_sequence,
-                    'confidence': 0.8,
-                    'description': f"Recent movement pattern: {' → '.join(recent_sequence)}",
-                    'evidence_type': 'behavioral_sequence'
-                })
+        if recent_sequence is None:
+            recent_sequence = self._aggregate_entity_patterns([entity_id])[entity_id]['recent_sequence']
+        
+        if len(recent_sequence) >= 2:
+            evidence_chains.append({
+                'type': 'sequential_pattern',
+                'sequence': recent_sequence,
+                'confidence': 0.8,
+                'description': f"Recent movement pattern: {' → '.join(recent_sequence)}",
+                'evidence_type': 'behavioral_sequence'
+            })
         
         return evidence_chains
     # featuring for ml 
     def _extract_ml_features(self, entity_id):
-        activities = self.entity_activities[entity_id]
-        profile = self.entity_registry[entity_id]
-        
-        # Basic features
-        features = {
-            'entity_id': entity_id,
-            'department': profile.get('department', 'Unknown'),
-            'role': profile.get('role', 'Unknown'),
-            'total_activities': sum(len(act_list) for act_list in activities.values()),
-            'activity_variety': len(activities),
-            'data_sources_used': list(activities.keys())
-        }
-        
-        # Location-based features
-        locations = []
-        for activity_type, activity_list in activities.items():
-            for activity in activity_list:
-                location = self._extract_location(activity['record'], activity_type)
-                if location:
-                    locations.append(location)
-        
-        if locations:
-            features.update({
-                'unique_locations_count': len(set(locations)),
-                'most_frequent_location': max(set(locations), key=locations.count),
-                'location_consistency': len(set(locations)) / len(locations) if locations else 0
-            })
-        
-        return features
+        return self._aggregate_entity_patterns([entity_id])[entity_id]['ml_features']
     # kepping only essential fields to reduce size
     def _clean_activity_details(self, record, activity_type):
         """Clean activity details for JSON output"""
         cleaned = {}
         
-        keep_fields = {
-            'wifi_logs': ['device_hash', 'ap_id', 'timestamp'],
-            'campus_swipes': ['card_id', 'location_id', 'timestamp'],
-            'library_checkouts': ['book_id', 'timestamp'],
-            'lab_bookings': ['room_id', 'start_time', 'end_time'],
-            'text_notes': ['category', 'text', 'timestamp'],
-            'face_vectors': ['face_id', 'timestamp'],
-            'cctv_frames': ['frame_id', 'location_id', 'timestamp']
-        }
-        
-        fields_to_keep = keep_fields.get(activity_type, [])
+        fields_to_keep = DETAIL_FIELDS.get(activity_type, [])
         for field in fields_to_keep:
             if field in record:
                 cleaned[field] = record[field]
@@ -435,15 +700,18 @@ class ImprovedEntityResolver(CompleteFixedEntityResolver):
         return 1.0 - (len(unique_locations) / len(locations))
     # calc location distribution
     def _calculate_location_entropy(self, locations):
-        from collections import Counter
-        if not locations:
+        if len(locations) == 0:
             return 0
         
-        counter = Counter(locations)
-        total = len(locations)
+        _, counts = ordered_counts(locations)
+        return self._entropy_from_counts(counts)
+    
+    def _entropy_from_counts(self, counts):
+        """Entropy of a distribution given its counts in first-occurrence order"""
+        total = sum(counts)
         entropy = 0
         
-        for count in counter.values():
+        for count in counts:
             p = count / total
             entropy -= p * np.log2(p)
         
@@ -483,8 +751,7 @@ class ImprovedEntityResolver(CompleteFixedEntityResolver):
     
     def _assess_data_completeness(self):
         """Assess data completeness for prediction"""
-        entities_with_activities = sum(1 for entity_acts in self.entity_activities.values() 
-                                     if any(entity_acts.values()))
+        entities_with_activities = len(self.activity_store.entities())
         completeness = entities_with_activities / len(self.entity_registry)
         
         if completeness > 0.8:
@@ -494,8 +761,186 @@ class ImprovedEntityResolver(CompleteFixedEntityResolver):
         else:
             return "low"
 
-#generate and save final entity resolver json file
-def generate_enhanced_json_output():    
+# keeps a resolved map up to date: new log batches only recompute the entities they touch
+class IncrementalEntityResolver(ImprovedEntityResolver):
+    def __init__(self, datasets):
+        super().__init__(datasets)
+        self.enhanced_entities = {}
+        self.batch_pieces = defaultdict(list)
+    
+    # full pipeline once, keeping every entity's enhanced output for later batches
+    def build(self):
+        self.resolve_all_entities_full_pipeline()
+        self.enhanced_entities = self._generate_enhanced_entities()
+        return self.generate_enhanced_json_output()
+    
+    def generate_enhanced_json_output(self, workers=None):
+        if not self.enhanced_entities:
+            return super().generate_enhanced_json_output(workers)
+        
+        return {
+            'entities': {entity_id: self.enhanced_entities[entity_id] for entity_id in self.entity_registry.keys()},
+            'patterns_ready': True,
+        }
+    
+    def iter_enhanced_entities(self, chunk_size=ENTITY_CHUNK_SIZE):
+        if not self.enhanced_entities:
+            yield from super().iter_enhanced_entities(chunk_size)
+            return
+        
+        for entity_id in self.entity_registry.keys():
+            yield entity_id, self.enhanced_entities[entity_id]
+    
+    # link a batch of new source rows ({dataset_name: DataFrame}) and refresh the entities it touches;
+    # identity graph evidence and orphan device links are recomputed over every row so far, as a full
+    # rebuild would
+    def apply_batch(self, batches):
+        if 'profile' in batches:
+            raise ValueError("Profile updates change identifier maps, run a full rebuild")
+        
+        staged = []
+        for dataset_name, id_field, activity_type in LINKING_CONFIG:
+            if dataset_name not in batches or id_field not in batches[dataset_name].columns:
+                continue
+            
+            raw = batches[dataset_name].reset_index(drop=True)
+            df, failures = validate_source(dataset_name, raw)
+            df = quarantine_rows(dataset_name, df, failures, QUARANTINE_PATH, raw)
+            piece = (self.activity_store.source_row_count(dataset_name), df,
+                     self._parse_batch_timestamps(dataset_name, activity_type, df))
+            self.batch_pieces[dataset_name].append(piece)
+            staged.append((dataset_name, id_field, activity_type, piece))
+        
+        evidence_sources = {dataset_name for rule in CO_OCCURRENCE_RULES for dataset_name, _ in (rule['left'], rule['right'])}
+        if evidence_sources & set(batches):
+            try:
+                self._check_identity_evidence()
+            except ValueError:
+                for dataset_name, _, _, piece in staged:
+                    self.batch_pieces[dataset_name].remove(piece)
+                raise
+        
+        touched = set()
+        for dataset_name, id_field, activity_type, (row_offset, df, timestamps) in staged:
+            self.activity_store.add_frame(dataset_name, df)
+            entity_ids = self._enhanced_join_entity_ids(df[id_field], id_field)
+            matched_rows = np.flatnonzero(pd.notna(entity_ids))
+            self.activity_store.add(dataset_name, activity_type, entity_ids[matched_rows], matched_rows, timestamps[matched_rows],
+                                    1.0, f"direct_{id_field}_match", frame=df, row_offset=row_offset)
+            touched.update(entity_ids[matched_rows])
+            
+            if dataset_name in FACE_LINKED_SOURCES:
+                rows, face_entity_ids, similarities = self._match_faces_by_embedding(df, entity_ids)
+                self.activity_store.add(dataset_name, activity_type, face_entity_ids, rows, timestamps[rows],
+                                        similarities, 'face_embedding_match', frame=df, row_offset=row_offset)
+                touched.update(face_entity_ids)
+            
+            for source_name, _, fields, text_fields in FUZZY_MENTION_SOURCES:
+                if source_name == dataset_name:
+                    matches = self._match_fuzzy_mentions(df, np.flatnonzero(pd.isna(entity_ids)), fields, text_fields)
+                    for provenance, (rows, fuzzy_entity_ids, scores) in matches.items():
+                        self.activity_store.add(dataset_name, activity_type, fuzzy_entity_ids, rows, timestamps[rows],
+                                                scores, provenance, frame=df, row_offset=row_offset)
+                        touched.update(fuzzy_entity_ids)
+        
+        orphan_sources = {ORPHAN_DEVICE_LINKING['source'][0], *ORPHAN_DEVICE_LINKING['evidence_sources']}
+        if orphan_sources & set(batches):
+            touched.update(self._relink_orphan_devices())
+        
+        touched = [entity_id for entity_id in self.entity_registry.keys() if entity_id in touched]
+        self._refresh_entities(touched)
+        print(f"Batch linked to {len(touched)} entities")
+        return touched
+    
+    def _source_pieces(self, dataset_name, activity_type):
+        """(first store row, frame, int64 timestamps) of each consecutive piece of a source: the loaded frame,
+        then every batch"""
+        return super()._source_pieces(dataset_name, activity_type) + self.batch_pieces.get(dataset_name, [])
+    
+    # the identity graph rebuilt with the batch's co-occurrences; rows already linked cannot be relinked,
+    # so a batch that changes which identifiers resolve needs a full rebuild
+    def _check_identity_evidence(self):
+        identity_graph, identifier_table = self.identity_graph, self.identifier_table
+        self._build_identity_graph()
+        if self.identity_graph.resolved_identifiers() != identity_graph.resolved_identifiers():
+            self.identity_graph, self.identifier_table = identity_graph, identifier_table
+            raise ValueError("Batch co-occurrences change how identifiers resolve, run a full rebuild")
+        self.identifier_table = identifier_table
+    
+    # orphan device links recomputed over every row so far: events of newly linked devices are added and
+    # changed shares rewritten in place; returns the entities whose activities changed
+    def _relink_orphan_devices(self):
+        dataset_name, id_field, activity_type = ORPHAN_DEVICE_LINKING['source']
+        proposal = self._propose_orphan_device_links()
+        rows, entity_ids, shares, _ = proposal if proposal else (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=object),
+                                                                 np.zeros(0), 0)
+        
+        store = self.activity_store
+        provenance = f"co_occurrence_{id_field}_match"
+        linked = np.flatnonzero((store.column('source') == store.register_source(dataset_name, activity_type))
+                                & (store.column('provenance') == store.provenance_codes.get(provenance, -1)))
+        linked_entities = np.array(store.entity_ids, dtype=object)[store.column('entity')[linked]]
+        matches = pd.Index(store.column('row')[linked]).get_indexer(rows)
+        
+        new = matches < 0
+        self._add_source_rows(dataset_name, activity_type, entity_ids[new], rows[new], shares[new], provenance)
+        kept = np.flatnonzero(~new)
+        same_entity = linked_entities[matches[kept]] == entity_ids[kept]
+        kept = kept[same_entity]
+        changed = kept[store.column('confidence')[linked[matches[kept]]] != shares[kept]]
+        store.update_confidence(linked[matches[changed]], shares[changed])
+        
+        # a linked event whose device lost its link or moved to another entity cannot be taken back
+        stale = np.ones(len(linked), dtype=bool)
+        stale[matches[kept]] = False
+        if stale.any():
+            print(f"Orphan devices: {int(stale.sum())} linked events no longer match their device's link, "
+                  f"run a full rebuild to drop them")
+        
+        print(f"Orphan devices: {int(new.sum())} events newly linked, {len(changed)} shares updated")
+        return set(entity_ids[new]) | set(entity_ids[changed])
+    
+    def _parse_batch_timestamps(self, dataset_name, activity_type, df):
+        """int64 epoch-ns timestamps of a batch, parsed with the format found for the source at build time"""
+        field = TIMESTAMP_FIELDS[activity_type]
+        if field not in df.columns:
+            return np.full(len(df), NAT, dtype=np.int64)
+        
+        stats = self.timestamp_report.get(dataset_name)
+        timestamp_format = stats['format'] if stats and stats['format'] != 'mixed' else None
+        parsed, unparseable = parse_timestamp_column(df[field], timestamp_format)
+        
+        if stats:
+            stats['rows'] += len(df)
+            stats['missing'] += int(df[field].isna().sum())
+            stats['unparseable'] += unparseable
+        return pd.DatetimeIndex(parsed).asi8
+    
+    # cross links, fusion scores and enhanced output of the given entities only
+    def _refresh_entities(self, entity_ids):
+        if not entity_ids:
+            return
+        
+        self._create_inferred_relationships(entity_ids)
+        self._perform_multi_modal_fusion(entity_ids)
+        
+        patterns = self._aggregate_entity_patterns(entity_ids)
+        for entity_id in entity_ids:
+            self.enhanced_entities[entity_id] = self._build_enhanced_entity(entity_id, patterns[entity_id])
+    
+    def save_state(self, filepath):
+        """Persist the resolved state so later batches can be applied without a rebuild"""
+        joblib.dump(self, filepath)
+        print(f"Resolver state saved to {filepath}")
+    
+    @classmethod
+    def load_state(cls, filepath):
+        resolver = joblib.load(filepath)
+        print(f"Resolver state loaded from {filepath}")
+        return resolver
+
+#generate and save final entity resolver json file; the whole map is also returned as a dict
+def generate_enhanced_json_output(workers=None):    
     # Load datasets
     datasets = load_all_datasets()
     if not datasets:
@@ -506,18 +951,35 @@ def generate_enhanced_json_output():
     resolver.resolve_all_entities_full_pipeline()
     
     # Generate JSON
-    enhanced_output = resolver.generate_enhanced_json_output()
-    
-    # Save to file
-    output_filename = f"Entity_resolution_map1.json"
-    with open(output_filename, 'w') as f:
-        json.dump(enhanced_output, f, indent=2, default=str)
+    enhanced_output = resolver.generate_enhanced_json_output(workers)
     
+    # Save to file, with its entity index
+    output_filename = "Entity_resolution_map1.json"
+    with EntityMapWriter(output_filename, index=True) as writer:
+        for entity_id, entity in enhanced_output['entities'].items():
+            writer.write(entity_id, entity)
     
     return enhanced_output
 
+# same map as generate_enhanced_json_output, streamed to the file (or a directory of shards) one
+# entity at a time instead of held in memory; returns the path written
+def write_enhanced_json_output(workers=None, compact=False, shard_size=None, database=None, event_log=None):
+    datasets = load_all_datasets()
+    if not datasets:
+        return None
+    
+    resolver = ImprovedEntityResolver(datasets)
+    resolver.resolve_all_entities_full_pipeline()
+    
+    output_filename = "Entity_resolution_map1" if shard_size else "Entity_resolution_map1.json"
+    resolver.write_enhanced_json_output(output_filename, compact, shard_size, workers, database=database)
+    if event_log:
+        resolver.write_event_log(event_log)
+    
+    return output_filename
+
 if __name__ == "__main__":
-    enhanced_json = generate_enhanced_json_output()
+    output_path = write_enhanced_json_output()
     
 
         
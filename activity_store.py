@@ -0,0 +1,458 @@
+import numpy as np
+import pandas as pd
+from collections.abc import Mapping, Sequence
+
+# int64 value used for missing timestamps (same as pandas NaT)
+NAT = np.iinfo(np.int64).min
+
+# location column precedence, same as CompleteEntityResolver._extract_location
+LOCATION_FIELDS = ['location_id', 'ap_id', 'room_id']
+
+# store columns and their dtypes
+ACTIVITY_COLUMNS = {
+    'entity': np.int32,
+    'source': np.int16,
+    'timestamp': np.int64,
+    'location': np.int32,
+    'row': np.int64,
+    'confidence': np.float64,
+    'provenance': np.int16
+}
+
+def location_field(df):
+    """Location column of a source frame, None when it has none"""
+    for field in LOCATION_FIELDS:
+        if field in df.columns:
+            return field
+    return None
+
+def timestamps_to_isoformat(timestamps):
+    """isoformat() strings for int64 epoch-ns timestamps, computed for the whole array"""
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    iso = np.datetime_as_string(timestamps.view('datetime64[ns]'), unit='s').astype(object)
+
+    # sub-second values keep the exact Timestamp.isoformat() rendering
+    for position in np.flatnonzero((timestamps % 1_000_000_000 != 0) & (timestamps != NAT)):
+        iso[position] = pd.Timestamp(timestamps[position]).isoformat()
+
+    return iso
+
+def hour_of(timestamps):
+    """Hour of day for int64 epoch-ns timestamps"""
+    return (np.asarray(timestamps, dtype=np.int64) // 3_600_000_000_000) % 24
+
+def weekday_of(timestamps):
+    """Day of week (Monday=0) for int64 epoch-ns timestamps"""
+    return (np.asarray(timestamps, dtype=np.int64) // 86_400_000_000_000 + 3) % 7
+
+def ordered_counts(values):
+    """Distinct values in first-occurrence order and how often each occurs"""
+    codes, uniques = pd.factorize(np.asarray(values))
+    return uniques.tolist(), np.bincount(codes[codes >= 0], minlength=len(uniques)).tolist()
+
+def grouped_ordered_counts(groups, values):
+    """Counts of every (group, value) pair for non-negative integer arrays; pairs come out
+    ordered by group, then by the value's first occurrence within the group"""
+    groups = np.asarray(groups, dtype=np.int64)
+    values = np.asarray(values, dtype=np.int64)
+    if len(groups) == 0:
+        return groups, values, np.zeros(0, dtype=np.int64)
+
+    keys = groups * (int(values.max()) + 1) + values
+    _, first, counts = np.unique(keys, return_index=True, return_counts=True)
+    order = np.lexsort((first, groups[first]))
+    return groups[first][order], values[first][order], counts[order]
+
+def group_bounds(groups):
+    """group -> (start, end) slice bounds for an array sorted by group"""
+    unique_groups, starts, counts = np.unique(groups, return_index=True, return_counts=True)
+    return {group: (start, start + count) for group, start, count in
+            zip(unique_groups.tolist(), starts.tolist(), counts.tolist())}
+
+# compact columnar table of linked activities, one row per activity
+class ActivityStore:
+    def __init__(self, datasets):
+        self.datasets = datasets
+
+        # code tables for the repeated values
+        self.entity_ids = []
+        self.entity_codes = {}
+        self.sources = []
+        self.source_codes = {}
+        self.locations = []
+        self.location_codes = {}
+        self.location_is_set = np.zeros(0, dtype=bool)
+        self.provenances = []
+        self.provenance_codes = {}
+
+        # columns grow by doubling so repeated appends stay amortized O(rows added)
+        self._columns = {name: np.zeros(0, dtype=dtype) for name, dtype in ACTIVITY_COLUMNS.items()}
+        self._size = 0
+        self._pending = []
+        self._appended_frames = {}
+        self._source_columns = {}
+        self._location_table = np.array([None], dtype=object)
+        self._entity_counts = np.zeros(0, dtype=np.int64)
+
+        # entity index: sorted index over the first _indexed_size rows plus a small one over the rest
+        self._indexed_size = 0
+        self._entity_order = np.zeros(0, dtype=np.int64)
+        self._entity_offsets = np.zeros(1, dtype=np.int64)
+        self._delta_index = None
+
+    def __len__(self):
+        return self._size + sum(len(chunk['entity']) for chunk in self._pending)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_source_columns'] = {}
+        return state
+
+    def register_source(self, dataset_name, activity_type):
+        """Fix a source's code up front; activities of an entity are ordered by source code, then row"""
+        return self._code((dataset_name, activity_type), self.sources, self.source_codes)
+
+    def add_frame(self, dataset_name, frame):
+        """Register rows appended to a source; returns the store row number of the frame's first row"""
+        start = self.source_row_count(dataset_name)
+        self._appended_frames.setdefault(dataset_name, []).append((start, frame))
+        return start
+
+    def source_row_count(self, dataset_name):
+        """Rows of a source, including appended frames"""
+        frames = self._frames(dataset_name)
+        return frames[-1][0] + len(frames[-1][1]) if frames else 0
+
+    def _frames(self, dataset_name):
+        """(first store row, frame) pieces of a source: the original frame, then appended ones"""
+        frames = [(0, self.datasets[dataset_name])] if dataset_name in self.datasets else []
+        return frames + self._appended_frames.get(dataset_name, [])
+
+    # append linked rows of one source; rows index into `frame` (the source frame by default)
+    def add(self, dataset_name, activity_type, entity_ids, rows, timestamps, confidence, provenance,
+            frame=None, row_offset=0):
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return 0
+
+        df = self.datasets[dataset_name] if frame is None else frame
+        field = location_field(df)
+        if field:
+            locations = self._encode(df[field].to_numpy()[rows], self.locations, self.location_codes)
+            self.location_is_set = np.array([bool(value) for value in self.locations], dtype=bool)
+            self._location_table = np.array(self.locations + [None], dtype=object)
+        else:
+            locations = np.full(len(rows), -1, dtype=np.int32)
+
+        entities = self._encode(np.asarray(entity_ids, dtype=object), self.entity_ids, self.entity_codes)
+        self._pending.append({
+            'entity': entities,
+            'source': np.full(len(rows), self.register_source(dataset_name, activity_type), dtype=np.int16),
+            'timestamp': np.asarray(timestamps, dtype=np.int64),
+            'location': locations,
+            'row': rows + row_offset,
+            'confidence': np.broadcast_to(np.asarray(confidence, dtype=np.float64), len(rows)).copy(),
+            'provenance': np.full(len(rows), self._code(provenance, self.provenances, self.provenance_codes), dtype=np.int16)
+        })
+
+        counts = np.bincount(entities, minlength=len(self.entity_ids))
+        counts[:len(self._entity_counts)] += self._entity_counts
+        self._entity_counts = counts
+        self._delta_index = None
+        return len(rows)
+
+    def update_confidence(self, positions, confidence):
+        """Overwrite the confidence of activities already in the store"""
+        self.column('confidence')[positions] = confidence
+
+    def _code(self, value, table, codes):
+        if value not in codes:
+            codes[value] = len(table)
+            table.append(value)
+        return codes[value]
+
+    def _encode(self, values, table, codes):
+        """Map values to codes of a code table; missing values become -1"""
+        value_codes, uniques = pd.factorize(values)
+        table_codes = np.array([self._code(value, table, codes) for value in uniques.tolist()], dtype=np.int32)
+        encoded = np.full(len(values), -1, dtype=np.int32)
+        present = value_codes >= 0
+        encoded[present] = table_codes[value_codes[present]]
+        return encoded
+
+    def column(self, name):
+        """Full column, in insertion order"""
+        if self._pending:
+            added = sum(len(chunk['entity']) for chunk in self._pending)
+            capacity = len(self._columns['entity'])
+            if self._size + added > capacity:
+                capacity = max(self._size + added, 2 * capacity)
+                for column, values in self._columns.items():
+                    grown = np.zeros(capacity, dtype=values.dtype)
+                    grown[:self._size] = values[:self._size]
+                    self._columns[column] = grown
+
+            for chunk in self._pending:
+                end = self._size + len(chunk['entity'])
+                for column in ACTIVITY_COLUMNS:
+                    self._columns[column][self._size:end] = chunk[column]
+                self._size = end
+            self._pending = []
+        return self._columns[name][:self._size]
+
+    def _canonical_order(self, positions):
+        """Positions sorted by (entity, source code, row), the order a full rebuild links them in"""
+        return positions[np.lexsort((self.column('row')[positions], self.column('source')[positions],
+                                     self.column('entity')[positions]))]
+
+    # the sorted index is rebuilt once the unindexed tail outgrows a quarter of the store
+    def _update_entity_index(self):
+        size = len(self)
+        if size - self._indexed_size > max(1024, size // 4):
+            self._entity_order = self._canonical_order(np.arange(size))
+            counts = np.bincount(self.column('entity'), minlength=len(self.entity_ids))
+            self._entity_offsets = np.concatenate(([0], np.cumsum(counts)))
+            self._indexed_size = size
+            self._delta_index = None
+
+        if self._delta_index is None:
+            delta = self._canonical_order(np.arange(self._indexed_size, size))
+            self._delta_index = (delta, group_bounds(self.column('entity')[delta]))
+
+    def entity_positions(self, entity_id):
+        """Store positions of an entity's activities, ordered by source code, then row"""
+        if entity_id not in self.entity_codes:
+            return np.zeros(0, dtype=np.int64)
+        self._update_entity_index()
+        code = self.entity_codes[entity_id]
+
+        indexed = np.zeros(0, dtype=np.int64)
+        if code + 1 < len(self._entity_offsets):
+            indexed = self._entity_order[self._entity_offsets[code]:self._entity_offsets[code + 1]]
+
+        delta, delta_bounds = self._delta_index
+        if code not in delta_bounds:
+            return indexed
+        start, end = delta_bounds[code]
+        return self._canonical_order(np.concatenate((indexed, delta[start:end])))
+
+    def entity_count(self, entity_id):
+        code = self.entity_codes.get(entity_id)
+        return int(self._entity_counts[code]) if code is not None else 0
+
+    def entities(self):
+        """Entity ids that have at least one activity"""
+        return [self.entity_ids[code] for code in np.flatnonzero(self._entity_counts)]
+
+    def entity_columns(self, entity_id):
+        """An entity's slice of every column (plus its store positions), in entity order"""
+        positions = self.entity_positions(entity_id)
+        columns = {name: self.column(name)[positions] for name in ACTIVITY_COLUMNS}
+        columns['position'] = positions
+        return columns
+
+    def entity_activity_index(self, entity_id):
+        """store position -> (activity_type, index among the entity's activities of that type)"""
+        positions = self.entity_positions(entity_id)
+        seen = {}
+        index = {}
+        for position, source_code in zip(positions.tolist(), self.column('source')[positions].tolist()):
+            activity_type = self.sources[source_code][1]
+            index[position] = (activity_type, seen.get(activity_type, 0))
+            seen[activity_type] = index[position][1] + 1
+        return index
+
+    def activity_types(self, entity_id):
+        """Activity types of an entity, in source order"""
+        source_codes = pd.unique(self.column('source')[self.entity_positions(entity_id)])
+        return [self.sources[code][1] for code in source_codes]
+
+    def location_values(self, location_codes):
+        """Raw location values for location codes (None for rows without one)"""
+        return self._location_table[location_codes]
+
+    def location_mask(self, location_codes):
+        """True where the row has a usable (truthy) location"""
+        is_set = np.append(self.location_is_set, False)
+        return is_set[location_codes]
+
+    def _columns_of(self, dataset_name, start, frame):
+        """Column arrays of a source frame, cached until the frame is replaced"""
+        cached = self._source_columns.get((dataset_name, start))
+        if cached is None or cached[0] is not frame:
+            columns = {}
+            for name in frame.columns:
+                series = frame[name]
+                # plain numpy columns are read directly, the rest through pandas
+                if isinstance(series.dtype, np.dtype) and series.dtype.kind not in 'mM':
+                    columns[name] = series.to_numpy()
+                else:
+                    columns[name] = series
+            cached = (frame, columns)
+            self._source_columns[(dataset_name, start)] = cached
+        return cached[1]
+
+    def _frame_rows(self, dataset_name, rows):
+        """(frame start, frame, positions in rows, local rows) for each frame the rows fall in"""
+        frames = self._frames(dataset_name)
+        if len(frames) == 1:
+            return [(frames[0][0], frames[0][1], np.arange(len(rows)), rows)]
+
+        starts = np.array([start for start, _ in frames], dtype=np.int64)
+        frame_numbers = np.searchsorted(starts, rows, side='right') - 1
+        pieces = []
+        for frame_number in np.unique(frame_numbers):
+            selected = np.flatnonzero(frame_numbers == frame_number)
+            start, frame = frames[frame_number]
+            pieces.append((start, frame, selected, rows[selected] - start))
+        return pieces
+
+    def subset(self, entity_ids, fields=None):
+        """New store holding only the given entities' activities, with the source frames cut
+        down to the referenced rows (and to `fields` per activity type, when given)"""
+        positions = np.sort(np.concatenate([self.entity_positions(entity_id) for entity_id in entity_ids]
+                                           + [np.zeros(0, dtype=np.int64)]))
+        source_codes = self.column('source')[positions]
+        rows = self.column('row')[positions]
+
+        # referenced rows of each source frame, renumbered from zero
+        datasets = {}
+        new_rows = np.zeros(len(positions), dtype=np.int64)
+        source_datasets = np.array([dataset_name for dataset_name, _ in self.sources] + [None], dtype=object)
+        for dataset_name in pd.unique(source_datasets[source_codes]):
+            selected = source_datasets[source_codes] == dataset_name
+            kept_rows, new_rows[selected] = np.unique(rows[selected], return_inverse=True)
+
+            columns = None
+            if fields is not None:
+                activity_types = [activity_type for name, activity_type in self.sources if name == dataset_name]
+                columns = list(dict.fromkeys(field for activity_type in activity_types
+                                             for field in fields.get(activity_type, [])))
+            pieces = []
+            for _, frame, _, local_rows in self._frame_rows(dataset_name, kept_rows):
+                frame = frame if columns is None else frame[[field for field in columns if field in frame.columns]]
+                pieces.append(frame.iloc[local_rows])
+            datasets[dataset_name] = pd.concat(pieces).reset_index(drop=True) if len(pieces) > 1 else pieces[0].reset_index(drop=True)
+
+        subset = ActivityStore(datasets)
+        subset.entity_ids = [entity_id for entity_id in entity_ids if entity_id in self.entity_codes]
+        subset.entity_codes = {entity_id: code for code, entity_id in enumerate(subset.entity_ids)}
+        subset.sources, subset.source_codes = list(self.sources), dict(self.source_codes)
+        subset.locations, subset.location_codes = list(self.locations), dict(self.location_codes)
+        subset.location_is_set, subset._location_table = self.location_is_set, self._location_table
+        subset.provenances, subset.provenance_codes = list(self.provenances), dict(self.provenance_codes)
+
+        entity_map = np.full(len(self.entity_ids), -1, dtype=np.int32)
+        entity_map[[self.entity_codes[entity_id] for entity_id in subset.entity_ids]] = np.arange(len(subset.entity_ids))
+        columns = {name: self.column(name)[positions] for name in ACTIVITY_COLUMNS}
+        columns['entity'] = entity_map[columns['entity']]
+        columns['row'] = new_rows
+        subset._pending = [columns]
+        subset._entity_counts = np.bincount(columns['entity'], minlength=len(subset.entity_ids))
+        return subset
+
+    def records(self, positions, fields=None):
+        """Source records for store positions, read back from the source frames;
+        fields optionally maps activity_type -> columns to keep"""
+        positions = np.asarray(positions, dtype=np.int64)
+        records = [None] * len(positions)
+        source_codes = self.column('source')[positions]
+        rows = self.column('row')[positions]
+
+        for source_code in np.unique(source_codes):
+            dataset_name, activity_type = self.sources[source_code]
+            selected = np.flatnonzero(source_codes == source_code)
+
+            for start, frame, in_frame, local_rows in self._frame_rows(dataset_name, rows[selected]):
+                columns = self._columns_of(dataset_name, start, frame)
+                names = list(columns) if fields is None else [field for field in fields.get(activity_type, []) if field in columns]
+                values = [columns[name][local_rows].tolist() if isinstance(columns[name], np.ndarray)
+                          else columns[name].iloc[local_rows].tolist() for name in names]
+
+                if names:
+                    for position, row_values in zip(selected[in_frame], zip(*values)):
+                        records[position] = dict(zip(names, row_values))
+                else:
+                    for position in selected[in_frame]:
+                        records[position] = {}
+
+        return records
+
+    def materialize(self, positions):
+        """Activity dicts in the original entity_activities layout"""
+        positions = np.asarray(positions, dtype=np.int64)
+        timestamps = self.column('timestamp')[positions]
+        confidences = self.column('confidence')[positions]
+        source_codes = self.column('source')[positions]
+        provenance_codes = self.column('provenance')[positions]
+
+        activities = []
+        for record, timestamp, confidence, source_code, provenance_code in zip(
+                self.records(positions), timestamps, confidences, source_codes, provenance_codes):
+            activities.append({
+                'record': record,
+                'source': self.sources[source_code][0],
+                'confidence': float(confidence),
+                'provenance': self.provenances[provenance_code],
+                'timestamp': pd.Timestamp(timestamp) if timestamp != NAT else None
+            })
+        return activities
+
+    def entity_activity_dicts(self, entity_id):
+        """activity_type -> list of activity dicts for one entity"""
+        positions = self.entity_positions(entity_id)
+        source_codes = self.column('source')[positions]
+
+        grouped = {}
+        for source_code in pd.unique(source_codes):
+            activity_type = self.sources[source_code][1]
+            grouped.setdefault(activity_type, []).extend(self.materialize(positions[source_codes == source_code]))
+        return grouped
+
+# read-only entity_id -> {activity_type: [activity dicts]} view over an ActivityStore
+class EntityActivitiesView(Mapping):
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, entity_id):
+        return self.store.entity_activity_dicts(entity_id)
+
+    def __iter__(self):
+        return iter(self.store.entities())
+
+    def __len__(self):
+        return len(self.store.entities())
+
+    def __contains__(self, entity_id):
+        return self.store.entity_count(entity_id) > 0
+
+# lazy sequence of activity dicts referenced by store position; records are read from the
+# source frames only when the activities are accessed
+class ActivityRefs(Sequence):
+    def __init__(self, store, positions):
+        self.store = store
+        self.positions = np.asarray(positions, dtype=np.int64)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.store.materialize(self.positions[index])
+        return self.store.materialize(self.positions[[index]])[0]
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __iter__(self):
+        return iter(self.store.materialize(self.positions))
+
+    def source_names(self):
+        """Dataset name of each referenced activity, without reading the records"""
+        return [self.store.sources[code][0] for code in self.store.column('source')[self.positions]]
+
+    def first_timestamp(self):
+        timestamp = self.store.column('timestamp')[self.positions[0]]
+        return pd.Timestamp(timestamp) if timestamp != NAT else None
+
+    def references(self, index):
+        """(activity_type, index in the entity's activities of that type) per referenced activity,
+        given index: store position -> that pair (see ActivityStore.entity_activity_index)"""
+        return [list(index[position]) for position in self.positions.tolist()]
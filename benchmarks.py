@@ -0,0 +1,185 @@
+import io
+import os
+import time
+import contextlib
+import numpy as np
+import pandas as pd
+from EntityResolver import CompleteEntityResolver
+from Entity_resolution_map_code_file import ImprovedEntityResolver, IncrementalEntityResolver
+from face_index import FaceEmbeddingIndex
+
+# synthetic profiles with the same identifier columns as the real profile csv
+def make_profiles(n_entities, seed=0):
+    rng = np.random.default_rng(seed)
+    numbers = np.arange(n_entities)
+    return pd.DataFrame({
+        'entity_id': [f"E{100000 + i}" for i in numbers],
+        'name': [f"Person {i}" for i in numbers],
+        'role': rng.choice(['student', 'staff'], n_entities),
+        'email': [f"user{i}@campus.edu" for i in numbers],
+        'department': rng.choice(['CS', 'EE', 'ME', 'Physics'], n_entities),
+        'student_id': [f"S{i}" for i in numbers],
+        'card_id': [f"C{i}" for i in numbers],
+        'device_hash': [f"DH{i:08x}" for i in numbers],
+        'face_id': [f"F{i}" for i in numbers]
+    })
+
+# synthetic wifi log, unknown_fraction of the rows come from devices not in any profile
+def make_wifi_logs(profiles, n_rows, unknown_fraction=0.1, seed=0):
+    rng = np.random.default_rng(seed)
+    devices = profiles['device_hash'].to_numpy()[rng.integers(0, len(profiles), n_rows)]
+    unknown = rng.random(n_rows) < unknown_fraction
+    devices[unknown] = [f"VISITOR{i}" for i in rng.integers(0, 10000, unknown.sum())]
+    timestamps = pd.Timestamp('2025-09-01') + pd.to_timedelta(rng.integers(0, 7 * 86400, n_rows), unit='s')
+    return pd.DataFrame({
+        'device_hash': devices,
+        'ap_id': rng.choice(['AP_ENG_1', 'AP_LAB_2', 'AP_AUD_1', 'AP_LIB_3'], n_rows),
+        'timestamp': timestamps.strftime('%Y-%m-%d %H:%M:%S')
+    })
+
+# throughput of the columnar identifier join used by _link_all_data_sources
+def benchmark_identifier_join(n_entities=100000, n_rows=5000000):
+    profiles = make_profiles(n_entities)
+    wifi = make_wifi_logs(profiles, n_rows)
+
+    resolver = CompleteEntityResolver({'profile': profiles, 'wifi_logs': wifi})
+    resolver._build_complete_entity_maps()
+
+    start = time.perf_counter()
+    entity_ids = resolver._join_entity_ids(wifi['device_hash'])
+    elapsed = time.perf_counter() - start
+
+    linked = int(pd.notna(entity_ids).sum())
+    print(f"Identifier join: {n_rows} rows, {linked} linked in {elapsed:.2f}s "
+          f"({n_rows / elapsed / 1e6:.2f}M rows/s)")
+    return elapsed
+
+
+# wall time of the enhanced entity stage, serial vs sharded over a process pool
+def benchmark_parallel_resolution(n_entities=20000, n_rows=2000000, worker_counts=None):
+    profiles = make_profiles(n_entities)
+    wifi = make_wifi_logs(profiles, n_rows)
+    worker_counts = worker_counts or sorted({1, 2, 4, os.cpu_count() or 1})
+
+    resolver = ImprovedEntityResolver({'profile': profiles, 'wifi_logs': wifi})
+    with contextlib.redirect_stdout(io.StringIO()):
+        resolver.resolve_all_entities_full_pipeline()
+
+    timings = {}
+    for workers in worker_counts:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            resolver.generate_enhanced_json_output(workers)
+        timings[workers] = time.perf_counter() - start
+        print(f"Enhanced entities with {workers} worker(s): {timings[workers]:.2f}s "
+              f"(speedup {timings[worker_counts[0]] / timings[workers]:.2f}x)")
+    return timings
+
+
+# cost of applying a new wifi batch to a built map, by batch size, against a full rebuild
+def benchmark_incremental_update(n_entities=20000, n_rows=2000000, batch_sizes=(100, 1000, 10000, 100000)):
+    profiles = make_profiles(n_entities)
+    wifi = make_wifi_logs(profiles, n_rows)
+    batches = {size: make_wifi_logs(profiles, size, seed=size) for size in batch_sizes}
+    
+    resolver = IncrementalEntityResolver({'profile': profiles, 'wifi_logs': wifi})
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        resolver.build()
+    rebuild = time.perf_counter() - start
+    print(f"Full build of {n_rows} rows: {rebuild:.2f}s")
+    
+    timings = {}
+    for size, batch in batches.items():
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            touched = resolver.apply_batch({'wifi_logs': batch})
+        timings[size] = time.perf_counter() - start
+        print(f"Batch of {size} rows ({len(touched)} entities): {timings[size]:.2f}s "
+              f"({rebuild / timings[size]:.1f}x faster than a rebuild)")
+    return timings
+
+
+# queries per second of exact and ivf face search, with ivf top-1 agreement against exact
+def benchmark_face_index(gallery_size=100000, dim=128, n_queries=10000, k=5, seed=0):
+    rng = np.random.default_rng(seed)
+    gallery = rng.normal(size=(gallery_size, dim)).astype(np.float32)
+    gallery /= np.linalg.norm(gallery, axis=1, keepdims=True)
+    
+    # queries are noisy re-captures of gallery faces
+    targets = rng.integers(0, gallery_size, n_queries)
+    queries = gallery[targets] + rng.normal(scale=0.5 / np.sqrt(dim), size=(n_queries, dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    
+    results = {}
+    for mode in ['exact', 'ivf']:
+        start = time.perf_counter()
+        index = FaceEmbeddingIndex(gallery, np.arange(gallery_size), mode=mode)
+        build = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        _, indices = index.search(queries, k)
+        elapsed = time.perf_counter() - start
+        results[mode] = indices[:, 0]
+        print(f"Face index {mode}: {gallery_size} x {dim} gallery, built in {build:.2f}s, "
+              f"{n_queries / elapsed:.0f} queries/s, top-1 hit rate {(indices[:, 0] == targets).mean():.3f}")
+    
+    print(f"ivf top-1 agrees with exact on {(results['ivf'] == results['exact']).mean():.3f} of queries")
+    return results
+
+
+# random pronounceable names, so the phonetic and n-gram blocking keys behave like real ones
+def make_names(n, seed=0):
+    rng = np.random.default_rng(seed)
+    syllables = np.array(['an', 'be', 'ca', 'di', 'el', 'fo', 'ga', 'ha', 'is', 'jo', 'ka', 'li', 'mo', 'na',
+                          'or', 'pe', 'ra', 'si', 'ta', 'ul', 'va', 'wi', 'ya', 'zo'])
+    def words(count):
+        parts = syllables[rng.integers(0, len(syllables), (n, count))]
+        return [''.join(row).capitalize() for row in parts]
+    return [f"{first} {last}" for first, last in zip(words(2), words(3))]
+
+# misspell a name by replacing, dropping or doubling one letter
+def misspell(names, seed=0):
+    rng = np.random.default_rng(seed)
+    misspelled = []
+    for name, edit, position in zip(names, rng.integers(0, 3, len(names)), rng.random(len(names))):
+        i = 1 + int(position * (len(name) - 2))
+        misspelled.append([name[:i] + 'x' + name[i + 1:], name[:i] + name[i + 1:], name[:i] + name[i] + name[i:]][edit])
+    return misspelled
+
+# blocked fuzzy matching of misspelled name mentions against the profile names
+def benchmark_fuzzy_matching(n_profiles=100000, n_mentions=1000000, distinct_mentions=200000):
+    profiles = make_profiles(n_profiles)
+    profiles['name'] = make_names(n_profiles)
+    
+    rng = np.random.default_rng(1)
+    targets = rng.integers(0, n_profiles, distinct_mentions)
+    mentions = np.array(misspell(profiles['name'].to_numpy()[targets]), dtype=object)
+    picks = rng.integers(0, distinct_mentions, n_mentions)
+    notes = pd.DataFrame({'entity_id': mentions[picks], 'text': '', 'timestamp': '2025-09-01 10:00:00'})
+    
+    resolver = CompleteEntityResolver({'profile': profiles, 'text_notes': notes})
+    with contextlib.redirect_stdout(io.StringIO()):
+        resolver._build_complete_entity_maps()
+    
+    start = time.perf_counter()
+    resolver._build_fuzzy_matchers()
+    build = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    matches = resolver._match_fuzzy_mentions(notes, np.arange(n_mentions), ['entity_id'], [])
+    elapsed = time.perf_counter() - start
+    
+    rows, entity_ids, _ = matches.get('fuzzy_name_match', (np.zeros(0, dtype=np.int64), [], []))
+    correct = (np.asarray(entity_ids, dtype=object) == profiles['entity_id'].to_numpy()[targets[picks[rows]]]).mean() if len(rows) else 0
+    print(f"Fuzzy matching: {n_profiles} profiles x {n_mentions} mentions ({distinct_mentions} distinct), "
+          f"matchers built in {build:.2f}s, matched {len(rows)} in {elapsed:.2f}s, {correct:.3f} correct")
+    return elapsed
+
+
+if __name__ == "__main__":
+    benchmark_identifier_join()
+    benchmark_parallel_resolution()
+    benchmark_incremental_update()
+    benchmark_face_index()
+    benchmark_fuzzy_matching()
@@ -0,0 +1,403 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import json
+import numpy as np
+import pandas as pd
+from face_index import EMBEDDING_COLUMN, embedding_columns
+from source_cache import SourceCache, SOURCE_CACHE_DIR
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, peak RSS is then left out of the load report
+    resource = None
+
+# formats tried when a source has no known timestamp format (month-first before
+# day-first, matching what pd.to_datetime does for a single ambiguous value)
+CANDIDATE_TIMESTAMP_FORMATS = [
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%d',
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%Y %H:%M',
+    '%m/%d/%Y',
+    '%d/%m/%Y %H:%M:%S',
+    '%d/%m/%Y %H:%M',
+    '%d/%m/%Y'
+]
+
+# known timestamp format per dataset, filled in when a feed's format is fixed
+KNOWN_TIMESTAMP_FORMATS = {}
+
+# per source CSV schema: columns to load (None loads all, e.g. embedding dimensions), columns read
+# as categoricals, id columns made categorical when they repeat enough, and timestamp columns
+SOURCE_SCHEMAS = {
+    'profile': {
+        'columns': ['entity_id', 'name', 'role', 'email', 'department', 'student_id', 'staff_id',
+                    'card_id', 'device_hash', 'face_id'],
+        'categorical': ['role', 'department'],
+        'repeated_ids': [],
+        'timestamps': []
+    },
+    'wifi_logs': {
+        'columns': ['device_hash', 'ap_id', 'timestamp'],
+        'categorical': ['ap_id'],
+        'repeated_ids': ['device_hash'],
+        'timestamps': ['timestamp']
+    },
+    'campus_swipes': {
+        'columns': ['card_id', 'location_id', 'timestamp'],
+        'categorical': ['location_id'],
+        'repeated_ids': ['card_id'],
+        'timestamps': ['timestamp']
+    },
+    'library_check': {
+        'columns': ['entity_id', 'book_id', 'timestamp'],
+        'categorical': [],
+        'repeated_ids': ['entity_id'],
+        'timestamps': ['timestamp']
+    },
+    'lab_bookings': {
+        'columns': ['entity_id', 'room_id', 'start_time', 'end_time'],
+        'categorical': ['room_id'],
+        'repeated_ids': ['entity_id'],
+        'timestamps': ['start_time', 'end_time']
+    },
+    'text_notes': {
+        'columns': ['entity_id', 'name', 'email', 'category', 'text', 'timestamp'],
+        'categorical': ['category'],
+        'repeated_ids': ['entity_id'],
+        'timestamps': ['timestamp']
+    },
+    'face_vector': {
+        'columns': None,
+        'categorical': [],
+        'repeated_ids': [],
+        'timestamps': ['timestamp']
+    },
+    'cctv_frame': {
+        'columns': None,
+        'categorical': ['location_id'],
+        'repeated_ids': ['face_id'],
+        'timestamps': ['timestamp']
+    }
+}
+
+# per source validation: columns every row needs (the id it is linked by), timestamp columns that
+# must parse and fall in TIMESTAMP_RANGE, and whether the rows carry face embeddings to check
+VALIDATION_RULES = {
+    'profile': {'required': ['entity_id'], 'timestamps': []},
+    'wifi_logs': {'required': ['device_hash'], 'timestamps': ['timestamp']},
+    'campus_swipes': {'required': ['card_id'], 'timestamps': ['timestamp']},
+    'library_check': {'required': ['entity_id'], 'timestamps': ['timestamp']},
+    'lab_bookings': {'required': ['entity_id'], 'timestamps': ['start_time']},
+    'text_notes': {'required': [], 'timestamps': ['timestamp']},
+    'face_vector': {'required': ['face_id'], 'timestamps': [], 'embeddings': True},
+    'cctv_frame': {'required': ['face_id'], 'timestamps': ['timestamp']}
+}
+
+# accepted event times; a fixed range so a rerun on the same data quarantines the same rows
+# (None leaves that side open)
+TIMESTAMP_RANGE = ('2000-01-01', '2100-01-01')
+
+# known ids per location column; a column with no entry is not checked
+KNOWN_LOCATIONS = {}
+
+# face embedding length; None takes the most common length of the source
+EXPECTED_EMBEDDING_DIM = None
+
+# where the resolvers write failing rows, one JSON line per row with its reason codes and raw values;
+# a validate_datasets run that quarantines rows starts the file over, one that quarantines none leaves it
+QUARANTINE_PATH = 'quarantine.jsonl'
+
+NUMBER_LIST_PATTERN = r"\s*\[?\s*[-+0-9.eE]+(\s*,\s*[-+0-9.eE]+)*\s*\]?\s*"
+
+# a repeated id column becomes categorical when it has at most this many distinct values per row
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+# pick the candidate format that parses most of a sample of the column
+def infer_timestamp_format(values, sample_size=1000):
+    sample = values.dropna().iloc[:sample_size]
+    if len(sample) == 0:
+        return None
+
+    best_format = None
+    best_parsed = 0
+    for candidate in CANDIDATE_TIMESTAMP_FORMATS:
+        parsed = pd.to_datetime(sample, format=candidate, errors='coerce').notna().sum()
+        if parsed > best_parsed:
+            best_format, best_parsed = candidate, parsed
+            if parsed == len(sample):
+                break
+
+    return best_format
+
+# parse a whole timestamp column; returns datetime64 values and the unparseable count
+def parse_timestamp_column(values, timestamp_format=None):
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values, 0
+
+    if timestamp_format:
+        parsed = pd.to_datetime(values, format=timestamp_format, errors='coerce')
+    else:
+        parsed = pd.to_datetime(values, format='mixed', errors='coerce')
+
+    # values that do not follow the column format get a per-value parse
+    leftover = parsed.isna() & values.notna()
+    if timestamp_format and leftover.any():
+        parsed[leftover] = pd.to_datetime(values[leftover], format='mixed', errors='coerce')
+        leftover = parsed.isna() & values.notna()
+
+    return parsed, int(leftover.sum())
+
+# normalize the timestamp column of every source once, at ingestion
+def normalize_source_timestamps(datasets, timestamp_fields):
+    source_timestamps = {}
+    report = {}
+
+    for dataset_name, field in timestamp_fields.items():
+        if dataset_name not in datasets or field not in datasets[dataset_name].columns:
+            continue
+
+        values = datasets[dataset_name][field]
+
+        # columns parsed by load_source_csv keep the results of that parse
+        loaded = datasets[dataset_name].attrs.get('parsed_timestamps', {}).get(field)
+        if loaded and pd.api.types.is_datetime64_any_dtype(values):
+            source_timestamps[dataset_name] = values
+            report[dataset_name] = {
+                'field': field,
+                'format': loaded['format'],
+                'rows': len(values),
+                'missing': loaded['missing'],
+                'unparseable': loaded['unparseable']
+            }
+            continue
+
+        timestamp_format = KNOWN_TIMESTAMP_FORMATS.get(dataset_name) or infer_timestamp_format(values)
+        parsed, unparseable = parse_timestamp_column(values, timestamp_format)
+
+        source_timestamps[dataset_name] = parsed
+        report[dataset_name] = {
+            'field': field,
+            'format': timestamp_format or 'mixed',
+            'rows': len(values),
+            'missing': int(values.isna().sum()),
+            'unparseable': unparseable
+        }
+
+    return source_timestamps, report
+
+# print per source timestamp parsing results
+def print_timestamp_report(report):
+    for dataset_name, stats in report.items():
+        print(f"{dataset_name}.{stats['field']}: format {stats['format']}, "
+              f"{stats['unparseable']}/{stats['rows']} unparseable, {stats['missing']} missing")
+
+# read one source CSV with its schema; timestamps are parsed here and the parse results kept in
+# df.attrs so normalize_source_timestamps can report them
+def load_source_csv(dataset_name, path, schema=None):
+    schema = schema or {}
+    columns = schema.get('columns')
+    start = time.perf_counter()
+
+    df = pd.read_csv(path, usecols=(lambda name: name in columns) if columns is not None else None)
+
+    # categories keep the dtype read_csv infers, so numeric location ids stay numbers
+    for field in schema.get('categorical', []):
+        if field in df.columns:
+            df[field] = df[field].astype('category')
+
+    # one factorize both counts the distinct ids and builds the categorical
+    for field in schema.get('repeated_ids', []):
+        if field in df.columns:
+            codes, uniques = pd.factorize(df[field])
+            if len(uniques) <= CATEGORY_MAX_UNIQUE_RATIO * len(df):
+                df[field] = pd.Categorical.from_codes(codes, uniques)
+
+    parsed_timestamps = {}
+    for field in schema.get('timestamps', []):
+        if field not in df.columns:
+            continue
+        timestamp_format = KNOWN_TIMESTAMP_FORMATS.get(dataset_name) or infer_timestamp_format(df[field])
+        missing = int(df[field].isna().sum())
+        parsed, unparseable = parse_timestamp_column(df[field], timestamp_format)
+        df[field] = parsed
+        parsed_timestamps[field] = {'format': timestamp_format or 'mixed', 'missing': missing, 'unparseable': unparseable}
+    df.attrs['parsed_timestamps'] = parsed_timestamps
+
+    stats = {
+        'path': path,
+        'rows': len(df),
+        'columns': len(df.columns),
+        'seconds': time.perf_counter() - start,
+        'memory_mb': df.memory_usage(deep=True).sum() / 2**20
+    }
+    return df, stats
+
+# load every source concurrently, through the on-disk cache of parsed frames unless cache_dir is None;
+# returns the datasets and per file load stats
+def load_datasets(paths, schemas=SOURCE_SCHEMAS, max_workers=None, cache_dir=SOURCE_CACHE_DIR):
+    start = time.perf_counter()
+    cache = SourceCache(cache_dir) if cache_dir else None
+
+    def load(dataset_name, path):
+        if cache is None:
+            return load_source_csv(dataset_name, path, schemas.get(dataset_name))
+        return cache.load(dataset_name, path, schemas.get(dataset_name), load_source_csv)
+
+    with ThreadPoolExecutor(max_workers=max_workers or min(len(paths), os.cpu_count() or 1) or 1) as executor:
+        futures = {dataset_name: executor.submit(load, dataset_name, path) for dataset_name, path in paths.items()}
+        loaded = {dataset_name: future.result() for dataset_name, future in futures.items()}
+
+    datasets = {dataset_name: df for dataset_name, (df, _) in loaded.items()}
+    report = {dataset_name: stats for dataset_name, (_, stats) in loaded.items()}
+    report['total'] = {'seconds': time.perf_counter() - start, 'peak_rss_mb': peak_rss_mb()}
+    return datasets, report
+
+def peak_rss_mb():
+    """Peak resident memory of the process in MB; None where the platform does not report it"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+# print per file load time and memory
+def print_load_report(report):
+    for dataset_name, stats in report.items():
+        if dataset_name == 'total':
+            continue
+        cached = ' (cached)' if stats.get('cached') else ''
+        print(f"{dataset_name}: {stats['rows']} rows x {stats['columns']} columns in {stats['seconds']:.2f}s{cached}, "
+              f"{stats['memory_mb']:.1f} MB")
+
+    total = report.get('total', {})
+    peak = f", peak RSS {total['peak_rss_mb']:.0f} MB" if total.get('peak_rss_mb') is not None else ''
+    print(f"Loaded {len(report) - 1} sources in {total.get('seconds', 0.0):.2f}s{peak}")
+
+# failure mask per reason code for the rows of one source; timestamp columns given as strings are
+# replaced by their parsed values in the returned frame. A missing timestamp is not a failure, the
+# row is linked without a time like before validation
+def validate_source(dataset_name, df, rules=None, timestamp_range=TIMESTAMP_RANGE):
+    rules = rules if rules is not None else VALIDATION_RULES.get(dataset_name, {})
+    failures = {}
+
+    # a source without the column at all is skipped at linking, not quarantined
+    for field in rules.get('required', []):
+        if field in df.columns:
+            failures['missing_id'] = failures.get('missing_id', np.zeros(len(df), dtype=bool)) | df[field].isna().to_numpy()
+
+    timestamp_fields = [field for field in rules.get('timestamps', []) if field in df.columns]
+    if timestamp_fields:
+        df = df.copy(deep=False)
+        low = pd.Timestamp(timestamp_range[0]) if timestamp_range[0] else pd.Timestamp.min
+        high = pd.Timestamp(timestamp_range[1]) if timestamp_range[1] else pd.Timestamp.max
+        invalid = np.zeros(len(df), dtype=bool)
+        out_of_range = np.zeros(len(df), dtype=bool)
+        for field in timestamp_fields:
+            present = df[field].notna().to_numpy()
+            if not pd.api.types.is_datetime64_any_dtype(df[field]):
+                timestamp_format = KNOWN_TIMESTAMP_FORMATS.get(dataset_name) or infer_timestamp_format(df[field])
+                missing = int(df[field].isna().sum())
+                parsed, unparseable = parse_timestamp_column(df[field], timestamp_format)
+                df[field] = parsed
+                df.attrs = dict(df.attrs, parsed_timestamps=dict(df.attrs.get('parsed_timestamps', {}), **{
+                    field: {'format': timestamp_format or 'mixed', 'missing': missing, 'unparseable': unparseable}}))
+            values = pd.DatetimeIndex(df[field])
+            invalid |= present & values.isna()
+            out_of_range |= ~values.isna() & ((values < low) | (values > high))
+        failures['invalid_timestamp'] = invalid
+        failures['timestamp_out_of_range'] = out_of_range
+
+    for field, known in KNOWN_LOCATIONS.items():
+        if field in df.columns and known:
+            values = df[field]
+            failures['unknown_location'] = failures.get('unknown_location', np.zeros(len(df), dtype=bool)) | (
+                values.notna() & ~values.astype(str).isin([str(value) for value in known])).to_numpy()
+
+    if rules.get('embeddings'):
+        failures['bad_embedding'] = _bad_embeddings(df)
+
+    return df, failures
+
+def _bad_embeddings(df):
+    """Rows whose embedding is missing, not a list of numbers, or of the wrong length"""
+    if EMBEDDING_COLUMN in df.columns:
+        values = df[EMBEDDING_COLUMN]
+        is_list = values.map(lambda value: isinstance(value, (list, tuple, np.ndarray))).to_numpy()
+        text = values.where(~is_list).astype(object)
+        well_formed = text.str.fullmatch(NUMBER_LIST_PATTERN).fillna(False).to_numpy(dtype=bool)
+        lengths = (text.str.count(',') + 1).fillna(0).to_numpy(dtype=np.int64)
+        lengths[is_list] = values[is_list].map(len).to_numpy(dtype=np.int64)
+        usable = well_formed | is_list
+    else:
+        columns = embedding_columns(df)
+        if not columns:
+            return np.zeros(len(df), dtype=bool)
+        matrix = df[columns].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+        usable = ~np.isnan(matrix).any(axis=1) & (np.abs(matrix).sum(axis=1) > 0)
+        lengths = np.full(len(df), len(columns), dtype=np.int64)
+
+    expected = EXPECTED_EMBEDDING_DIM
+    if expected is None:
+        expected = np.bincount(lengths[usable]).argmax() if usable.any() else 0
+    return ~usable | (lengths != expected)
+
+# validate every source, keeping only rows that pass; failing rows go to quarantine_path when given
+def validate_datasets(datasets, rules=VALIDATION_RULES, quarantine_path=None, timestamp_range=TIMESTAMP_RANGE):
+    start = time.perf_counter()
+    quarantined = 0
+    valid_datasets = {}
+    report = {}
+    for dataset_name, df in datasets.items():
+        if dataset_name not in rules:
+            valid_datasets[dataset_name] = df
+            continue
+        raw = df
+        df, failures = validate_source(dataset_name, raw, rules[dataset_name], timestamp_range)
+        valid_datasets[dataset_name] = quarantine_rows(dataset_name, df, failures, quarantine_path, raw,
+                                                       mode='a' if quarantined else 'w')
+        quarantined += len(df) - len(valid_datasets[dataset_name])
+        report[dataset_name] = {'rows': len(df), **{reason: int(mask.sum()) for reason, mask in failures.items()},
+                                'quarantined': len(df) - len(valid_datasets[dataset_name])}
+    report['total'] = {'seconds': time.perf_counter() - start}
+    return valid_datasets, report
+
+def quarantine_rows(dataset_name, df, failures, quarantine_path=None, raw=None, mode='a'):
+    """Write failing rows to quarantine_path (opened with mode) and return the passing rows of df,
+    renumbered; the file gets the rows of raw, the frame as loaded, when given"""
+    failed = np.zeros(len(df), dtype=bool)
+    for mask in failures.values():
+        failed |= mask
+    if not failed.any():
+        return df
+
+    rows = np.flatnonzero(failed)
+    reasons = [[reason for reason, mask in failures.items() if mask[row]] for row in rows.tolist()]
+    failed_rows = (df if raw is None else raw).iloc[rows].astype(object)
+    records = failed_rows.where(failed_rows.notna(), None).to_dict('records')
+    if quarantine_path:
+        with open(quarantine_path, mode) as f:
+            for row, row_reasons, record in zip(rows.tolist(), reasons, records):
+                f.write(json.dumps({'dataset': dataset_name, 'row': row, 'reasons': row_reasons, 'record': record},
+                                   default=str) + '\n')
+
+    valid = df.iloc[np.flatnonzero(~failed)].reset_index(drop=True)
+    valid.attrs = df.attrs
+    return valid
+
+# print per source validation results
+def print_validation_report(report):
+    for dataset_name, stats in report.items():
+        if dataset_name == 'total':
+            continue
+        reasons = ', '.join(f"{reason} {count}" for reason, count in stats.items()
+                            if reason not in ('rows', 'quarantined') and count)
+        print(f"{dataset_name}: {stats['quarantined']}/{stats['rows']} rows quarantined" + (f" ({reasons})" if reasons else ''))
+    print(f"Validation took {report.get('total', {}).get('seconds', 0.0):.2f}s")
@@ -0,0 +1,297 @@
+import json
+import os
+import sqlite3
+from collections.abc import Mapping
+import pandas as pd
+
+# entities written per transaction while the database is built
+DB_BATCH_SIZE = 2000
+
+# where the resolver builds the database when asked to
+ENTITY_DATABASE_PATH = 'Entity_resolution_map1.db'
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+DB_SCHEMA = """
+CREATE TABLE profiles (position INTEGER PRIMARY KEY, entity_id TEXT NOT NULL, name TEXT, role TEXT,
+                       email TEXT, department TEXT, profile TEXT);
+CREATE TABLE identifiers (identifier TEXT NOT NULL, entity_id TEXT NOT NULL);
+CREATE TABLE activities (entity_id TEXT NOT NULL, seq INTEGER NOT NULL, timestamp TEXT, activity_type TEXT,
+                         location TEXT, source TEXT, confidence REAL, provenance TEXT, details TEXT);
+CREATE TABLE aggregates (entity_id TEXT PRIMARY KEY, activity_count INTEGER, first_seen TEXT, last_seen TEXT,
+                         most_visited_location TEXT, patterns TEXT);
+CREATE TABLE features (position INTEGER PRIMARY KEY, entity_id TEXT NOT NULL, features TEXT);
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+# built after the bulk load, which is much faster than maintaining them row by row
+DB_INDEXES = """
+CREATE UNIQUE INDEX profiles_entity ON profiles (entity_id);
+CREATE INDEX identifiers_identifier ON identifiers (identifier);
+CREATE UNIQUE INDEX activities_entity_seq ON activities (entity_id, seq);
+CREATE INDEX activities_entity_time ON activities (entity_id, timestamp);
+CREATE INDEX activities_location_time ON activities (location, timestamp);
+CREATE UNIQUE INDEX features_entity ON features (entity_id);
+"""
+
+ACTIVITY_FIELDS = ['timestamp', 'activity_type', 'location', 'source', 'confidence', 'provenance', 'details']
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':'), default=str)
+
+def _column(value):
+    """A profile value sqlite can bind; anything else is stored as text"""
+    if value is None or isinstance(value, (str, int, float)):
+        return value
+    return str(value)
+
+def is_entity_database(path):
+    """True when path is an sqlite database rather than a JSON map"""
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+
+def _isoformat(value):
+    """ISO text of a time bound, comparable with the stored activity timestamps"""
+    if value is None:
+        return None
+    return pd.Timestamp(value).isoformat()
+
+# builds the entity database from enhanced entities, one batched transaction per batch_size entities,
+# in WAL mode; the file is built aside and moved into place when closed, or deleted when aborted
+class EntityDatabaseWriter:
+    def __init__(self, path, batch_size=DB_BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+        self.entity_count = 0
+        self._closed = False
+        self._build_path = path + '.tmp'
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(self._build_path + suffix):
+                os.remove(self._build_path + suffix)
+
+        self.connection = sqlite3.connect(self._build_path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.executescript(DB_SCHEMA)
+        self._clear_batch()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _clear_batch(self):
+        self._profiles, self._identifiers, self._activities, self._aggregates = [], [], [], []
+
+    def write(self, entity_id, entity):
+        entity_id = str(entity_id)
+        profile = entity.get('profile_info', {})
+        timeline = entity.get('activity_timeline', [])
+        self.entity_count += 1
+
+        self._profiles.append((self.entity_count, entity_id, _column(profile.get('name')), _column(profile.get('role')),
+                               _column(profile.get('email')), _column(profile.get('department')), _dumps(profile)))
+        self._identifiers.extend((str(identifier), entity_id) for identifier in profile.get('all_identifiers', []))
+        self._activities.extend((entity_id, seq, activity['timestamp'], activity['activity_type'], activity['location'],
+                                 activity['source'], activity['confidence'], activity['provenance'],
+                                 _dumps(activity['details'])) for seq, activity in enumerate(timeline))
+
+        # everything but the profile and timeline, in entity order, so entities rebuild exactly
+        patterns = {key: value for key, value in entity.items() if key not in ('profile_info', 'activity_timeline')}
+        timestamps = [activity['timestamp'] for activity in timeline if activity['timestamp']]
+        self._aggregates.append((entity_id, len(timeline), min(timestamps, default=None), max(timestamps, default=None),
+                                 _column(entity.get('location_analysis', {}).get('most_visited_location')),
+                                 _dumps(patterns)))
+
+        if len(self._profiles) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        with self.connection:
+            self.connection.executemany('INSERT INTO profiles VALUES (?, ?, ?, ?, ?, ?, ?)', self._profiles)
+            self.connection.executemany('INSERT INTO identifiers VALUES (?, ?)', self._identifiers)
+            self.connection.executemany('INSERT INTO activities VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', self._activities)
+            self.connection.executemany('INSERT INTO aggregates VALUES (?, ?, ?, ?, ?, ?)', self._aggregates)
+        self._clear_batch()
+
+    def close(self):
+        """Write the last batch, build the indexes and move the database into place"""
+        if self._closed:
+            return
+        self._closed = True
+        self._flush()
+        with self.connection:
+            self.connection.executescript(DB_INDEXES)
+            self.connection.executemany('INSERT INTO meta VALUES (?, ?)', [
+                ('entity_count', _dumps(self.entity_count)),
+                ('patterns_ready', _dumps(True))
+            ])
+        self.connection.execute('ANALYZE')
+        self.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self.connection.close()
+
+        for suffix in ['-wal', '-shm']:
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+        os.replace(self._build_path, self.path)
+        for suffix in ['-wal', '-shm']:
+            if os.path.exists(self._build_path + suffix):
+                os.remove(self._build_path + suffix)
+
+    def abort(self):
+        """Drop the half built database, leaving any database already at path untouched"""
+        if self._closed:
+            return
+        self._closed = True
+        self.connection.close()
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(self._build_path + suffix):
+                os.remove(self._build_path + suffix)
+
+# queries over an entity database; entities and features are also available as lazy dict-like views
+class EntityDatabase:
+    def __init__(self, path, readonly=True):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.path = path
+        self.readonly = readonly
+        if readonly:
+            self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+        self.entities = DatabaseEntities(self)
+        self.features = DatabaseFeatures(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def meta(self, key, default=None):
+        row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def timeline(self, entity_id, start=None, end=None, limit=None):
+        """An entity's activities in timeline order, optionally between two times and capped at limit"""
+        query = f"SELECT {', '.join(ACTIVITY_FIELDS)} FROM activities WHERE entity_id = ?"
+        parameters = [entity_id]
+        if start is not None:
+            query += ' AND timestamp >= ?'
+            parameters.append(_isoformat(start))
+        if end is not None:
+            query += ' AND timestamp <= ?'
+            parameters.append(_isoformat(end))
+        query += ' ORDER BY seq'
+        if limit is not None:
+            query += ' LIMIT ?'
+            parameters.append(limit)
+
+        timeline = []
+        for row in self.connection.execute(query, parameters):
+            activity = dict(zip(ACTIVITY_FIELDS, row))
+            activity['details'] = json.loads(activity['details'])
+            timeline.append(activity)
+        return timeline
+
+    def last_seen(self, entity_id):
+        """Timestamp of an entity's latest activity, None when it has none"""
+        row = self.connection.execute('SELECT last_seen FROM aggregates WHERE entity_id = ?', (entity_id,)).fetchone()
+        return pd.Timestamp(row[0]) if row and row[0] else None
+
+    def location_occupancy(self, location, start=None, end=None):
+        """Distinct entities and activities recorded at a location, optionally between two times"""
+        query = 'SELECT COUNT(DISTINCT entity_id), COUNT(*) FROM activities WHERE location = ?'
+        parameters = [location]
+        if start is not None:
+            query += ' AND timestamp >= ?'
+            parameters.append(_isoformat(start))
+        if end is not None:
+            query += ' AND timestamp <= ?'
+            parameters.append(_isoformat(end))
+        entities, activities = self.connection.execute(query, parameters).fetchone()
+        return {'location': location, 'entities': entities, 'activities': activities}
+
+    def locations(self):
+        """Every recorded location, in name order"""
+        rows = self.connection.execute('SELECT DISTINCT location FROM activities WHERE location IS NOT NULL ORDER BY location')
+        return [row[0] for row in rows]
+
+    def entity_of(self, identifier):
+        row = self.connection.execute('SELECT entity_id FROM identifiers WHERE identifier = ? LIMIT 1', (identifier,)).fetchone()
+        return row[0] if row else None
+
+    # features extracted from the entities, replacing any stored before
+    def write_features(self, features, global_patterns, batch_size=DB_BATCH_SIZE):
+        if self.readonly:
+            raise ValueError("database was opened read only")
+        with self.connection:
+            self.connection.execute('DELETE FROM features')
+            self.connection.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', ('global_patterns', _dumps(global_patterns)))
+            self.connection.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', ('feature_count', _dumps(len(features))))
+
+        rows = []
+        for position, (entity_id, entity_features) in enumerate(features.items()):
+            rows.append((position, str(entity_id), _dumps(entity_features)))
+            if len(rows) >= batch_size:
+                with self.connection:
+                    self.connection.executemany('INSERT INTO features VALUES (?, ?, ?)', rows)
+                rows = []
+        with self.connection:
+            self.connection.executemany('INSERT INTO features VALUES (?, ?, ?)', rows)
+
+# read only dict interface over the entities of a database; each lookup rebuilds one enhanced entity
+class DatabaseEntities(Mapping):
+    def __init__(self, database):
+        self.database = database
+
+    def __getitem__(self, entity_id):
+        row = self.database.connection.execute(
+            'SELECT p.profile, a.patterns FROM profiles p JOIN aggregates a ON a.entity_id = p.entity_id '
+            'WHERE p.entity_id = ?', (entity_id,)).fetchone()
+        if row is None:
+            raise KeyError(entity_id)
+        entity = {'profile_info': json.loads(row[0]), 'activity_timeline': self.database.timeline(entity_id)}
+        entity.update(json.loads(row[1]))
+        return entity
+
+    def __contains__(self, entity_id):
+        return self.database.connection.execute('SELECT 1 FROM profiles WHERE entity_id = ?', (entity_id,)).fetchone() is not None
+
+    def __len__(self):
+        return self.database.meta('entity_count', 0)
+
+    def __iter__(self):
+        for row in self.database.connection.execute('SELECT entity_id FROM profiles ORDER BY position'):
+            yield row[0]
+
+# read only dict interface over the stored features
+class DatabaseFeatures(Mapping):
+    def __init__(self, database):
+        self.database = database
+
+    def __getitem__(self, entity_id):
+        row = self.database.connection.execute('SELECT features FROM features WHERE entity_id = ?', (entity_id,)).fetchone()
+        if row is None:
+            raise KeyError(entity_id)
+        return json.loads(row[0])
+
+    def __contains__(self, entity_id):
+        return self.database.connection.execute('SELECT 1 FROM features WHERE entity_id = ?', (entity_id,)).fetchone() is not None
+
+    def __len__(self):
+        return self.database.meta('feature_count', 0)
+
+    def __iter__(self):
+        for row in self.database.connection.execute('SELECT entity_id FROM features ORDER BY position'):
+            yield row[0]
@@ -0,0 +1,157 @@
+import json
+import os
+from entity_store import EntityIndexWriter, INDEX_SUFFIX, MANIFEST_FILENAME
+
+# entities per file in the sharded layout
+DEFAULT_SHARD_SIZE = 10000
+
+# writes the resolution map ({"entities": {...}, "patterns_ready": true}) one entity at a time, so
+# memory holds a single entity; indented output is byte for byte what json.dump(indent=2) writes,
+# compact output has no whitespace, and with shard_size the map is split into files of shard_size
+# entities each under the output directory, plus a manifest. member and trailer name the keyed
+# object and the members written after it; with index every file gets an entity_store index.
+# files are written aside and moved into place only when the writer closes without an error, so a
+# failed run leaves the previous map untouched
+class EntityMapWriter:
+    def __init__(self, path, compact=False, shard_size=None, member='entities', trailer=None, index=False):
+        self.path = path
+        self.compact = compact
+        self.shard_size = shard_size
+        self.member = member
+        self.trailer = {'patterns_ready': True} if trailer is None else trailer
+        self.index = index
+        self.entity_count = 0
+        self.shards = []
+        self._file = None
+        self._file_path = None
+        self._index = None
+        self._position = 0
+        self._shard_count = 0
+        self._closed = False
+        self._written = []
+        if shard_size:
+            os.makedirs(path, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _dumps(self, value, level):
+        """JSON text of a value nested `level` objects deep"""
+        if self.compact:
+            return json.dumps(value, separators=(',', ':'), default=str)
+        return json.dumps(value, indent=2, default=str).replace('\n', '\n' + '  ' * level)
+
+    def _emit(self, text):
+        data = text.encode('utf-8')
+        self._file.write(data)
+        self._position += len(data)
+
+    def _open(self):
+        if self.shard_size:
+            filename = f"{self.member}_{len(self.shards):05d}.json"
+            self.shards.append({'file': filename, 'entities': 0, 'first_entity': None, 'last_entity': None})
+            self._file_path = os.path.join(self.path, filename)
+        else:
+            self._file_path = self.path
+        self._file = open(self._file_path + '.tmp', 'wb')
+        self._position = 0
+        self._index = EntityIndexWriter(self.member) if self.index else None
+        member = json.dumps(self.member)
+        self._emit('{' + member + ':{' if self.compact else '{\n  ' + member + ': {')
+        self._shard_count = 0
+
+    def _close_file(self):
+        if self.compact:
+            self._emit('}')
+        else:
+            self._emit('\n  }' if self._shard_count else '}')
+
+        # the trailer's byte range is indexed too, so readers get it without the entities
+        trailer_offset = trailer_length = 0
+        if self.trailer:
+            separator = ',' if self.compact else ',\n  '
+            self._emit(separator)
+            trailer_offset = self._position
+            self._emit(separator.join(json.dumps(key) + (':' if self.compact else ': ') + self._dumps(value, 1)
+                                      for key, value in self.trailer.items()))
+            trailer_length = self._position - trailer_offset
+        self._emit('}' if self.compact else '\n}')
+        self._file.close()
+        self._file = None
+        self._written.append(self._file_path)
+
+        if self._index is not None:
+            self._index.write(self._file_path + INDEX_SUFFIX + '.tmp', self._position, trailer_offset, trailer_length)
+            self._index = None
+            self._written.append(self._file_path + INDEX_SUFFIX)
+
+    def write(self, entity_id, entity):
+        if self._file is None:
+            self._open()
+
+        entity_id = str(entity_id)
+        if self.compact:
+            self._emit((',' if self._shard_count else '') + json.dumps(entity_id) + ':')
+        else:
+            self._emit((',\n    ' if self._shard_count else '\n    ') + json.dumps(entity_id) + ': ')
+        offset = self._position
+        self._emit(self._dumps(entity, 2))
+        if self._index is not None:
+            self._index.add(entity_id, offset, self._position - offset)
+
+        self._shard_count += 1
+        self.entity_count += 1
+        if self.shard_size:
+            shard = self.shards[-1]
+            shard['entities'] += 1
+            if shard['first_entity'] is None:
+                shard['first_entity'] = entity_id
+            shard['last_entity'] = entity_id
+            if self._shard_count >= self.shard_size:
+                self._close_file()
+
+    def close(self):
+        """Finish the open file, and write the manifest of a sharded map"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._file is None and self.entity_count == 0 and not self.shard_size:
+            # a map without entities is still a valid file
+            self._open()
+        if self._file is not None:
+            self._close_file()
+
+        if self.shard_size:
+            manifest = {
+                'format': 'sharded',
+                'shard_size': self.shard_size,
+                'entity_count': self.entity_count,
+                **self.trailer,
+                'shards': self.shards
+            }
+            with open(os.path.join(self.path, MANIFEST_FILENAME) + '.tmp', 'w') as f:
+                json.dump(manifest, f, indent=2)
+            self._written.append(os.path.join(self.path, MANIFEST_FILENAME))
+
+        # data files before their indexes, the manifest last
+        for path in self._written:
+            os.replace(path + '.tmp', path)
+
+    def abort(self):
+        """Delete everything written so far, leaving any map already at path untouched"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._written.append(self._file_path)
+        for path in self._written:
+            if os.path.exists(path + '.tmp'):
+                os.remove(path + '.tmp')
@@ -0,0 +1,273 @@
+import hashlib
+import json
+import mmap
+import os
+from array import array
+from collections import OrderedDict
+from collections.abc import Mapping
+import numpy as np
+
+# side index of a map file, written next to it as <map>.idx
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'ENTIDX01'
+
+# decoded entities kept per store, so repeated lookups of one entity decode it once
+ENTITY_CACHE_SIZE = 256
+
+# manifest of a sharded map directory
+MANIFEST_FILENAME = 'manifest.json'
+
+# characters read at a time when a map is streamed
+READ_CHUNK_SIZE = 1 << 20
+
+# index layout: header, entries in write order, (hash, entry) sorted by hash, then the key bytes
+INDEX_HEADER = np.dtype([('magic', 'S8'), ('member', 'S32'), ('count', '<i8'), ('data_size', '<i8'),
+                         ('trailer_offset', '<i8'), ('trailer_length', '<i8'), ('keys_bytes', '<i8')])
+INDEX_ENTRY = np.dtype([('offset', '<i8'), ('length', '<i8'), ('key_offset', '<i8'), ('key_length', '<i8')])
+
+def key_hash(key):
+    """Stable 64 bit hash of an entity id"""
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+# collects entity_id -> (offset, length) of each value while a map file is written
+class EntityIndexWriter:
+    def __init__(self, member):
+        self.member = member
+        self.offsets = array('q')
+        self.lengths = array('q')
+        self.hashes = array('Q')
+        self.key_lengths = array('q')
+        self.keys = bytearray()
+
+    def add(self, key, offset, length):
+        encoded = key.encode('utf-8')
+        self.offsets.append(offset)
+        self.lengths.append(length)
+        self.hashes.append(key_hash(key))
+        self.key_lengths.append(len(encoded))
+        self.keys += encoded
+
+    def write(self, path, data_size, trailer_offset, trailer_length):
+        """Write the index of a finished map file of data_size bytes"""
+        count = len(self.offsets)
+        header = np.zeros(1, dtype=INDEX_HEADER)
+        header[0] = (INDEX_MAGIC, self.member.encode('utf-8'), count, data_size, trailer_offset, trailer_length,
+                     len(self.keys))
+
+        entries = np.zeros(count, dtype=INDEX_ENTRY)
+        entries['offset'] = np.frombuffer(self.offsets, dtype=np.int64)
+        entries['length'] = np.frombuffer(self.lengths, dtype=np.int64)
+        key_lengths = np.frombuffer(self.key_lengths, dtype=np.int64)
+        entries['key_offset'] = np.cumsum(key_lengths) - key_lengths
+        entries['key_length'] = key_lengths
+        hashes = np.frombuffer(self.hashes, dtype=np.uint64)
+        order = np.argsort(hashes, kind='stable')
+
+        # written aside and renamed so readers never see a half written index
+        with open(path + '.tmp', 'wb') as f:
+            f.write(header.tobytes())
+            f.write(entries.tobytes())
+            f.write(hashes[order].tobytes())
+            f.write(order.astype(np.int64).tobytes())
+            f.write(bytes(self.keys))
+        os.replace(path + '.tmp', path)
+
+# read only dict interface over an indexed map file: opening maps the file and its index without
+# reading them, and each entity is decoded from its own byte range when it is first looked up
+class EntityStore(Mapping):
+    def __init__(self, path, member='entities', cache_size=ENTITY_CACHE_SIZE):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+        header = np.fromfile(self.index_path, dtype=INDEX_HEADER, count=1)
+        if len(header) == 0 or header[0]['magic'] != INDEX_MAGIC:
+            raise ValueError(f"{self.index_path} is not an entity index")
+        header = header[0]
+        if header['member'].decode('utf-8') != member:
+            raise ValueError(f"{self.index_path} indexes '{header['member'].decode('utf-8')}', not '{member}'")
+        if os.path.getsize(path) != header['data_size']:
+            raise ValueError(f"{self.index_path} is out of date with {path}")
+
+        self._count = int(header['count'])
+        self._trailer = (int(header['trailer_offset']), int(header['trailer_length']))
+        entries_offset = INDEX_HEADER.itemsize
+        hashes_offset = entries_offset + self._count * INDEX_ENTRY.itemsize
+        order_offset = hashes_offset + self._count * 8
+        keys_offset = order_offset + self._count * 8
+        self._entries = self._map(INDEX_ENTRY, entries_offset, self._count)
+        self._hashes = self._map(np.uint64, hashes_offset, self._count)
+        self._order = self._map(np.int64, order_offset, self._count)
+        self._keys = self._map(np.uint8, keys_offset, int(header['keys_bytes']))
+
+        with open(path, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _map(self, dtype, offset, count):
+        # np.memmap refuses empty regions
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.index_path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+    def _find(self, key):
+        """Index entry of a key, or None"""
+        if not isinstance(key, str):
+            return None
+        target = key_hash(key)
+        encoded = key.encode('utf-8')
+        position = int(np.searchsorted(self._hashes, np.uint64(target)))
+        while position < self._count and int(self._hashes[position]) == target:
+            entry = self._entries[int(self._order[position])]
+            key_offset, key_length = int(entry['key_offset']), int(entry['key_length'])
+            if self._keys[key_offset:key_offset + key_length].tobytes() == encoded:
+                return entry
+            position += 1
+        return None
+
+    def __getitem__(self, key):
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        entry = self._find(key)
+        if entry is None:
+            raise KeyError(key)
+        offset, length = int(entry['offset']), int(entry['length'])
+        value = json.loads(self._data[offset:offset + length])
+
+        self._cache[key] = value
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return value
+
+    def __contains__(self, key):
+        return key in self._cache or self._find(key) is not None
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self, chunk_size=10000):
+        keys = self._keys.tobytes() if self._count else b''
+        for start in range(0, self._count, chunk_size):
+            entries = self._entries[start:start + chunk_size]
+            for key_offset, key_length in zip(entries['key_offset'].tolist(), entries['key_length'].tolist()):
+                yield keys[key_offset:key_offset + key_length].decode('utf-8')
+
+    def extras(self):
+        """The map's other top level members, e.g. patterns_ready or global_patterns"""
+        offset, length = self._trailer
+        if length == 0:
+            return {}
+        return json.loads(b'{' + self._data[offset:offset + length] + b'}')
+
+    def close(self):
+        self._data.close()
+        self._cache.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+def open_entity_map(path, member='entities'):
+    """(entries, other top level members) of a map file; entries are an EntityStore when the file has an
+    up to date index, otherwise the whole file is loaded into a dict"""
+    if os.path.exists(path + INDEX_SUFFIX):
+        try:
+            store = EntityStore(path, member)
+            return store, store.extras()
+        except ValueError as e:
+            print(f"Ignoring entity index: {e}")
+
+    with open(path, 'r') as f:
+        data = json.load(f)
+    entries = data.pop(member)
+    return entries, data
+
+# incremental JSON reader over a text file: values are decoded with raw_decode from a buffer that
+# only holds the unread part of the file, refilled chunk by chunk
+class _JSONStream:
+    def __init__(self, f, chunk_size=READ_CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+
+    def _fill(self, size):
+        """Read at least size more characters, dropping what has been consumed; False at end of file"""
+        if self.eof:
+            return False
+        chunk = self.f.read(max(size, self.chunk_size))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def peek(self):
+        """Next non-whitespace character, '' at end of file"""
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in ' \t\n\r':
+                self.position += 1
+            if self.position < len(self.buffer) or not self._fill(self.chunk_size):
+                return self.buffer[self.position:self.position + 1]
+
+    def expect(self, character):
+        found = self.peek()
+        if found != character:
+            raise ValueError(f"expected '{character}', found '{found}' in {self.f.name}")
+        self.position += 1
+
+    def decode(self):
+        """Next JSON value; the buffer grows until the value fits"""
+        self.peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                # a number may continue past the buffer
+                if end < len(self.buffer) or self.eof:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill(size)
+            size *= 2
+
+def _iter_members(path, member, chunk_size):
+    with open(path, 'r', encoding='utf-8') as f:
+        stream = _JSONStream(f, chunk_size)
+        stream.expect('{')
+        while stream.peek() != '}':
+            key = stream.decode()
+            stream.expect(':')
+            if key != member:
+                stream.decode()
+            else:
+                stream.expect('{')
+                while stream.peek() != '}':
+                    entity_id = stream.decode()
+                    stream.expect(':')
+                    yield entity_id, stream.decode()
+                    if stream.peek() == ',':
+                        stream.expect(',')
+                stream.expect('}')
+            if stream.peek() == ',':
+                stream.expect(',')
+
+def iter_entity_map(path, member='entities', chunk_size=READ_CHUNK_SIZE):
+    """(entity_id, entity) pairs of a map file or sharded map directory, decoded one at a time so
+    memory holds one entity and one read chunk"""
+    if os.path.isdir(path):
+        with open(os.path.join(path, MANIFEST_FILENAME)) as f:
+            manifest = json.load(f)
+        for shard in manifest['shards']:
+            yield from _iter_members(os.path.join(path, shard['file']), member, chunk_size)
+    else:
+        yield from _iter_members(path, member, chunk_size)
@@ -0,0 +1,156 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from activity_store import NAT, timestamps_to_isoformat
+
+# where the resolver writes the event log when asked to
+EVENT_LOG_PATH = 'event_log'
+
+# bump when the on-disk layout changes
+EVENT_LOG_VERSION = 1
+
+# one resolved activity; locations and sources are codes into the log's tables (-1: no location)
+EVENT_DTYPE = np.dtype([('entity', '<i4'), ('timestamp', '<i8'), ('source', '<i2'), ('location', '<i4'),
+                        ('confidence', '<f4')])
+
+def _save(path, array):
+    # written aside and renamed so readers never map a half written file
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, array)
+    os.replace(path + '.tmp', path)
+
+# every timed activity of a store as one structured array sorted by (entity, timestamp), ties in
+# timeline (source, row) order; entity codes are positions in entity_ids
+def write_event_log(path, store, entity_ids):
+    os.makedirs(path, exist_ok=True)
+    entity_ids = list(entity_ids)
+
+    # store entity codes -> log entity codes; entities outside entity_ids are left out
+    log_codes = np.full(len(store.entity_ids) + 1, -1, dtype=np.int64)
+    known = [(store.entity_codes[entity_id], code) for code, entity_id in enumerate(entity_ids)
+             if entity_id in store.entity_codes]
+    if known:
+        store_codes, codes = np.array(known, dtype=np.int64).T
+        log_codes[store_codes] = codes
+
+    entities = log_codes[store.column('entity')]
+    timestamps = store.column('timestamp')
+    keep = np.flatnonzero((entities >= 0) & (timestamps != NAT))
+    order = keep[np.lexsort((store.column('row')[keep], store.column('source')[keep], timestamps[keep], entities[keep]))]
+
+    events = np.zeros(len(order), dtype=EVENT_DTYPE)
+    events['entity'] = entities[order]
+    events['timestamp'] = timestamps[order]
+    events['source'] = store.column('source')[order]
+    events['location'] = store.column('location')[order]
+    events['confidence'] = store.column('confidence')[order]
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(events['entity'], minlength=len(entity_ids))))).astype(np.int64)
+
+    _save(os.path.join(path, 'events.npy'), events)
+    _save(os.path.join(path, 'offsets.npy'), offsets)
+    tables = {
+        'version': EVENT_LOG_VERSION,
+        'entities': entity_ids,
+        'sources': [list(source) for source in store.sources],
+        'locations': store.locations
+    }
+    with open(os.path.join(path, 'tables.json.tmp'), 'w') as f:
+        json.dump(tables, f, default=str)
+    os.replace(os.path.join(path, 'tables.json.tmp'), os.path.join(path, 'tables.json'))
+    return len(events)
+
+# read side of the event log: the arrays are memory mapped, so an entity's timeline is a zero copy
+# slice and campus wide scans are vectorized over the mapped columns
+class EventLog:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'tables.json')) as f:
+            tables = json.load(f)
+        if tables.get('version') != EVENT_LOG_VERSION:
+            raise ValueError(f"{path} is an event log of another version")
+
+        self.entity_ids = tables['entities']
+        self.sources = [tuple(source) for source in tables['sources']]
+        self.locations = tables['locations']
+        self._location_table = np.array(self.locations + [None], dtype=object)
+        self._entity_codes = None
+        self.events = np.load(os.path.join(path, 'events.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.events)
+
+    def __contains__(self, entity_id):
+        return self.entity_code(entity_id) is not None
+
+    def entity_code(self, entity_id):
+        if self._entity_codes is None:
+            self._entity_codes = {entity_id: code for code, entity_id in enumerate(self.entity_ids)}
+        return self._entity_codes.get(entity_id)
+
+    def entity_events(self, entity_id):
+        """An entity's events in time order, a view into the mapped log"""
+        code = self.entity_code(entity_id)
+        if code is None:
+            return self.events[:0]
+        return self.events[self.offsets[code]:self.offsets[code + 1]]
+
+    def entity_timestamps(self, entity_id):
+        """An entity's activity times as Timestamps, in time order"""
+        return list(pd.to_datetime(self.entity_events(entity_id)['timestamp']))
+
+    def entity_activities(self, entity_id, limit=None, latest_first=False):
+        """Timeline style dicts (timestamp, activity_type, location, source, confidence) of an entity's
+        events; latest_first orders newest first, keeping timeline order among equal times"""
+        events = self.entity_events(entity_id)
+        positions = np.arange(len(events))
+        if latest_first:
+            positions = np.lexsort((positions, -events['timestamp']))
+        events = events[positions[:limit]]
+
+        timestamps = timestamps_to_isoformat(events['timestamp'])
+        locations = self._location_table[events['location']]
+        return [{
+            'timestamp': timestamp,
+            'activity_type': self.sources[source][1],
+            'location': location,
+            'source': self.sources[source][0],
+            'confidence': confidence
+        } for timestamp, source, location, confidence in zip(
+            timestamps, events['source'].tolist(), locations, events['confidence'].astype(np.float64).tolist())]
+
+    def last_seen(self, entity_id):
+        """Timestamp of an entity's latest activity, None when it has none"""
+        events = self.entity_events(entity_id)
+        return pd.Timestamp(int(events['timestamp'][-1])) if len(events) else None
+
+    def last_seen_all(self):
+        """Latest activity time (epoch ns) of every entity, NAT for entities without activities"""
+        ends = np.asarray(self.offsets[1:])
+        has_events = ends > np.asarray(self.offsets[:-1])
+        last = np.full(len(self.entity_ids), NAT, dtype=np.int64)
+        last[has_events] = self.events['timestamp'][ends[has_events] - 1]
+        return last
+
+    def _time_mask(self, start, end):
+        timestamps = self.events['timestamp']
+        mask = np.ones(len(timestamps), dtype=bool)
+        if start is not None:
+            mask &= timestamps >= pd.Timestamp(start).value
+        if end is not None:
+            mask &= timestamps <= pd.Timestamp(end).value
+        return mask
+
+    def location_counts(self, start=None, end=None):
+        """location -> number of events there, optionally between two times"""
+        locations = self.events['location'][self._time_mask(start, end)]
+        counts = np.bincount(locations[locations >= 0], minlength=len(self.locations))
+        return {location: int(count) for location, count in zip(self.locations, counts.tolist()) if count}
+
+    def location_occupancy(self, location, start=None, end=None):
+        """Distinct entities and events recorded at a location, optionally between two times"""
+        if location not in self.locations:
+            return {'location': location, 'entities': 0, 'activities': 0}
+        mask = self._time_mask(start, end) & (self.events['location'] == self.locations.index(location))
+        return {'location': location, 'entities': len(np.unique(self.events['entity'][mask])), 'activities': int(mask.sum())}
@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+
+# column holding a face embedding as a list or a "[x, y, ...]" string
+EMBEDDING_COLUMN = 'embedding'
+
+# without an EMBEDDING_COLUMN, an embedding is stored one dimension per column in the columns
+# named with this prefix (emb_0, emb_1, ...)
+EMBEDDING_COLUMN_PREFIX = 'emb_'
+
+def embedding_columns(df):
+    """Dimension columns of a frame that stores embeddings one dimension per column"""
+    return [name for name in df.columns if str(name).startswith(EMBEDDING_COLUMN_PREFIX)]
+
+# parse the embeddings of a frame into an L2-normalized float32 matrix; rows without a
+# usable embedding come back as zeros with valid=False. columns names the dimension columns
+# when they are not the EMBEDDING_COLUMN_PREFIX ones
+def parse_embeddings(df, columns=None):
+    if columns is None and EMBEDDING_COLUMN in df.columns:
+        vectors = [_parse_vector(value) for value in df[EMBEDDING_COLUMN].tolist()]
+        dim = max((len(vector) for vector in vectors), default=0)
+        matrix = np.zeros((len(df), dim), dtype=np.float32)
+        for row, vector in enumerate(vectors):
+            if len(vector) == dim:
+                matrix[row] = vector
+    else:
+        # one numeric column per dimension
+        columns = embedding_columns(df) if columns is None else columns
+        matrix = df[columns].to_numpy(dtype=np.float32) if columns else np.zeros((len(df), 0), dtype=np.float32)
+        matrix = np.nan_to_num(matrix)
+
+    norms = np.linalg.norm(matrix, axis=1)
+    valid = norms > 0
+    matrix[valid] /= norms[valid, None]
+    return matrix, valid
+
+def _parse_vector(value):
+    if isinstance(value, str):
+        text = value.strip().strip('[]')
+        try:
+            return np.array(text.split(','), dtype=np.float32) if text.strip() else np.zeros(0, dtype=np.float32)
+        except ValueError:
+            return np.zeros(0, dtype=np.float32)
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return np.asarray(value, dtype=np.float32)
+    return np.zeros(0, dtype=np.float32)
+
+# top-k cosine similarity search over labeled face embeddings; 'exact' scores every
+# gallery vector, 'ivf' only the vectors in the n_probe coarse clusters nearest the query
+class FaceEmbeddingIndex:
+    def __init__(self, vectors, labels, mode='exact', n_lists=None, n_probe=16, seed=0):
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.labels = np.asarray(labels, dtype=object)
+        self.mode = mode
+        self.n_probe = n_probe
+        if mode == 'ivf':
+            self._train_coarse_quantizer(n_lists or max(1, int(4 * np.sqrt(len(self.vectors)))), seed)
+        elif mode != 'exact':
+            raise ValueError(f"Unknown face index mode: {mode}")
+
+    def __len__(self):
+        return len(self.vectors)
+
+    # spherical k-means on a sample of the gallery, then every vector goes to its nearest centroid
+    def _train_coarse_quantizer(self, n_lists, seed, iterations=8, sample_size=25000):
+        rng = np.random.default_rng(seed)
+        n_lists = min(n_lists, len(self.vectors))
+        sample = self.vectors[rng.choice(len(self.vectors), min(sample_size, len(self.vectors)), replace=False)]
+
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            norms = np.linalg.norm(sums, axis=1)
+
+            # empty clusters are reseeded from random sample vectors
+            empty = norms == 0
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            norms[empty] = 1.0
+            centroids = sums / norms[:, None]
+
+        self.centroids = centroids.astype(np.float32)
+        assignment = np.concatenate([np.argmax(block @ self.centroids.T, axis=1)
+                                     for block in np.array_split(self.vectors, max(1, len(self.vectors) // 65536))])
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(n_lists + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(n_lists)]
+
+    # (similarities, gallery indices) of the k best matches per query, best first; -1 pads missing
+    def search(self, queries, k=5, batch_size=1024):
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        if len(queries) and (queries.ndim != 2 or queries.shape[1] != self.vectors.shape[1]):
+            raise ValueError(f"Query embeddings have shape {queries.shape}, the face gallery holds "
+                             f"{self.vectors.shape[1]}-dimensional embeddings")
+        k = min(k, len(self.vectors))
+        similarities = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        if k == 0:
+            return similarities, indices
+
+        for start in range(0, len(queries), batch_size):
+            batch = slice(start, start + batch_size)
+            if self.mode == 'exact':
+                similarities[batch], indices[batch] = self._search_exact(queries[batch], k)
+            else:
+                similarities[batch], indices[batch] = self._search_ivf(queries[batch], k)
+        return similarities, indices
+
+    def _search_exact(self, queries, k):
+        scores = queries @ self.vectors.T
+        top = np.argpartition(scores, scores.shape[1] - k, axis=1)[:, -k:]
+        return self._sorted_top(np.take_along_axis(scores, top, axis=1), top)
+
+    def _search_ivf(self, queries, k):
+        n_probe = min(self.n_probe, len(self.lists))
+        probes = np.argpartition(-(queries @ self.centroids.T), n_probe - 1, axis=1)[:, :n_probe]
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_indices = np.full((len(queries), k), -1, dtype=np.int64)
+
+        # score each probed list against the queries probing it, merging into the running top-k
+        flat_lists = probes.ravel()
+        order = np.argsort(flat_lists, kind='stable')
+        query_rows = order // n_probe
+        list_bounds = np.searchsorted(flat_lists[order], np.arange(len(self.lists) + 1))
+        for list_number in np.unique(flat_lists):
+            members = self.lists[list_number]
+            if len(members) == 0:
+                continue
+            rows = query_rows[list_bounds[list_number]:list_bounds[list_number + 1]]
+            scores = np.concatenate((best_scores[rows], queries[rows] @ self.vectors[members].T), axis=1)
+            candidates = np.concatenate((best_indices[rows], np.broadcast_to(members, (len(rows), len(members)))), axis=1)
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            best_scores[rows] = np.take_along_axis(scores, top, axis=1)
+            best_indices[rows] = np.take_along_axis(candidates, top, axis=1)
+
+        return self._sorted_top(best_scores, best_indices)
+
+    def _sorted_top(self, scores, indices):
+        order = np.argsort(-scores, axis=1, kind='stable')
+        return np.take_along_axis(scores, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+    def best_labels(self, queries, threshold):
+        """Best matching label and its similarity per query; None below the threshold"""
+        similarities, indices = self.search(queries, 1)
+        labels = np.full(len(queries), None, dtype=object)
+        matched = (indices[:, 0] >= 0) & (similarities[:, 0] >= threshold)
+        labels[matched] = self.labels[indices[matched, 0]]
+        return labels, similarities[:, 0]
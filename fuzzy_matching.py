@@ -0,0 +1,218 @@
+import re
+import numpy as np
+import pandas as pd
+
+# profiles sharing a blocking key beyond this many make the key useless for blocking
+MAX_BLOCK_SIZE = 200
+
+# candidates per mention kept after blocking, ranked by shared blocking keys
+MAX_CANDIDATES = 20
+
+# distinct mentions matched per batch, bounds the candidate pair table
+MENTION_BATCH_SIZE = 10000
+
+EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+
+SOUNDEX_CODES = {letter: str(code) for code, letters in enumerate(
+    ['aehiouwy', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r']) for letter in letters}
+
+def soundex(word):
+    """Four character Soundex code of a lowercase word ('' for a word without letters)"""
+    letters = [letter for letter in word if letter in SOUNDEX_CODES]
+    if not letters:
+        return ''
+
+    code = letters[0].upper()
+    previous = SOUNDEX_CODES[letters[0]]
+    for letter in letters[1:]:
+        digit = SOUNDEX_CODES[letter]
+        if digit != '0' and digit != previous:
+            code += digit
+        # h and w do not separate equal codes, vowels do
+        if letter not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
+
+def normalize_name(value):
+    """Lowercase letters-only name with single spaces; None unless it has at least two tokens"""
+    name = ' '.join(re.sub(r"[^a-z]+", ' ', str(value).lower()).split())
+    return name if name.count(' ') >= 1 else None
+
+def normalize_email_local(value):
+    """Local part of an email with case, +tags and separators removed; None if value is not an email"""
+    value = str(value).strip().lower()
+    if '@' not in value:
+        return None
+    local = value.split('@', 1)[0].split('+', 1)[0]
+    local = re.sub(r"[^a-z0-9]+", '', local)
+    return local or None
+
+# a misspelled name usually keeps its phonetic codes, or at least one token intact
+def name_blocking_keys(name):
+    tokens = name.split()
+    keys = {'p:' + ' '.join(sorted(soundex(token) for token in tokens))}
+    for i, token in enumerate(tokens):
+        initials = ''.join(sorted(other[0] for other in tokens[:i] + tokens[i + 1:]))
+        keys.add(f"t:{token}|{initials}")
+    return keys
+
+def email_blocking_keys(local):
+    letters = re.sub(r"[0-9]+", '', local)
+    return {'e:' + local, 'p:' + soundex(letters), 'l:' + letters}
+
+def trigrams(value):
+    padded = f" {value} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+# blocked fuzzy matcher: candidates come from shared blocking keys, never all pairs, and are
+# scored by trigram Dice similarity in vectorized batches
+class FuzzyMatcher:
+    def __init__(self, values, labels, blocking_keys, max_block_size=MAX_BLOCK_SIZE, max_candidates=MAX_CANDIDATES):
+        self.values = list(values)
+        self.labels = np.asarray(labels, dtype=object)
+        self.blocking_keys = blocking_keys
+        self.max_candidates = max_candidates
+
+        # key -> profiles lists (CSR style), without keys shared by too many profiles
+        self.key_codes = {}
+        key_rows = [(self.key_codes.setdefault(key, len(self.key_codes)), position)
+                    for position, value in enumerate(self.values) for key in blocking_keys(value)]
+        key_rows = np.array(key_rows, dtype=np.int64).reshape(-1, 2)
+        block_sizes = np.bincount(key_rows[:, 0], minlength=len(self.key_codes))
+        key_rows = key_rows[block_sizes[key_rows[:, 0]] <= max_block_size]
+        key_rows = key_rows[np.argsort(key_rows[:, 0], kind='stable')]
+        self.key_offsets = np.searchsorted(key_rows[:, 0], np.arange(len(self.key_codes) + 1))
+        self.key_profiles = key_rows[:, 1]
+
+        self.gram_codes = {}
+        self.profile_grams = self._gram_table(self.values)
+
+    def _gram_table(self, values, grow=True):
+        """(offsets, codes, sizes): each value's distinct trigram codes, CSR style, and its trigram count;
+        without grow, trigrams no profile has are counted but left out of the codes"""
+        lengths = []
+        sizes = []
+        codes = []
+        for value in values:
+            grams = trigrams(value)
+            if grow:
+                known = [self.gram_codes.setdefault(gram, len(self.gram_codes)) for gram in grams]
+            else:
+                known = [self.gram_codes[gram] for gram in grams if gram in self.gram_codes]
+            lengths.append(len(known))
+            sizes.append(len(grams))
+            codes.extend(known)
+        offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        return offsets, np.array(codes, dtype=np.int64), np.array(sizes, dtype=np.int64)
+
+    # best label and similarity per query value; None (and 0.0) when blocking finds no candidate
+    def match(self, queries, batch_size=MENTION_BATCH_SIZE):
+        queries = list(queries)
+        labels = np.full(len(queries), None, dtype=object)
+        scores = np.zeros(len(queries), dtype=np.float64)
+
+        for start in range(0, len(queries), batch_size):
+            batch = queries[start:start + batch_size]
+            mentions, profiles = self._candidates(batch)
+            if len(mentions) == 0:
+                continue
+
+            similarity = self._dice(self._gram_table(batch, grow=False), mentions, profiles)
+
+            # best candidate per mention, lowest profile position on ties
+            order = np.lexsort((profiles, -similarity, mentions))
+            first = order[np.concatenate(([True], np.diff(mentions[order]) != 0))]
+            labels[start + mentions[first]] = self.labels[profiles[first]]
+            scores[start + mentions[first]] = similarity[first]
+
+        return labels, scores
+
+    def _candidates(self, batch):
+        """(mention, profile) candidate pairs: the profiles sharing the most blocking keys with each mention"""
+        mention_keys = [(position, self.key_codes[key]) for position, value in enumerate(batch)
+                        for key in self.blocking_keys(value) if key in self.key_codes]
+        mention_keys = np.array(mention_keys, dtype=np.int64).reshape(-1, 2)
+        mentions, profiles = self._expand((self.key_offsets, self.key_profiles), mention_keys[:, 1])
+        mentions = mention_keys[:, 0][mentions]
+
+        # shared key count per pair
+        pairs, shared = np.unique(mentions * len(self.values) + profiles, return_counts=True)
+        mentions, profiles = np.divmod(pairs, len(self.values))
+        if pairs.size == 0:
+            return mentions, profiles
+
+        # keep the top max_candidates per mention; pairs are already in (mention, profile) order,
+        # so one stable sort on (mention, most shared first) ranks them
+        order = np.argsort(mentions * (shared.max() + 1) + (shared.max() - shared), kind='stable')
+        mentions, profiles = mentions[order], profiles[order]
+        group_starts = np.flatnonzero(np.concatenate(([True], np.diff(mentions) != 0)))
+        rank = np.arange(len(mentions)) - np.repeat(group_starts, np.diff(np.append(group_starts, len(mentions))))
+        keep = rank < self.max_candidates
+        return mentions[keep], profiles[keep]
+
+    def _dice(self, mention_grams, mentions, profiles):
+        """Trigram Dice similarity of each (mention, profile) pair"""
+        mention_codes = self._expand(mention_grams[:2], mentions)
+        profile_codes = self._expand(self.profile_grams[:2], profiles)
+        width = len(self.gram_codes) + 1
+
+        # a trigram shared by both sides shows up twice under its (pair, trigram) key
+        keys = np.concatenate((mention_codes[0] * width + mention_codes[1], profile_codes[0] * width + profile_codes[1]))
+        keys.sort()
+        shared = keys[1:][keys[1:] == keys[:-1]] // width
+        intersection = np.bincount(shared, minlength=len(mentions))
+
+        sizes = mention_grams[2][mentions] + self.profile_grams[2][profiles]
+        return 2.0 * intersection / np.maximum(sizes, 1)
+
+    def _expand(self, table, positions):
+        """(index into positions, entry) for every entry of a CSR style (offsets, entries) table's rows"""
+        offsets, codes = table
+        lengths = offsets[positions + 1] - offsets[positions]
+        pair_index = np.repeat(np.arange(len(positions)), lengths)
+        within = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        return pair_index, codes[offsets[positions][pair_index] + within]
+
+# (row, kind, normalized value) mentions in the given columns of a frame; text columns are
+# scanned for email addresses, other columns are taken as a name or an email
+def extract_mentions(df, rows, fields, text_fields):
+    pieces = []
+    for field in fields + text_fields:
+        if field not in df.columns:
+            continue
+
+        # each distinct value is parsed once
+        codes, uniques = pd.factorize(df[field].to_numpy()[rows])
+        parsed = [_text_mentions(value) if field in text_fields else _field_mention(value) for value in uniques.tolist()]
+        counts = np.array([len(mentions) for mentions in parsed], dtype=np.int64)
+        if counts.sum() == 0:
+            continue
+
+        present = codes >= 0
+        value_codes = codes[present]
+        repeats = counts[value_codes]
+        starts = np.concatenate(([0], np.cumsum(counts)))[value_codes]
+        flat = [mention for mentions in parsed for mention in mentions]
+        within = np.arange(repeats.sum()) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        selected = np.repeat(starts, repeats) + within
+        pieces.append(pd.DataFrame({
+            'row': np.repeat(np.asarray(rows)[present], repeats),
+            'kind': np.array([kind for kind, _ in flat], dtype=object)[selected],
+            'value': np.array([value for _, value in flat], dtype=object)[selected]
+        }))
+
+    if not pieces:
+        return pd.DataFrame({'row': np.zeros(0, dtype=np.int64), 'kind': [], 'value': []})
+    return pd.concat(pieces, ignore_index=True)
+
+def _field_mention(value):
+    local = normalize_email_local(value)
+    if local:
+        return [('email', local)]
+    name = normalize_name(value)
+    return [('name', name)] if name else []
+
+def _text_mentions(value):
+    if not isinstance(value, str):
+        return []
+    return [('email', normalize_email_local(email)) for email in EMAIL_PATTERN.findall(value)]
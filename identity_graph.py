@@ -0,0 +1,221 @@
+import numpy as np
+import pandas as pd
+from activity_store import group_bounds
+
+# identifier pairs seen together in the logs that count as evidence of one identity:
+# rows of the two sources at the same location within max_seconds, seen at least min_support times
+CO_OCCURRENCE_RULES = [
+    {'left': ('campus_swipes', 'card_id'), 'right': ('cctv_frame', 'face_id'), 'max_seconds': 5, 'min_support': 3}
+]
+
+# disjoint sets over integer nodes, with path halving on find and union by size
+class UnionFind:
+    def __init__(self, size):
+        self.parent = np.arange(size, dtype=np.int64)
+        self.size = np.ones(size, dtype=np.int64)
+
+    def find(self, node):
+        parent = self.parent
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    def union(self, a, b):
+        """Merge the sets of a and b; returns the new root"""
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return a
+
+    def roots(self):
+        """Root of every node, compressing all paths at once"""
+        parent = self.parent
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                return parent
+            parent[:] = grandparent
+
+# node_entity value of a cluster that holds more than one entity
+CONFLICTED = -2
+
+# identifiers clustered into identities from profile fields and co-occurrence evidence
+class IdentityGraph:
+    def __init__(self, entity_identifiers):
+        """entity_identifiers: (entity_id, identifier) pairs from the profiles"""
+        pairs = pd.DataFrame(entity_identifiers, columns=['entity_id', 'identifier'])
+        entity_codes, entities = pd.factorize(pairs['entity_id'])
+        identifier_codes, identifiers = pd.factorize(pairs['identifier'].astype(str))
+
+        # nodes: entities first, then identifiers; node_entity is an entity code on entity nodes and
+        # cluster roots (-1 when the cluster has no entity), meaningless elsewhere
+        self.entities = entities.tolist()
+        self.identifiers = identifiers.tolist()
+        self.node_of = dict(zip(self.identifiers, range(len(self.entities), len(self.entities) + len(self.identifiers))))
+        self.node_entity = np.full(len(self.entities) + len(self.identifiers), -1, dtype=np.int64)
+        self.node_entity[:len(self.entities)] = np.arange(len(self.entities))
+        self.union_find = UnionFind(len(self.node_entity))
+        self.conflicts = []
+        self.evidence_edges = 0
+        self._resolved = None
+
+        # an identifier listed by one profile hangs straight off that entity; shared ones merge entities
+        identifier_nodes = identifier_codes + len(self.entities)
+        first = ~pd.Series(identifier_codes).duplicated().to_numpy()
+        self.union_find.parent[identifier_nodes[first]] = entity_codes[first]
+        np.add.at(self.union_find.size, entity_codes[first], 1)
+        for entity_code, identifier_node in zip(entity_codes[~first].tolist(), identifier_nodes[~first].tolist()):
+            self._union(entity_code, identifier_node, merge_conflicting=True)
+
+    def _add_nodes(self, identifiers):
+        """Singleton nodes for identifiers not in the graph yet"""
+        new_identifiers = [identifier for identifier in dict.fromkeys(identifiers) if identifier not in self.node_of]
+        if not new_identifiers:
+            return
+        start = len(self.node_entity)
+        self.node_of.update(zip(new_identifiers, range(start, start + len(new_identifiers))))
+        self.identifiers.extend(new_identifiers)
+        self.node_entity = np.concatenate((self.node_entity, np.full(len(new_identifiers), -1, dtype=np.int64)))
+        self.union_find.parent = np.concatenate((self.union_find.parent, np.arange(start, start + len(new_identifiers))))
+        self.union_find.size = np.concatenate((self.union_find.size, np.ones(len(new_identifiers), dtype=np.int64)))
+
+    def _union(self, a, b, merge_conflicting=False):
+        """Union two nodes; clusters of different entities only merge when merge_conflicting (a shared
+        profile identifier), otherwise the link is reported and skipped"""
+        root_a, root_b = self.union_find.find(a), self.union_find.find(b)
+        if root_a == root_b:
+            return True
+
+        entity_a, entity_b = self.node_entity[root_a], self.node_entity[root_b]
+        clash = entity_a != -1 and entity_b != -1 and entity_a != entity_b
+        if clash:
+            self.conflicts.append({
+                'identifiers': [self._label(a), self._label(b)],
+                'entities': [self._entity_label(entity_a), self._entity_label(entity_b)],
+                'merged': merge_conflicting
+            })
+            if not merge_conflicting:
+                return False
+
+        # a conflicted cluster stays conflicted whatever it absorbs
+        root = self.union_find.union(root_a, root_b)
+        if clash or CONFLICTED in (entity_a, entity_b):
+            self.node_entity[root] = CONFLICTED
+        else:
+            self.node_entity[root] = max(entity_a, entity_b)
+        return True
+
+    def _label(self, node):
+        if node < len(self.entities):
+            return str(self.entities[node])
+        return self.identifiers[node - len(self.entities)]
+
+    def _entity_label(self, entity_code):
+        return str(self.entities[entity_code]) if entity_code >= 0 else 'conflicted cluster'
+
+    # co-occurring identifier pairs, strongest evidence first, merged unless they join two entities
+    def add_evidence(self, left_identifiers, right_identifiers, support):
+        left_identifiers = [str(identifier) for identifier in left_identifiers]
+        right_identifiers = [str(identifier) for identifier in right_identifiers]
+        self._add_nodes(left_identifiers + right_identifiers)
+
+        merged = 0
+        for position in np.argsort(-np.asarray(support), kind='stable').tolist():
+            merged += self._union(self.node_of[left_identifiers[position]], self.node_of[right_identifiers[position]])
+        self.evidence_edges += merged
+        self._resolved = None
+        return merged
+
+    def resolved_identifiers(self):
+        """identifier -> entity for every identifier whose cluster has exactly one entity"""
+        if self._resolved is None:
+            cluster_entity = self.node_entity[self.union_find.roots()][len(self.entities):]
+            owned = np.flatnonzero(cluster_entity >= 0)
+            self._resolved = {self.identifiers[position]: self.entities[entity_code]
+                              for position, entity_code in zip(owned.tolist(), cluster_entity[owned].tolist())}
+        return self._resolved
+
+    def entity_of(self, identifier):
+        """Entity of an identifier's cluster; None if unknown or the cluster is conflicted"""
+        node = self.node_of.get(identifier)
+        if node is None:
+            return None
+        entity_code = self.node_entity[self.union_find.find(node)]
+        return self.entities[entity_code] if entity_code >= 0 else None
+
+    def print_report(self, limit=5):
+        merged = sum(conflict['merged'] for conflict in self.conflicts)
+        print(f"Identity graph: {len(self.identifiers)} identifiers, {self.evidence_edges} evidence links, "
+              f"{merged} shared profile identifiers, {len(self.conflicts) - merged} conflicting evidence links skipped")
+        for conflict in self.conflicts[:limit]:
+            print(f"   conflict: {' / '.join(conflict['identifiers'])} links {' and '.join(conflict['entities'])}")
+
+# bound on the event pairs co_occurring_pairs expands at once
+MAX_PAIRS_PER_CHUNK = 5_000_000
+
+# sort-merge join of two event streams on (location, time): every pair of events at the same
+# location within `window` ns of each other, counted per (left value, right value) in a sparse
+# table; left events are expanded in chunks so no more than max_pairs pairs exist at a time
+def co_occurring_pairs(left_locations, left_times, left_values, right_locations, right_times, right_values, window,
+                       max_pairs=MAX_PAIRS_PER_CHUNK):
+    location_codes, _ = pd.factorize(np.concatenate((np.asarray(left_locations, dtype=object),
+                                                     np.asarray(right_locations, dtype=object))))
+    left_keys = location_codes[:len(left_locations)]
+    right_keys = location_codes[len(left_locations):]
+    left_times = np.asarray(left_times, dtype=np.int64)
+    right_times = np.asarray(right_times, dtype=np.int64)
+    left_codes, left_uniques = pd.factorize(np.asarray(left_values, dtype=object))
+    right_codes, right_uniques = pd.factorize(np.asarray(right_values, dtype=object))
+
+    # events without a location or value never pair
+    left_usable = (left_keys >= 0) & (left_codes >= 0)
+    right_usable = (right_keys >= 0) & (right_codes >= 0)
+    left_keys, left_times, left_codes = left_keys[left_usable], left_times[left_usable], left_codes[left_usable]
+    right_keys, right_times, right_codes = right_keys[right_usable], right_times[right_usable], right_codes[right_usable]
+
+    # right events sorted by (location, time), left events by location; each left event takes
+    # the slice of right events at its location within the window
+    right_order = np.lexsort((right_times, right_keys))
+    right_keys, right_times, right_codes = right_keys[right_order], right_times[right_order], right_codes[right_order]
+    left_order = np.argsort(left_keys, kind='stable')
+    left_keys, left_times, left_codes = left_keys[left_order], left_times[left_order], left_codes[left_order]
+    left_bounds = group_bounds(left_keys)
+
+    starts = np.zeros(len(left_keys), dtype=np.int64)
+    ends = np.zeros(len(left_keys), dtype=np.int64)
+    for location, (start, end) in group_bounds(right_keys).items():
+        if location not in left_bounds:
+            continue
+        selected = slice(*left_bounds[location])
+        times = right_times[start:end]
+        starts[selected] = start + np.searchsorted(times, left_times[selected] - window, side='left')
+        ends[selected] = start + np.searchsorted(times, left_times[selected] + window, side='right')
+
+    # (left code, right code) pair keys counted chunk by chunk, then merged
+    counts = ends - starts
+    width = max(len(right_uniques), 1)
+    chunk_of = (np.cumsum(counts) - counts) // max_pairs
+    chunk_starts = np.concatenate(([0], np.flatnonzero(np.diff(chunk_of)) + 1, [len(counts)]))
+    pair_keys, pair_counts = [], []
+    for start, end in zip(chunk_starts[:-1].tolist(), chunk_starts[1:].tolist()):
+        chunk_counts = counts[start:end]
+        total = chunk_counts.sum()
+        if total == 0:
+            continue
+        left_index = np.repeat(np.arange(start, end), chunk_counts)
+        right_index = np.repeat(starts[start:end] - (np.cumsum(chunk_counts) - chunk_counts), chunk_counts) + np.arange(total)
+        keys, key_counts = np.unique(left_codes[left_index] * width + right_codes[right_index], return_counts=True)
+        pair_keys.append(keys)
+        pair_counts.append(key_counts)
+
+    if not pair_keys:
+        return [], [], np.zeros(0, dtype=np.int64)
+    keys, inverse = np.unique(np.concatenate(pair_keys), return_inverse=True)
+    support = np.bincount(inverse, weights=np.concatenate(pair_counts), minlength=len(keys)).astype(np.int64)
+    left_index, right_index = np.divmod(keys, width)
+    return left_uniques[left_index].tolist(), right_uniques[right_index].tolist(), support
@@ -0,0 +1,77 @@
+import hashlib
+from collections import OrderedDict
+
+# most recently failed lookups remembered exactly
+NEGATIVE_CACHE_SIZE = 100000
+
+# doorkeeper bits, about 1% false positives at NEGATIVE_CACHE_SIZE entries with 4 hashes
+DOORKEEPER_BITS = 1 << 20
+DOORKEEPER_HASHES = 4
+
+# Bloom filter over string keys; hashes are stable across processes so a pickled filter stays valid
+class BloomFilter:
+    def __init__(self, bits=DOORKEEPER_BITS, hashes=DOORKEEPER_HASHES):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray(bits // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8 * self.hashes).digest()
+        return [int.from_bytes(digest[8 * i:8 * i + 8], 'little') % self.bits for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        return all(self.array[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def clear(self):
+        self.array = bytearray(self.bits // 8)
+        self.count = 0
+
+# bounded cache of lookups known to fail: an LRU of exact keys, admitted through a Bloom filter
+# doorkeeper so identifiers seen only once never push out the ones that keep coming back
+class NegativeCache:
+    def __init__(self, size=NEGATIVE_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.doorkeeper = BloomFilter()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, key):
+        """Record a failed lookup; cached once it has failed before"""
+        doorkeeper_key = '\x1f'.join(key)
+        if doorkeeper_key not in self.doorkeeper:
+            # the doorkeeper is reset once it holds more keys than the cache, keeping false positives low
+            if self.doorkeeper.count >= self.size:
+                self.doorkeeper.clear()
+            self.doorkeeper.add(doorkeeper_key)
+            return
+
+        self.entries[key] = True
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """Forget every cached failure, e.g. when new identifiers become resolvable"""
+        self.entries.clear()
+        self.doorkeeper.clear()
+
+    def print_stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups else 0.0
+        print(f"Negative cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1%} hit rate), "
+              f"{len(self.entries)} unresolvable identifiers cached")
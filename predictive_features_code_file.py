@@ -3,57 +3,100 @@ import numpy as np
 from datetime import datetime, timedelta
 from collections import defaultdict, Counter
 import json
+import os
+from entity_map_writer import EntityMapWriter
+from entity_store import open_entity_map, iter_entity_map
+from entity_db import EntityDatabase, ENTITY_DATABASE_PATH
+from event_log import EventLog, EVENT_LOG_PATH
 
 class PredictiveFeatureExtractor:
-    def __init__(self, enhanced_json):
+    def __init__(self, enhanced_json, event_log=None):
+        # the entity map dict, or (entity_id, entity) pairs such as iter_entity_map(path)
         self.enhanced_json = enhanced_json
+        self.event_log = event_log
         self.features = {}
         self.global_patterns = {}
+        
+        # global pattern counts, accumulated entity by entity
+        self.department_locations = defaultdict(list)
+        self.hour_activity = defaultdict(int)
+        self.location_popularity = defaultdict(int)
     # all features for predictive monitoring    
     def extract_all_features(self):
-        # Extract global patterns first
+        # One pass extracts entity features and counts global patterns; the parts that depend on
+        # global patterns are filled in once the pass is over
+        pending = list(self._iter_entity_features())
         self._extract_global_patterns()
         
-        # Extract features for each entity
-        for entity_id, entity_data in self.enhanced_json['entities'].items():
-            self.features[entity_id] = self._extract_entity_features(entity_id, entity_data)
+        for entity_id, entity_features, profile in pending:
+            self.features[entity_id] = self._add_global_context(entity_features, profile)
         
         print(f"Extracted features for {len(self.features)} entities")
         return self.features, self.global_patterns
-    # extract campus wide pattern
-    def _extract_global_patterns(self):        
-        # Department location preferences
-        department_locations = defaultdict(list)
-        hour_activity = defaultdict(int)
-        location_popularity = defaultdict(int)
-        
-        for entity_id, entity_data in self.enhanced_json['entities'].items():
-            department = entity_data['profile_info']['department']
-            behavioral = entity_data.get('behavioral_patterns', {})
-            temporal = entity_data.get('temporal_analysis', {})
-            
-            # Department patterns
-            if 'unique_locations' in behavioral:
-                department_locations[department].extend(behavioral['unique_locations'])
-            
-            # Hourly activity patterns
-            if 'hourly_activity_distribution' in temporal:
-                for hour, count in temporal['hourly_activity_distribution'].items():
-                    hour_activity[hour] += count
+    # same single pass, but features are spilled to disk and then streamed into an indexed features
+    # file, so memory holds one entity however large the map is
+    def write_all_features(self, path):
+        spill_path = path + '.spill'
+        try:
+            with open(spill_path, 'w') as spill:
+                for entity_id, entity_features, profile in self._iter_entity_features():
+                    spill.write(json.dumps([entity_id, entity_features, profile], default=str) + '\n')
+            self._extract_global_patterns()
             
-            # Location popularity
-            if 'location_frequency' in behavioral:
-                for location, freq in behavioral['location_frequency'].items():
-                    location_popularity[location] += freq
+            trailer = {
+                'global_patterns': self.global_patterns,
+                'extraction_timestamp': datetime.now().isoformat()
+            }
+            with EntityMapWriter(path, member='features', trailer=trailer, index=True) as writer, open(spill_path) as spill:
+                for line in spill:
+                    entity_id, entity_features, profile = json.loads(line)
+                    writer.write(entity_id, self._add_global_context(entity_features, profile))
+        finally:
+            if os.path.exists(spill_path):
+                os.remove(spill_path)
+        
+        print(f"Extracted features for {writer.entity_count} entities")
+        return self.global_patterns
+    
+    def _entity_items(self):
+        if isinstance(self.enhanced_json, dict):
+            return self.enhanced_json['entities'].items()
+        return self.enhanced_json
+    # (entity_id, features without global context, profile fields the context needs) per entity
+    def _iter_entity_features(self):
+        for entity_id, entity_data in self._entity_items():
+            self._count_global_patterns(entity_data)
+            profile = {key: value for key, value in entity_data['profile_info'].items() if key == 'department'}
+            yield entity_id, self._extract_entity_features(entity_id, entity_data), profile
+    # campus wide pattern counts of one entity
+    def _count_global_patterns(self, entity_data):
+        department = entity_data['profile_info']['department']
+        behavioral = entity_data.get('behavioral_patterns', {})
+        temporal = entity_data.get('temporal_analysis', {})
         
+        # Department patterns
+        if 'unique_locations' in behavioral:
+            self.department_locations[department].extend(behavioral['unique_locations'])
+        
+        # Hourly activity patterns
+        if 'hourly_activity_distribution' in temporal:
+            for hour, count in temporal['hourly_activity_distribution'].items():
+                self.hour_activity[hour] += count
+        
+        # Location popularity
+        if 'location_frequency' in behavioral:
+            for location, freq in behavioral['location_frequency'].items():
+                self.location_popularity[location] += freq
+    # extract campus wide pattern
+    def _extract_global_patterns(self):        
         # Calculate most common patterns
         self.global_patterns = {
             'department_location_preferences': {
-                dept: Counter(locs).most_common(5) for dept, locs in department_locations.items()
+                dept: Counter(locs).most_common(5) for dept, locs in self.department_locations.items()
             },
-            'campus_peak_hours': dict(sorted(hour_activity.items(), key=lambda x: x[1], reverse=True)[:5]),
-            'popular_locations': dict(sorted(location_popularity.items(), key=lambda x: x[1], reverse=True)[:10]),
-            'location_categories': self._categorize_locations(location_popularity)
+            'campus_peak_hours': dict(sorted(self.hour_activity.items(), key=lambda x: x[1], reverse=True)[:5]),
+            'popular_locations': dict(sorted(self.location_popularity.items(), key=lambda x: x[1], reverse=True)[:10]),
+            'location_categories': self._categorize_locations(self.location_popularity)
         }
         
         print(f"Found {len(self.global_patterns['department_location_preferences'])} department patterns")
@@ -66,6 +109,7 @@ class PredictiveFeatureExtractor:
         location_analysis = entity_data.get('location_analysis', {})
         ml_features = entity_data.get('ml_features', {})
         timeline = entity_data.get('activity_timeline', [])
+        timestamps = self._timeline_timestamps(entity_id, timeline)
         
         features = {
             # Basic identity features
@@ -74,27 +118,48 @@ class PredictiveFeatureExtractor:
             'role': profile.get('role', 'Unknown'),
             
             # Temporal patterns
-            'temporal_features': self._extract_temporal_features(temporal, timeline),
+            'temporal_features': self._extract_temporal_features(temporal, timestamps),
             
             # Location preferences 
             'location_features': self._extract_location_features(behavioral, location_analysis),
             
             # Behavioral sequences
-            'sequence_features': self._extract_sequence_features(behavioral, timeline),
+            'sequence_features': self._extract_sequence_features(behavioral, self._recent_activities(entity_id, timeline)),
             
             # Activity patterns
-            'activity_features': self._extract_activity_features(ml_features, timeline),
+            'activity_features': self._extract_activity_features(ml_features, timestamps),
             
-            # Contextual features
-            'context_features': self._extract_context_features(entity_data),
+            # Contextual features, filled in from the global patterns
+            'context_features': None,
             
             # Predictive signals
             'predictive_signals': self._extract_predictive_signals(entity_data)
         }
         
         return features
+    # the features that depend on global patterns: context and department signals
+    def _add_global_context(self, features, profile):
+        features['context_features'] = self._extract_context_features({'profile_info': profile})
+        
+        # Department pattern signals
+        department = profile.get('department')
+        dept_patterns = self.global_patterns['department_location_preferences'].get(department, [])
+        if dept_patterns:
+            features['predictive_signals']['department_suggested_locations'] = [loc for loc, freq in dept_patterns[:3]]
+        
+        return features
+    # activity times of an entity, read from the event log when there is one instead of parsing the timeline
+    def _timeline_timestamps(self, entity_id, timeline):
+        if self.event_log is not None and entity_id in self.event_log:
+            return self.event_log.entity_timestamps(entity_id)
+        return [pd.to_datetime(item['timestamp']) for item in timeline if item.get('timestamp')]
+    # the five latest activities, newest first
+    def _recent_activities(self, entity_id, timeline):
+        if self.event_log is not None and entity_id in self.event_log:
+            return self.event_log.entity_activities(entity_id, limit=5, latest_first=True)
+        return sorted(timeline, key=lambda x: x['timestamp'], reverse=True)[:5]
     #extract temporal features for prediction
-    def _extract_temporal_features(self, temporal, timeline):
+    def _extract_temporal_features(self, temporal, timestamps):
         features = {}
         
         # From temporal_analysis
@@ -115,14 +180,12 @@ class PredictiveFeatureExtractor:
             features['preferred_weekday'] = temporal['most_active_day']
         
         # Enhanced temporal features from timeline
-        if timeline:
-            timestamps = [pd.to_datetime(item['timestamp']) for item in timeline if item.get('timestamp')]
-            if timestamps:
-                features.update({
-                    'days_since_first_activity': (datetime.now() - min(timestamps)).days,
-                    'days_since_last_activity': (datetime.now() - max(timestamps)).days,
-                    'activity_regularity': self._calculate_regularity_score(timestamps)
-                })
+        if timestamps:
+            features.update({
+                'days_since_first_activity': (datetime.now() - min(timestamps)).days,
+                'days_since_last_activity': (datetime.now() - max(timestamps)).days,
+                'activity_regularity': self._calculate_regularity_score(list(timestamps))
+            })
         
         return features
     # extract location features for prediction
@@ -159,7 +222,7 @@ class PredictiveFeatureExtractor:
         
         return features
     # movement sequence patterns
-    def _extract_sequence_features(self, behavioral, timeline):
+    def _extract_sequence_features(self, behavioral, recent_activities):
         features = {}
         
         # From behavioral_patterns
@@ -181,8 +244,7 @@ class PredictiveFeatureExtractor:
             })
         
         # Extract recent activity context
-        if timeline:
-            recent_activities = sorted(timeline, key=lambda x: x['timestamp'], reverse=True)[:5]
+        if recent_activities:
             features['recent_activities'] = [
                 {
                     'location': act.get('location'),
@@ -195,7 +257,7 @@ class PredictiveFeatureExtractor:
         
         return features
     # general activity patterns
-    def _extract_activity_features(self, ml_features, timeline):
+    def _extract_activity_features(self, ml_features, timestamps):
         features = {}
         
         # From ml_features
@@ -207,11 +269,9 @@ class PredictiveFeatureExtractor:
         })
         
         # Calculate activity 
-        if timeline:
-            timestamps = [pd.to_datetime(item['timestamp']) for item in timeline if item.get('timestamp')]
-            if timestamps and len(timestamps) > 1:
-                time_span = (max(timestamps) - min(timestamps)).total_seconds() / 3600  # hours
-                features['activity_density'] = len(timestamps) / max(time_span, 1)  # activities per hour
+        if len(timestamps) > 1:
+            time_span = (max(timestamps) - min(timestamps)).total_seconds() / 3600  # hours
+            features['activity_density'] = len(timestamps) / max(time_span, 1)  # activities per hour
         
         return features
     # context features 
@@ -256,12 +316,6 @@ class PredictiveFeatureExtractor:
             if transitions:
                 signals['most_likely_next_movement'] = max(transitions.items(), key=lambda x: x[1])[0]
         
-        # Department pattern signals
-        department = entity_data['profile_info'].get('department')
-        dept_patterns = self.global_patterns['department_location_preferences'].get(department, [])
-        if dept_patterns:
-            signals['department_suggested_locations'] = [loc for loc, freq in dept_patterns[:3]]
-        
         return signals
     
     # calculation
@@ -358,9 +412,9 @@ class PredictiveFeatureExtractor:
 
 
 # extract predictive features on json
-def extract_features_from_json(enhanced_json):
+def extract_features_from_json(enhanced_json, event_log=None):
     
-    extractor = PredictiveFeatureExtractor(enhanced_json)
+    extractor = PredictiveFeatureExtractor(enhanced_json, event_log)
     features, global_patterns = extractor.extract_all_features()
     
     
@@ -377,20 +431,19 @@ def extract_features_from_json(enhanced_json):
 
 # Example usage with your JSON
 if __name__ == "__main__":
-    # Load your enhanced JSON
-    with open('Entity_resolution_map_code_file', 'r') as f:
-       enhanced_json= json.load(f)
-       
+    # Stream your enhanced JSON one entity at a time
+    enhanced_json = iter_entity_map('Entity_resolution_map_code_file')
     
-    features, global_patterns = extract_features_from_json(enhanced_json)
+    # the resolver's event log, when it wrote one, supplies activity times without parsing timelines
+    event_log = EventLog(EVENT_LOG_PATH) if os.path.exists(EVENT_LOG_PATH) else None
     
-    # Save features for ML training
-    output_data = {
-        'features': features,
-        'global_patterns': global_patterns,
-        'extraction_timestamp': datetime.now().isoformat()
-    }
+    # Save features for ML training, indexed so the predictor can open them lazily
+    extractor = PredictiveFeatureExtractor(enhanced_json, event_log)
+    global_patterns = extractor.write_all_features('predictive_features.json')
     
-    with open('predictive_features.json', 'w') as f:
-        json.dump(output_data, f, indent=2, default=str)
+    # keep the resolver's entity database, when it built one, in step with the features
+    if os.path.exists(ENTITY_DATABASE_PATH):
+        features, _ = open_entity_map('predictive_features.json', 'features')
+        with EntityDatabase(ENTITY_DATABASE_PATH, readonly=False) as database:
+            database.write_features(features, global_patterns)
 
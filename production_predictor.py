@@ -4,12 +4,15 @@ import pandas as pd
 from datetime import datetime
 import json
 from pipeline import ImprovedPredictiveMonitor
+from entity_store import open_entity_map
+from entity_db import EntityDatabase, is_entity_database
 
 class ProductionPredictor:
     def __init__(self, model_path, data_path=None):
         self.model_path = model_path
         self.data_path = data_path
         self.monitor = None
+        self.database = None
         self.features_data = None
         self.global_patterns = None
         self.load_model()
@@ -38,12 +41,15 @@ class ProductionPredictor:
             raise
     
     def load_data(self):
-        """Load the predictive_features data"""
+        """Load the predictive_features data, lazily from an entity database or an indexed file"""
         try:
-            with open(self.data_path, 'r') as f:
-                data = json.load(f)
-            self.features_data = data['features']
-            self.global_patterns = data['global_patterns']
+            if is_entity_database(self.data_path):
+                self.database = EntityDatabase(self.data_path)
+                self.features_data = self.database.features
+                self.global_patterns = self.database.meta('global_patterns')
+            else:
+                self.features_data, data = open_entity_map(self.data_path, 'features')
+                self.global_patterns = data['global_patterns']
             print(f"Loaded data for {len(self.features_data)} entities")
         except Exception as e:
             print(f"Error loading data: {e}")
@@ -8,26 +8,55 @@ import pandas as pd
 from datetime import datetime, timedelta
 import json
 from production_predictor import ProductionPredictor
+from entity_store import open_entity_map
+from entity_db import EntityDatabase, is_entity_database
+from event_log import EventLog, EVENT_LOG_PATH
+import os
 
 class SecurityMonitoringDashboard:
-    def __init__(self, model_path, entity_data_path,predictive_data_path):
+    def __init__(self, model_path, entity_data_path,predictive_data_path, event_log_path=None):
         self.model_path = model_path
         self.entity_data_path = entity_data_path
         self.predictive_data_path=predictive_data_path
+        self.event_log_path = event_log_path
         self.entity_data = None
+        self.entity_db = None
+        self.event_log = None
         self.predictor = None
         self.load_entity_data()
         self.load_predictor()
         self.setup_page()
-    # load entity profiles and activity data
+    # load entity profiles and activity data; an entity database or an indexed map is opened lazily
     def load_entity_data(self):
         try:
-            with open(self.entity_data_path, 'r') as f:
-                data = json.load(f)
-            self.entity_data = data['entities']
+            if is_entity_database(self.entity_data_path):
+                self.entity_db = EntityDatabase(self.entity_data_path)
+                self.entity_data = self.entity_db.entities
+            else:
+                self.entity_data, _ = open_entity_map(self.entity_data_path)
             print(f" Loaded entity data for {len(self.entity_data)} entities")
+            if self.event_log_path:
+                self.event_log = EventLog(self.event_log_path)
+                print(f" Opened event log of {len(self.event_log)} events")
         except Exception as e:
             st.error(f" Error loading entity data: {e}")
+    # an entity's timeline (or its first `limit` activities) from the database, event log or map
+    def _activity_timeline(self, entity_id, limit=None):
+        if self.entity_db is not None:
+            return self.entity_db.timeline(entity_id, limit=limit)
+        if self.event_log is not None and entity_id in self.event_log:
+            return self.event_log.entity_activities(entity_id, limit)
+        activity_timeline = self.entity_data[entity_id].get('activity_timeline', [])
+        return activity_timeline[:limit] if limit else activity_timeline
+    # activities that can hold the latest timestamp: just the last one when a store keeps it
+    def _latest_activities(self, entity_id):
+        if self.entity_db is not None:
+            latest_timestamp = self.entity_db.last_seen(entity_id)
+        elif self.event_log is not None and entity_id in self.event_log:
+            latest_timestamp = self.event_log.last_seen(entity_id)
+        else:
+            return self._activity_timeline(entity_id)
+        return [] if latest_timestamp is None else [{'timestamp': latest_timestamp}]
         # Loading ml predictor 
     def load_predictor(self):
         try:
@@ -57,8 +86,7 @@ class SecurityMonitoringDashboard:
                     'last_seen': None
                 }
                 
-            entity_info = self.entity_data[entity_id]
-            activity_timeline = entity_info.get('activity_timeline', [])
+            activity_timeline = self._latest_activities(entity_id)
             
             if not activity_timeline:
                 return {
@@ -162,8 +190,7 @@ class SecurityMonitoringDashboard:
                 st.metric("Alert Level", "UNKNOWN")
     # Activity timeline
     def display_activity_timeline(self, entity_id):
-        entity_info = self.entity_data[entity_id]
-        activity_timeline = entity_info.get('activity_timeline', [])
+        activity_timeline = self._activity_timeline(entity_id, limit=15)
         
         if not activity_timeline:
             st.info("No activity timeline data available")
@@ -354,6 +381,21 @@ class SecurityMonitoringDashboard:
         show_behavioral = st.sidebar.checkbox("Show Behavioral Patterns", True)
         show_evidence = st.sidebar.checkbox("Show Evidence Chains", True)
         show_prediction = st.sidebar.checkbox("Show ML Prediction", True)
+
+        # Location occupancy, queried from the entity database or scanned in the event log
+        occupancy_store = self.entity_db if self.entity_db is not None else self.event_log
+        if occupancy_store is not None:
+            st.sidebar.markdown("---")
+            st.sidebar.subheader("Location Occupancy")
+            if self.entity_db is not None:
+                locations = self.entity_db.locations()
+            else:
+                locations = sorted(self.event_log.location_counts(), key=str)
+            # options keep the stored values, numeric location ids included; only the labels are strings
+            selected_location = st.sidebar.selectbox("Location", options=locations, format_func=str)
+            if selected_location is not None:
+                occupancy = occupancy_store.location_occupancy(selected_location)
+                st.sidebar.metric("Entities Seen", occupancy['entities'], delta=f"{occupancy['activities']} activities")
         
         # Main content
         if selected_entity:
@@ -431,7 +473,8 @@ if __name__ == "__main__":
         dashboard = SecurityMonitoringDashboard(
             model_path='trained_model.joblib',
             entity_data_path='Entity_resolution_map.json' , 
-            predictive_data_path='predictive_features.json'
+            predictive_data_path='predictive_features.json',
+            event_log_path=EVENT_LOG_PATH if os.path.exists(EVENT_LOG_PATH) else None
         )
         dashboard.run()
     except Exception as e:
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+
+# directory of the parsed source cache, next to the working directory's raw data
+SOURCE_CACHE_DIR = 'source_cache'
+
+# bump when the on-disk layout or the parsed frames change so old entries are rebuilt
+CACHE_FORMAT_VERSION = 2
+
+def file_hash(path, chunk_size=1 << 20):
+    """blake2b hex digest of a file's contents"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _encode_strings(values):
+    """UTF-8 bytes of all strings back to back plus their offsets"""
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+def _decode_strings(data, offsets):
+    buffer = data.tobytes()
+    bounds = offsets.tolist()
+    return [buffer[start:end].decode('utf-8') for start, end in zip(bounds[:-1], bounds[1:])]
+
+# parsed, typed source frames cached on disk, one .npz of column arrays plus a .json entry per source;
+# an entry is valid while the file's size and mtime match, or failing that its content hash
+class SourceCache:
+    def __init__(self, cache_dir=SOURCE_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, dataset_name):
+        base = os.path.join(self.cache_dir, dataset_name)
+        return base + '.json', base + '.npz'
+
+    # cached frame of a source, or loader(dataset_name, path, schema) -> (df, stats) stored for next time
+    def load(self, dataset_name, path, schema, loader):
+        entry_path, data_path = self._paths(dataset_name)
+        stat = os.stat(path)
+        schema_key = json.dumps([CACHE_FORMAT_VERSION, schema], sort_keys=True, default=str)
+
+        entry = None
+        if os.path.exists(entry_path) and os.path.exists(data_path):
+            with open(entry_path) as f:
+                entry = json.load(f)
+            if entry.get('schema') != schema_key or entry.get('path') != os.path.abspath(path):
+                entry = None
+
+        content_hash = None
+        if entry is not None and (entry['size'], entry['mtime_ns']) != (stat.st_size, stat.st_mtime_ns):
+            # touched but possibly unchanged: same size and content hash keep the entry
+            content_hash = file_hash(path) if entry['size'] == stat.st_size else None
+            if content_hash is None or content_hash != entry['hash']:
+                entry = None
+            else:
+                entry['mtime_ns'] = stat.st_mtime_ns
+                self._write_entry(entry_path, entry)
+
+        if entry is not None:
+            start = time.perf_counter()
+            df = self._read_frame(data_path, entry)
+            return df, dict(entry['stats'], seconds=time.perf_counter() - start, cached=True)
+
+        df, stats = loader(dataset_name, path, schema)
+        entry = {
+            'path': os.path.abspath(path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'hash': content_hash or file_hash(path),
+            'schema': schema_key,
+            'stats': stats,
+            'attrs': df.attrs,
+            'columns': self._write_frame(data_path, df)
+        }
+        self._write_entry(entry_path, entry)
+        return df, dict(stats, cached=False)
+
+    def _write_entry(self, entry_path, entry):
+        # written aside and renamed so a crash never leaves a half written entry
+        with open(entry_path + '.tmp', 'w') as f:
+            json.dump(entry, f, default=str)
+        os.replace(entry_path + '.tmp', entry_path)
+
+    def _write_frame(self, data_path, df):
+        """Save every column as plain arrays; returns the column descriptions"""
+        arrays = {}
+        columns = []
+        for number, name in enumerate(df.columns):
+            series = df[name]
+            key = f"c{number}"
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                kind = 'category'
+                arrays[key + '_codes'] = series.cat.codes.to_numpy()
+                uniques = series.cat.categories
+            elif pd.api.types.is_datetime64_any_dtype(series):
+                kind = 'datetime'
+                arrays[key] = series.to_numpy(dtype='datetime64[ns]').view(np.int64)
+                uniques = None
+            elif series.dtype != object:
+                kind = 'array'
+                arrays[key] = series.to_numpy()
+                uniques = None
+            else:
+                # object columns are stored factorized; missing values get code -1
+                kind = 'object'
+                codes, uniques = pd.factorize(series)
+                arrays[key + '_codes'] = codes
+                uniques = pd.Index(uniques)
+
+            if uniques is not None:
+                if uniques.dtype == object and all(isinstance(value, str) for value in uniques):
+                    arrays[key + '_data'], arrays[key + '_offsets'] = _encode_strings(uniques.tolist())
+                    unique_kind = 'strings'
+                else:
+                    arrays[key + '_uniques'] = uniques.to_numpy()
+                    unique_kind = 'array' if uniques.dtype != object else 'objects'
+            else:
+                unique_kind = None
+            columns.append({'name': name, 'kind': kind, 'uniques': unique_kind})
+
+        with open(data_path + '.tmp', 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(data_path + '.tmp', data_path)
+        return columns
+
+    def _read_frame(self, data_path, entry):
+        data = {}
+        with np.load(data_path, allow_pickle=True) as arrays:
+            for number, column in enumerate(entry['columns']):
+                key = f"c{number}"
+                if column['kind'] == 'array':
+                    data[column['name']] = arrays[key]
+                    continue
+                if column['kind'] == 'datetime':
+                    data[column['name']] = pd.DatetimeIndex(arrays[key].view('datetime64[ns]'))
+                    continue
+
+                if column['uniques'] == 'strings':
+                    uniques = pd.Index(_decode_strings(arrays[key + '_data'], arrays[key + '_offsets']), dtype=object)
+                else:
+                    uniques = pd.Index(arrays[key + '_uniques'])
+                codes = arrays[key + '_codes']
+                if column['kind'] == 'category':
+                    data[column['name']] = pd.Categorical.from_codes(codes, uniques)
+                else:
+                    values = np.full(len(codes), np.nan, dtype=object)
+                    present = codes >= 0
+                    values[present] = uniques.to_numpy(dtype=object)[codes[present]]
+                    data[column['name']] = values
+
+        df = pd.DataFrame(data)
+        df.attrs.update(entry['attrs'])
+        return df
@@ -0,0 +1,414 @@
+import io
+import os
+import csv
+import json
+import time
+import heapq
+import bisect
+from collections import defaultdict, deque
+import pandas as pd
+import numpy as np
+from EntityResolver import LINKING_CONFIG, TIMESTAMP_FIELDS
+from data_ingestion import KNOWN_TIMESTAMP_FORMATS, infer_timestamp_format, parse_timestamp_column
+from activity_store import NAT, location_field
+
+# append-only raw files tailed in streaming mode
+STREAMING_SOURCES = {
+    'wifi_logs': 'RAW_Data_folder/wifi_associations_logs.csv',
+    'campus_swipes': 'RAW_Data_folder/campus card_swipes.csv',
+    'cctv_frame': 'RAW_Data_folder/cctv_frames.csv'
+}
+
+# reads rows appended to a csv since the last call, at most chunk_size at a time; dtype is passed to
+# read_csv so id columns keep their text (a chunk with a blank id would otherwise read 123 as 123.0)
+class CsvTail:
+    def __init__(self, path, chunk_size=5000, dtype=None):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.dtype = dtype
+        self.offset = 0
+        self.header = None
+        self.inode = None
+        self.bytes_behind = 0
+
+    def read_chunk(self, final=False):
+        """Next complete new lines as a DataFrame, or None when nothing new was written;
+        a trailing line without a newline is left for the next call unless final"""
+        if not os.path.exists(self.path):
+            return None
+
+        # a file that shrank was truncated, one with a new inode was rotated; either way start it over
+        stat = os.stat(self.path)
+        size = stat.st_size
+        if size < self.offset or (self.inode is not None and stat.st_ino != self.inode):
+            self.offset = 0
+            self.header = None
+        self.inode = stat.st_ino
+
+        lines = []
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            if self.header is None:
+                line = f.readline()
+                if not line.endswith(b'\n') and not (final and line):
+                    return None
+                self.header = next(csv.reader([line.decode('utf-8').rstrip('\r\n')]))
+                self.offset = f.tell()
+
+            while len(lines) < self.chunk_size:
+                line = f.readline()
+                if not line.endswith(b'\n') and not (final and line):
+                    break
+                lines.append(line)
+                self.offset += len(line)
+
+        self.bytes_behind = max(size - self.offset, 0)
+        if not lines:
+            return None
+        return pd.read_csv(io.BytesIO(b''.join(lines)), names=self.header, header=None, dtype=self.dtype)
+
+# tails the raw source files and links every new row against a built resolver's identifier maps
+class StreamingIngestor:
+    def __init__(self, resolver, sources=None, chunk_size=5000, poll_interval=1.0):
+        self.resolver = resolver
+        self.sources = sources or STREAMING_SOURCES
+        self.poll_interval = poll_interval
+        self.linking = {dataset_name: (id_field, activity_type) for dataset_name, id_field, activity_type in LINKING_CONFIG}
+        self.tails = {dataset_name: CsvTail(path, chunk_size, dtype={self.linking[dataset_name][0]: str})
+                      for dataset_name, path in self.sources.items()}
+        self.timestamp_formats = {}
+        self.metrics = {dataset_name: {'chunks': 0, 'rows_read': 0, 'rows_linked': 0, 'bytes_behind': 0,
+                                       'ingest_lag_seconds': None, 'max_ingest_lag_seconds': 0.0}
+                        for dataset_name in self.sources}
+
+    # (dataset_name, linked rows) per chunk; each chunk gets entity_id and event_time columns
+    def iter_chunks(self, follow=True, stop_event=None):
+        while not (stop_event and stop_event.is_set()):
+            idle = True
+            for dataset_name, tail in self.tails.items():
+                df = tail.read_chunk(final=not follow)
+                if df is None:
+                    continue
+
+                idle = False
+                linked = self._link_chunk(dataset_name, df)
+                self.metrics[dataset_name]['bytes_behind'] = tail.bytes_behind
+                if len(linked):
+                    yield dataset_name, linked
+
+            if idle:
+                if not follow:
+                    return
+                time.sleep(self.poll_interval)
+
+    # one dict per linked event, in the activity dict layout plus entity_id and activity_type
+    def iter_events(self, follow=True, stop_event=None):
+        for dataset_name, linked in self.iter_chunks(follow, stop_event):
+            _, activity_type = self.linking[dataset_name]
+            field = location_field(linked)
+            records = linked.drop(columns=['entity_id', 'event_time']).to_dict('records')
+            locations = linked[field].tolist() if field else [None] * len(linked)
+
+            for record, entity_id, timestamp, location in zip(records, linked['entity_id'], linked['event_time'], locations):
+                yield {
+                    'entity_id': entity_id,
+                    'activity_type': activity_type,
+                    'record': record,
+                    'source': dataset_name,
+                    'location': location,
+                    'confidence': 1.0,
+                    'provenance': f"streaming_{self.linking[dataset_name][0]}_match",
+                    'timestamp': timestamp if pd.notna(timestamp) else None
+                }
+
+    # push events to a queue for consumers on other threads; None marks the end of the stream
+    def run(self, events_queue, follow=True, stop_event=None):
+        try:
+            for event in self.iter_events(follow, stop_event):
+                events_queue.put(event)
+        finally:
+            events_queue.put(None)
+
+    def _link_chunk(self, dataset_name, df):
+        """Resolve a chunk's identifiers and parse its timestamps; returns only the linked rows"""
+        id_field, activity_type = self.linking[dataset_name]
+        metrics = self.metrics[dataset_name]
+        metrics['chunks'] += 1
+        metrics['rows_read'] += len(df)
+
+        if id_field not in df.columns:
+            return df.iloc[0:0]
+
+        entity_ids = self.resolver._enhanced_join_entity_ids(df[id_field], id_field)
+        linked_rows = np.flatnonzero(pd.notna(entity_ids))
+        linked = df.iloc[linked_rows].reset_index(drop=True)
+        linked['entity_id'] = entity_ids[linked_rows]
+        linked['event_time'] = self._parse_timestamps(dataset_name, activity_type, linked)
+        metrics['rows_linked'] += len(linked)
+
+        # ingest lag: how far the newest event of the chunk is behind the wall clock
+        newest = linked['event_time'].max() if len(linked) else None
+        if pd.notna(newest):
+            lag = (pd.Timestamp.now() - newest).total_seconds()
+            metrics['ingest_lag_seconds'] = lag
+            metrics['max_ingest_lag_seconds'] = max(metrics['max_ingest_lag_seconds'], lag)
+
+        return linked
+
+    def _parse_timestamps(self, dataset_name, activity_type, df):
+        """Timestamps of a chunk, with the format fixed on the first chunk that has any"""
+        field = TIMESTAMP_FIELDS[activity_type]
+        if field not in df.columns:
+            return pd.Series(pd.NaT, index=df.index)
+
+        if dataset_name not in self.timestamp_formats:
+            stats = self.resolver.timestamp_report.get(dataset_name)
+            timestamp_format = (KNOWN_TIMESTAMP_FORMATS.get(dataset_name)
+                                or (stats['format'] if stats and stats['format'] != 'mixed' else None)
+                                or infer_timestamp_format(df[field]))
+            if timestamp_format is None and df[field].isna().all():
+                return pd.Series(pd.NaT, index=df.index)
+            self.timestamp_formats[dataset_name] = timestamp_format
+
+        parsed, _ = parse_timestamp_column(df[field], self.timestamp_formats[dataset_name])
+        return parsed
+
+    def print_metrics(self):
+        for dataset_name, metrics in self.metrics.items():
+            lag = metrics['ingest_lag_seconds']
+            print(f"{dataset_name}: {metrics['rows_linked']}/{metrics['rows_read']} linked in {metrics['chunks']} chunks, "
+                  f"{metrics['bytes_behind']} bytes behind, ingest lag {lag if lag is None else round(lag, 1)}s")
+
+# expected arrival delay per source; the watermark waits this long for a source's stragglers
+SOURCE_DELAYS_MINUTES = {
+    'wifi_logs': 5,
+    'campus_swipes': 1,
+    'cctv_frame': 60
+}
+
+# per entity event-time buffer: events are grouped into 30 minute windows in timestamp order
+# once the watermark passes them, so correlation runs continuously on out-of-order sources.
+# on_group / on_late receive finalized groups and too late events; only the last late_log_size
+# late events are kept in memory
+class EventTimeCorrelator:
+    def __init__(self, window_minutes=30, source_delays=None, default_delay_minutes=5,
+                 allowed_lateness_minutes=0, on_group=None, late_log_size=1000, on_late=None):
+        self.window = pd.Timedelta(minutes=window_minutes).value
+        self.allowed_lateness = pd.Timedelta(minutes=allowed_lateness_minutes).value
+        self.source_delays = {source: pd.Timedelta(minutes=minutes).value
+                              for source, minutes in (source_delays or SOURCE_DELAYS_MINUTES).items()}
+        self.default_delay = pd.Timedelta(minutes=default_delay_minutes).value
+        self.on_group = on_group
+        self.on_late = on_late
+
+        # watermark: every event at or before it is assumed to have arrived
+        self.source_max = {}
+        self.watermark = NAT
+
+        self.pending = defaultdict(list)
+        self.open_groups = {}
+        self.closed_anchors = {}
+        self.frontier = {}
+        self.timers = []
+        self.scheduled = {}
+        self.sequence = 0
+
+        self.late_counts = defaultdict(int)
+        self.late_events = deque(maxlen=late_log_size)
+        self.stats = {'events': 0, 'untimed': 0, 'late_merged': 0, 'late_dropped': 0, 'groups': 0, 'links': 0}
+
+    # buffer one event; returns the (entity_id, activities) links finalized by the watermark move
+    def add(self, event):
+        self.stats['events'] += 1
+        if event['timestamp'] is None:
+            self.stats['untimed'] += 1
+            return []
+
+        entity_id = event['entity_id']
+        timestamp = event['timestamp'].value
+        if timestamp < self.frontier.get(entity_id, NAT):
+            self._add_late(entity_id, timestamp, event)
+        else:
+            heapq.heappush(self.pending[entity_id], (timestamp, self.sequence, event))
+            self._schedule(entity_id, timestamp)
+            self.sequence += 1
+
+        source = event['source']
+        self.source_max[source] = max(self.source_max.get(source, NAT), timestamp)
+        watermark = min(latest - self.source_delays.get(source, self.default_delay)
+                        for source, latest in self.source_max.items())
+        return self.advance_watermark(watermark)
+
+    def advance_watermark(self, watermark):
+        """Move the watermark forward and finalize what it passed"""
+        self.watermark = max(self.watermark, watermark)
+        finalized = []
+        while self.timers and self.timers[0][0] <= self.watermark:
+            due, entity_id = heapq.heappop(self.timers)
+            if self.scheduled.get(entity_id) != due:
+                continue
+            del self.scheduled[entity_id]
+            finalized.extend(self._release(entity_id))
+        return finalized
+
+    def flush(self):
+        """End of stream: finalize every buffered event and open group"""
+        return self.advance_watermark(np.iinfo(np.int64).max)
+
+    def _schedule(self, entity_id, due):
+        """Wake an entity up once the watermark reaches due; one live timer per entity, stale ones are skipped"""
+        if due < self.scheduled.get(entity_id, np.iinfo(np.int64).max):
+            self.scheduled[entity_id] = due
+            heapq.heappush(self.timers, (due, entity_id))
+
+    # an event older than ones already grouped for its entity joins the open group whose window
+    # covers it, including groups later events have moved past but whose lateness has not run out.
+    # one no group covers anchors a group of its own, as it would have arriving in order, and the
+    # open groups after it are swept again from it; it is dropped when that group's deadline has
+    # passed or it falls in the window of a group already finalized
+    def _add_late(self, entity_id, timestamp, event):
+        groups = self.open_groups.get(entity_id, [])
+        position = bisect.bisect_right([group['anchor'] for group in groups], timestamp) - 1
+        closed_anchor = self.closed_anchors.get(entity_id)
+        if position >= 0 and timestamp - groups[position]['anchor'] <= self.window:
+            group = groups[position]
+            position = bisect.bisect_right(group['timestamps'], timestamp)
+            group['timestamps'].insert(position, timestamp)
+            group['events'].insert(position, event)
+            self.stats['late_merged'] += 1
+        elif ((closed_anchor is None or timestamp - closed_anchor > self.window)
+              and timestamp + self.window + self.allowed_lateness > self.watermark):
+            later = groups[position + 1:]
+            regrouped = self._sweep([timestamp] + [value for group in later for value in group['timestamps']],
+                                    [event] + [value for group in later for value in group['events']])
+            self.open_groups[entity_id] = groups[:position + 1] + regrouped
+            self._schedule(entity_id, timestamp + self.window + self.allowed_lateness)
+            self.stats['late_merged'] += 1
+        else:
+            self.late_counts[event['source']] += 1
+            self.late_events.append(event)
+            self.stats['late_dropped'] += 1
+            if self.on_late:
+                self.on_late(event)
+
+    def _sweep(self, timestamps, events, groups=None):
+        """Anchored groups of time ordered events, continuing the last of groups when given"""
+        groups = [] if groups is None else groups
+        for timestamp, event in zip(timestamps, events):
+            if groups and timestamp - groups[-1]['anchor'] <= self.window:
+                groups[-1]['timestamps'].append(timestamp)
+                groups[-1]['events'].append(event)
+            else:
+                groups.append({'anchor': timestamp, 'timestamps': [timestamp], 'events': [event]})
+        return groups
+
+    def _release(self, entity_id):
+        """Sweep an entity's events up to the watermark into anchored groups"""
+        finalized = []
+        buffered = self.pending.get(entity_id, [])
+        groups = self.open_groups.pop(entity_id, [])
+
+        released = []
+        while buffered and buffered[0][0] <= self.watermark:
+            released.append(heapq.heappop(buffered))
+        if released:
+            self.frontier[entity_id] = released[-1][0]
+            self._sweep([timestamp for timestamp, _, _ in released], [event for _, _, event in released], groups)
+
+        # nothing can join a group once the watermark is past its window (plus allowed lateness);
+        # groups are in anchor order, so the ones past their deadline come first
+        while groups and groups[0]['anchor'] + self.window + self.allowed_lateness <= self.watermark:
+            self.closed_anchors[entity_id] = groups[0]['anchor']
+            finalized.extend(self._close(entity_id, groups.pop(0)))
+        if groups:
+            self.open_groups[entity_id] = groups
+            self._schedule(entity_id, groups[0]['anchor'] + self.window + self.allowed_lateness)
+
+        if buffered:
+            self._schedule(entity_id, buffered[0][0])
+        else:
+            self.pending.pop(entity_id, None)
+        return finalized
+
+    def _close(self, entity_id, group):
+        self.stats['groups'] += 1
+        if len(group['events']) < 2:
+            return []
+
+        self.stats['links'] += 1
+        if self.on_group:
+            self.on_group(entity_id, group['events'])
+        return [(entity_id, group['events'])]
+
+    def print_stats(self):
+        watermark = pd.Timestamp(self.watermark).isoformat() if self.watermark != NAT else None
+        print(f"Watermark {watermark}: {self.stats['links']} links from {self.stats['groups']} groups, "
+              f"{self.stats['late_merged']} late events merged, {self.stats['late_dropped']} too late "
+              f"{dict(self.late_counts)}, {sum(len(buffered) for buffered in self.pending.values())} buffered")
+
+# where run_streaming_ingestion appends finalized groups and too late events
+STREAMING_LINKS_PATH = 'streaming_links.jsonl'
+STREAMING_LATE_PATH = 'streaming_late_events.jsonl'
+
+# appends one JSON line per value to a file, so a long running stream keeps nothing in memory
+class JsonLinesSink:
+    def __init__(self, path, flush_every=1000):
+        self.path = path
+        self.flush_every = flush_every
+        self.count = 0
+        self._file = open(path, 'a')
+
+    def write(self, value):
+        self._file.write(json.dumps(value, default=str) + '\n')
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+def group_record(entity_id, events):
+    """JSON line of a finalized group, in the layout of the resolver's temporal cross links"""
+    sources = sorted(set(event['source'] for event in events))
+    return {
+        'entity_id': entity_id,
+        'type': 'temporal_correlation',
+        'sources': sources,
+        'timestamp': events[0]['timestamp'],
+        'activities': events,
+        'confidence': min(0.9, 0.7 + (len(sources) * 0.05)),
+        'provenance': 'inferred_temporal_pattern'
+    }
+
+# follow the raw files, correlating linked events as they arrive; links and too late events are
+# appended to files rather than kept on the resolver
+def run_streaming_ingestion(chunk_size=5000, poll_interval=1.0, links_path=STREAMING_LINKS_PATH,
+                            late_path=STREAMING_LATE_PATH):
+    from Entity_resolution_map_code_file import CompleteFixedEntityResolver
+
+    resolver = CompleteFixedEntityResolver({'profile': pd.read_csv('RAW_Data_folder/student or staff profiles.csv')})
+    resolver._build_complete_entity_maps()
+    ingestor = StreamingIngestor(resolver, chunk_size=chunk_size, poll_interval=poll_interval)
+    links, late = JsonLinesSink(links_path), JsonLinesSink(late_path)
+    correlator = EventTimeCorrelator(on_group=lambda entity_id, events: links.write(group_record(entity_id, events)),
+                                     on_late=late.write)
+
+    event_count = 0
+    try:
+        for event in ingestor.iter_events():
+            correlator.add(event)
+            event_count += 1
+            if event_count % chunk_size == 0:
+                ingestor.print_metrics()
+                correlator.print_stats()
+    except KeyboardInterrupt:
+        correlator.flush()
+        print(f"Stopped after {event_count} linked events, {links.count} links written to {links_path}")
+        ingestor.print_metrics()
+        correlator.print_stats()
+    finally:
+        links.close()
+        late.close()
+
+if __name__ == "__main__":
+    run_streaming_ingestion()
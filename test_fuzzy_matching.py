@@ -0,0 +1,14 @@
+from fuzzy_matching import FuzzyMatcher, name_blocking_keys
+
+def test_match_close_name():
+    matcher = FuzzyMatcher(['alice smith', 'bob jones'], ['E1', 'E2'], name_blocking_keys)
+    labels, scores = matcher.match(['alice smyth'])
+    assert labels.tolist() == ['E1']
+    assert scores[0] > 0.5
+
+# a batch where no mention shares a blocking key with any profile
+def test_batch_without_candidates():
+    matcher = FuzzyMatcher(['alice smith', 'bob jones'], ['E1', 'E2'], name_blocking_keys)
+    labels, scores = matcher.match(['zzz qqq'])
+    assert labels.tolist() == [None]
+    assert scores.tolist() == [0.0]
@@ -0,0 +1,31 @@
+from identity_graph import IdentityGraph
+
+# an identifier listed by two profiles merges them into one conflicted cluster
+def test_shared_identifier_conflicts():
+    graph = IdentityGraph([('E1', 'X'), ('E2', 'X'), ('E3', 'Z')])
+    assert graph.entity_of('X') is None
+    assert graph.entity_of('Z') == 'E3'
+    assert [conflict['merged'] for conflict in graph.conflicts] == [True]
+
+# evidence never resolves a conflicted cluster to the entity it is linked to
+def test_evidence_across_conflict_is_skipped():
+    graph = IdentityGraph([('E1', 'X'), ('E2', 'X'), ('E3', 'Z')])
+    merged = graph.add_evidence(['X', 'Y'], ['Y', 'Z'], [5, 5])
+    assert merged == 1
+    assert graph.entity_of('X') is None
+    assert graph.entity_of('Y') is None
+    assert graph.entity_of('Z') == 'E3'
+    assert graph.conflicts[-1] == {'identifiers': ['Y', 'Z'], 'entities': ['conflicted cluster', 'E3'], 'merged': False}
+
+# evidence joining two entities is skipped, the stronger link wins
+def test_evidence_between_entities():
+    graph = IdentityGraph([('E1', 'A'), ('E2', 'B')])
+    merged = graph.add_evidence(['C', 'C'], ['A', 'B'], [2, 7])
+    assert merged == 1
+    assert graph.entity_of('C') == 'E2'
+    assert graph.conflicts == [{'identifiers': ['C', 'A'], 'entities': ['E2', 'E1'], 'merged': False}]
+
+def test_resolved_identifiers():
+    graph = IdentityGraph([('E1', 'X'), ('E2', 'X'), ('E3', 'Z'), ('E4', 'W')])
+    graph.add_evidence(['W', 'Q'], ['V', 'X'], [3, 3])
+    assert graph.resolved_identifiers() == {'Z': 'E3', 'W': 'E4', 'V': 'E4'}